@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_item import CsvStorage, TrackLibrary
+from memory_benchmark import make_csv
+from playlist_store import PlaylistStore
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+# Timings only compare on the same machine, so no baseline is checked in: run once with
+# --save-baseline (same --sizes and --gui as later runs) before making changes, then
+# without it to see what got slower
+BASELINE_FILE = os.path.join(BENCHMARK_FOLDER, "baseline.json")
+RESULTS_FILE = os.path.join(BENCHMARK_FOLDER, "benchmark_results.json")
+# Timings this short are mostly noise, so they're reported but never fail the run
+NOISE_FLOOR_SECONDS = 0.001
+DEFAULT_SIZES = [1000, 10000, 100000]
+LOOKUPS = 10000
+# How long the GUI gets to finish loading and build its search index before timing starts
+GUI_STARTUP_TIMEOUT_SECONDS = 300
+SEARCH_QUERIES = ["track 12", "artist 3", "album", "pop", "nothing matches this"]
+
+def make_playlists(folder, track_count, playlist_count, playlist_size, seed=0):
+    # The original CSV layout (Track ID, Name, Artist), which PlaylistStore converts on first open
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for number in range(playlist_count):
+        with open(os.path.join(folder, f"Playlist {number}.csv"), "w", newline="", encoding="utf-8") as f:
+            f.write("Track ID,Name,Artist\n")
+            for track_id in rng.sample(range(1, track_count + 1), min(playlist_size, track_count)):
+                f.write(f"{track_id},Track {track_id},Artist\n")
+
+def timed(func, repeat, setup=None):
+    # Best of `repeat` runs; the minimum is the least noisy estimate of the real cost.
+    # setup runs before each one, outside the timing.
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def run_library_benchmarks(track_count, args):
+    results = {}
+    library = None
+
+    def load():
+        nonlocal library
+        library = TrackLibrary()
+        return len(library.tracks_by_id)
+
+    cache_file = CsvStorage().cache_file
+
+    def drop_cache():
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+
+    # Every load after the first would otherwise come from the pickle cache, so the CSV
+    # path and the cached one are timed separately
+    results["load_tracks cold"], loaded = timed(load, args.repeat, setup=drop_cache)
+    results["load_tracks cached"], _ = timed(load, args.repeat)
+    if loaded != track_count:
+        raise RuntimeError(f"Expected {track_count} tracks, loaded {loaded}")
+    results["save_tracks"], _ = timed(library.save_tracks, args.repeat)
+
+    rng = random.Random(1)
+    ids = [rng.randint(1, track_count) for _ in range(LOOKUPS)]
+    results[f"get_track_by_id x{LOOKUPS}"], _ = timed(lambda: [library.get_track_by_id(i) for i in ids], args.repeat)
+
+    results["search"], _ = timed(lambda: [library.search(query) for query in SEARCH_QUERIES], args.repeat)
+    results["filter_tracks"], _ = timed(lambda: library.filter_tracks(artist="Artist 1", genre=["Pop", "Jazz"]),
+                                        args.repeat)
+
+    tracks = library.list_all()
+    for order_by in ("name", "play_count"):
+        results[f"sort_tracks {order_by}"], _ = timed(lambda: library.sort_tracks(tracks, order_by), args.repeat)
+
+    def build_view():
+        library.sorted_views = {}
+        return library.sorted_tracks("rating")[:50]
+
+    results["sorted_tracks rating"], _ = timed(build_view, args.repeat)
+    results["top_tracks"], _ = timed(lambda: library.top_tracks(50), args.repeat)
+    return results
+
+def run_playlist_benchmarks(args):
+    results = {}
+    library = TrackLibrary()
+    # The first open converts the generated CSV playlists to the ID format
+    PlaylistStore("playlists").open()
+
+    def load_all():
+        store = PlaylistStore("playlists")
+        names = store.open()
+        return {name: [library.get_track_by_id(i) for i in store.get_ids(name)] for name in names}
+
+    results["open_playlists"], _ = timed(lambda: PlaylistStore("playlists").open(), args.repeat)
+    results["load_all_playlists"], _ = timed(load_all, args.repeat)
+
+    store = PlaylistStore("playlists")
+    store.open()
+    name = store.names()[0]
+    track_id = next(i for i in range(1, len(library.tracks_by_id) + 1) if i not in store.load(name))
+
+    def add_and_remove():
+        store.add(name, track_id)
+        store.flush(name)
+        store.remove(name, track_id)
+        store.flush(name)
+
+    results["playlist add+remove"], _ = timed(add_and_remove, args.repeat)
+    return results
+
+def run_gui_benchmark(args):
+    # Needs a display; run the whole script under xvfb-run on a headless machine
+    import tkinter as tk
+    from track_player import TrackPlayerGUI
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"Skipping GUI benchmark: {e}")
+        return None
+    root.withdraw()
+    app = TrackPlayerGUI(root)
+    app.track_library.ensure_loaded()
+
+    # Let startup finish before timing: the last chunk starts the search index build on
+    # index_io and the theme loads once idle, and neither belongs in view_tracks' time
+    deadline = time.monotonic() + GUI_STARTUP_TIMEOUT_SECONDS
+    try:
+        while app.track_library.search_index is None:
+            if time.monotonic() > deadline:
+                raise RuntimeError("The GUI didn't finish starting up")
+            root.update()
+            time.sleep(0.01)
+        root.update_idletasks()
+
+        def build():
+            app.view_tracks()
+            root.update_idletasks()
+
+        seconds, _ = timed(build, args.repeat)
+    finally:
+        # Same as closing the window: stops the background threads so the process can exit
+        app.on_close()
+    return seconds
+
+def run_size(track_count, args):
+    with tempfile.TemporaryDirectory() as folder:
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            with open("tracks_data.csv", "w", newline="", encoding="utf-8") as f:
+                f.write(make_csv(track_count))
+            make_playlists("playlists", track_count, args.playlists, args.playlist_size)
+
+            results = run_library_benchmarks(track_count, args)
+            results.update(run_playlist_benchmarks(args))
+            if args.gui:
+                gui_seconds = run_gui_benchmark(args)
+                if gui_seconds is not None:
+                    results["view_tracks"] = gui_seconds
+        finally:
+            os.chdir(cwd)
+    return results
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for size, operations in results.items():
+        for operation, seconds in operations.items():
+            previous = baseline.get(size, {}).get(operation)
+            if previous and seconds > NOISE_FLOOR_SECONDS and seconds > previous * (1 + tolerance):
+                regressions.append(f"{operation} @ {size} tracks: {previous * 1000:.2f} ms -> {seconds * 1000:.2f} ms "
+                                   f"({seconds / previous - 1:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the TrackLibrary and GUI hot paths on synthetic catalogues.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="catalogue sizes to test (up to 1000000)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--playlists", type=int, default=50)
+    parser.add_argument("--playlist-size", type=int, default=200)
+    parser.add_argument("--gui", action="store_true", help="also time view_tracks (needs a display or xvfb-run)")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="fail when an operation is this much slower than the baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for track_count in args.sizes:
+        print(f"{track_count} tracks")
+        results[str(track_count)] = run_size(track_count, args)
+        for operation, seconds in results[str(track_count)].items():
+            print(f"  {operation:<28} {seconds * 1000:10.2f} ms")
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --save-baseline first to create one")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"Slower than the baseline by more than {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"No operation is more than {args.tolerance:.0%} slower than the baseline")
+
+if __name__ == "__main__":
+    main()
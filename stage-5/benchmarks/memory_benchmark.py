@@ -0,0 +1,88 @@
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_item import LibraryItemAlbum
+from track_table import TrackTable
+
+# The original dict-backed classes, kept here as the baseline to compare against
+class DictLibraryItem:
+    def __init__(self, track_id, name, artist, rating, play_count=0, image_path=""):
+        self.track_id = track_id
+        self.name = name
+        self.artist = artist
+        self.rating = rating
+        self.play_count = play_count
+        self.image_path = image_path
+
+class DictLibraryItemAlbum(DictLibraryItem):
+    def __init__(self, track_id, name, artist, rating, play_count=0, image_path="", album="", release_year=0, genre="", track_number=0):
+        super().__init__(track_id, name, artist, rating, play_count, image_path)
+        self.album = album
+        self.release_year = release_year
+        self.genre = genre
+        self.track_number = track_number
+
+def make_csv(count, seed=0):
+    rng = random.Random(seed)
+    artists = [f"Artist {i}" for i in range(max(1, count // 50))]
+    genres = ["Pop", "K-Pop", "R&B", "Rock", "Hip-Hop", "Jazz"]
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["Track ID", "Name", "Artist", "Rating", "Play Count", "Image Path", "Album", "Release Year", "Genre", "Track Number"])
+    for track_id in range(1, count + 1):
+        artist = rng.choice(artists)
+        writer.writerow([track_id, f"Track {track_id}", artist, rng.randint(1, 5), rng.randint(0, 500),
+                         f"images/{track_id % 500}.png", f"{artist} Album {track_id % 7}",
+                         rng.randint(1990, 2024), rng.choice(genres), track_id % 12 + 1])
+    return out.getvalue()
+
+def parse_rows(text):
+    for row in csv.DictReader(io.StringIO(text)):
+        yield (int(row["Track ID"]), row["Name"], row["Artist"], int(row["Rating"]), int(row["Play Count"]),
+               row["Image Path"], row["Album"], int(row["Release Year"]), row["Genre"], int(row["Track Number"]))
+
+def build_dict_items(text):
+    return [DictLibraryItemAlbum(*fields) for fields in parse_rows(text)]
+
+def build_slotted_items(text):
+    return [LibraryItemAlbum(*fields) for fields in parse_rows(text)]
+
+def build_track_table(text):
+    table = TrackTable()
+    for fields in parse_rows(text):
+        table.add_row(*fields)
+    return table
+
+def measure(build, text):
+    tracemalloc.start()
+    result = build(text)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory used by each track representation.")
+    parser.add_argument("--tracks", type=int, default=100000)
+    args = parser.parse_args()
+
+    text = make_csv(args.tracks)
+    results = [
+        ("dict-backed classes", measure(build_dict_items, text)),
+        ("__slots__ classes", measure(build_slotted_items, text)),
+        ("columnar TrackTable", measure(build_track_table, text)),
+    ]
+    baseline = results[0][1]
+    print(f"{args.tracks} tracks")
+    for label, size in results:
+        print(f"{label:<22} {size / 1024 / 1024:8.1f} MiB  {size / args.tracks:7.0f} B/track  {size / baseline:6.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_item import parse_track_row
+from memory_benchmark import make_csv
+from search_index import SearchIndex
+
+# What people type into the search box: single words, short prefixes, a word and a number
+QUERIES = ["pop", "k pop", "a", "3", "album", "jazz", "track 12", "artist 3", "nothing matches this"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Time limited searches on a large synthetic catalogue.")
+    parser.add_argument("--tracks", type=int, default=500000)
+    parser.add_argument("--limit", type=int, default=50, help="results per search, like one page of the service")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=1.0,
+                        help="fail when any query's best time is slower than this")
+    args = parser.parse_args()
+
+    tracks = [parse_track_row(row) for row in csv.DictReader(io.StringIO(make_csv(args.tracks)))]
+    start = time.perf_counter()
+    index = SearchIndex(tracks)
+    built = time.perf_counter()
+    # The GUI does this on the thread that builds the index
+    index.prepare_short_terms()
+    prepared = time.perf_counter()
+    print(f"{args.tracks} tracks: index built in {built - start:.1f} s, short terms prepared in {prepared - built:.1f} s")
+
+    slow = []
+    for query in QUERIES:
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = index.search(query, args.limit)
+            times.append(time.perf_counter() - start)
+        best = min(times) * 1000
+        print(f"  {query!r:<24} {len(results):5} results {best:8.3f} ms (first run {times[0] * 1000:.3f} ms)")
+        if best > args.target_ms:
+            slow.append(query)
+    if slow:
+        print(f"Slower than {args.target_ms} ms: {', '.join(slow)}")
+        sys.exit(1)
+    print(f"Every query took under {args.target_ms} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_benchmark import make_csv
+from library_item import CsvStorage, TrackLibrary
+from library_service import LibraryService
+
+async def client(port, paths, batch_size):
+    # One kept-alive connection; with a batch size above 1 the paths go through POST /batch
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        if batch_size == 1:
+            head = f"GET {chunk[0]} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode()
+        else:
+            body = json.dumps({"requests": [{"path": path} for path in chunk]}).encode()
+            head = f"POST /batch HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+        writer.write(head)
+        response = await reader.readuntil(b"\r\n\r\n")
+        length = int(response.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+        await reader.readexactly(length)
+    writer.close()
+
+async def run(track_count, connections, requests, batch_size):
+    library = TrackLibrary(storage=CsvStorage("tracks_data.csv"))
+    service = LibraryService(library)
+    server = await service.start("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    paths = [random.choice([f"/tracks/{random.randint(1, track_count)}",
+                            f"/tracks?order_by=play_count&offset={random.randint(0, track_count - 20)}&limit=20",
+                            f"/search?q={random.randint(1000, track_count)}&limit=20"]) for _ in range(requests)]
+    per_connection = requests // connections
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, paths[i * per_connection:(i + 1) * per_connection], batch_size)
+                           for i in range(connections)))
+    elapsed = time.perf_counter() - start
+    await service.close()
+    return per_connection * connections / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure library_service.py requests per second.")
+    parser.add_argument("--tracks", type=int, default=20000)
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            with open("tracks_data.csv", "w", newline="", encoding="utf-8") as f:
+                f.write(make_csv(args.tracks))
+            for batch_size in (1, 50):
+                rate = asyncio.run(run(args.tracks, args.connections, args.requests, batch_size))
+                label = "one request per round trip" if batch_size == 1 else f"batches of {batch_size}"
+                print(f"{label:<28} {rate:10.0f} requests/s")
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_benchmark import make_csv
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter each time so nothing is already imported or cached
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {app_folder!r})
+import track_player
+from library_item import TrackLibrary
+imported = time.perf_counter()
+library = TrackLibrary(load=False)
+loader = library.start_loading()
+next(loader, None)
+first_chunk = time.perf_counter()
+library.ensure_loaded()
+loaded = time.perf_counter()
+result = {{"import": imported - start, "first_chunk": first_chunk - start, "library_ready": loaded - start}}
+if {gui!r}:
+    import tkinter as tk
+    root = tk.Tk()
+    app = track_player.TrackPlayerGUI(root)
+    def painted():
+        result["first_paint"] = time.perf_counter() - start
+        root.after(1, root.destroy)
+    root.after_idle(painted)
+    root.mainloop()
+print(json.dumps(result))
+"""
+
+def run_child(gui):
+    output = subprocess.run([sys.executable, "-c", CHILD_SCRIPT.format(app_folder=APP_FOLDER, gui=gui)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def best_of(runs):
+    return {key: min(run[key] for run in runs) for key in runs[0]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Time JukeBox startup with and without the track cache.")
+    parser.add_argument("--tracks", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--gui", action="store_true", help="also time the first paint (needs a display or xvfb-run)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            with open("tracks_data.csv", "w", newline="", encoding="utf-8") as f:
+                f.write(make_csv(args.tracks))
+            cold_runs = []
+            for _ in range(args.repeat):
+                if os.path.exists("tracks_data_cache.pickle"):
+                    os.remove("tracks_data_cache.pickle")
+                cold_runs.append(run_child(args.gui))
+            # The last cold run left a cache behind for the warm ones
+            warm_runs = [run_child(args.gui) for _ in range(args.repeat)]
+        finally:
+            os.chdir(cwd)
+
+    results = {"tracks": args.tracks, "cold": best_of(cold_runs), "warm": best_of(warm_runs)}
+    print(f"{args.tracks} tracks (best of {args.repeat})")
+    for step in results["cold"]:
+        print(f"  {step:<14} cold {results['cold'][step] * 1000:9.1f} ms   warm {results['warm'][step] * 1000:9.1f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from library_item import CSV_FIELDS, TrackLibrary, make_track
+from sqlite_storage import SqliteStorage, DATABASE_FILE
+
+BATCH_SIZE = 2000
+PROGRESS_EVERY = 20000
+REJECTS_FILE = "import_rejects.csv"
+# JSON-lines input may use the attribute names instead of the CSV headers
+JSON_KEYS = {
+    "track_id": "Track ID", "name": "Name", "artist": "Artist", "rating": "Rating", "play_count": "Play Count",
+    "image_path": "Image Path", "album": "Album", "release_year": "Release Year", "genre": "Genre",
+    "track_number": "Track Number",
+}
+
+def iter_input_rows(path):
+    # Yields (line number, row) from a CSV file. For .jsonl/.ndjson files the row is the
+    # line itself, so the JSON is decoded in the worker processes along with the checks.
+    if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_number, line.strip()
+        return
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+
+def text_field(row, field):
+    value = row.get(field)
+    return "" if value is None else str(value).strip()
+
+def number_field(row, field, required=False):
+    value = text_field(row, field)
+    if not value:
+        if required:
+            raise ValueError(f"{field} is required")
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{field} must be a whole number") from None
+
+def decode_json_row(line):
+    try:
+        row = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON: {e}") from None
+    if not isinstance(row, dict):
+        raise ValueError("Expected a JSON object")
+    return {JSON_KEYS.get(key, key): value for key, value in row.items()}
+
+def validate_row(row):
+    # The checks load_tracks and the Edit Track form make, returning the cleaned-up fields
+    # (without a track ID) or raising ValueError with the reason the row is rejected
+    if isinstance(row, str):
+        row = decode_json_row(row)
+    name = text_field(row, "Name")
+    artist = text_field(row, "Artist")
+    if not name:
+        raise ValueError("Name is required")
+    if not artist:
+        raise ValueError("Artist is required")
+    rating = number_field(row, "Rating", required=True)
+    if not 1 <= rating <= 5:
+        raise ValueError("Rating must be an integer between 1 and 5")
+    play_count = number_field(row, "Play Count")
+    if play_count < 0:
+        raise ValueError("Play Count can't be negative")
+    release_year = number_field(row, "Release Year")
+    current_year = datetime.date.today().year
+    if release_year and not 1900 <= release_year <= current_year:
+        raise ValueError(f"Release year must be between 1900 and {current_year}")
+    track_number = number_field(row, "Track Number")
+    if track_number < 0:
+        raise ValueError("Track Number can't be negative")
+    return (name, artist, rating, play_count, text_field(row, "Image Path"), text_field(row, "Album"),
+            release_year, text_field(row, "Genre"), track_number)
+
+def validate_batch(rows):
+    # Runs in the worker processes; returns (accepted, rejected) with line numbers kept for reporting
+    accepted = []
+    rejected = []
+    for line_number, row in rows:
+        try:
+            accepted.append((line_number, validate_row(row)))
+        except ValueError as e:
+            rejected.append((line_number, row, str(e)))
+    return accepted, rejected
+
+def duplicate_key(name, artist, album):
+    return (name.casefold(), artist.casefold(), album.casefold())
+
+def iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_validated(batches, workers):
+    # Results come back in input order. Only a few batches per worker are in flight at
+    # once, so a huge input is streamed rather than read into memory first. A single
+    # worker process would only add overhead, so that case validates in this process.
+    if workers <= 1:
+        for batch in batches:
+            yield validate_batch(batch)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.submit(validate_batch, batch))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.rows} rows: {self.imported} imported, {self.duplicates} duplicates, {self.rejected} rejected "
+                f"in {self.seconds:.1f}s ({self.rows_per_second:.0f} rows/s)")
+
+def import_tracks(library, path, rejects_path=REJECTS_FILE, workers=None, batch_size=BATCH_SIZE, progress=None):
+    # Validates rows in a process pool, skips any whose (name, artist, album) is already in
+    # the library or earlier in the input, and adds the rest with one write. Imported tracks
+    # get new IDs after the library's highest. Bad rows and duplicates go to the rejects
+    # file with the reason; progress, if given, is called with the report as rows come in.
+    library.ensure_loaded()
+    workers = os.cpu_count() or 1 if workers is None else workers
+    report = ImportReport()
+    start = time.perf_counter()
+    seen = {duplicate_key(track.name, track.artist, getattr(track, "album", ""))
+            for track in library.tracks_by_id.values()}
+    next_id = max(library.tracks_by_id, default=0) + 1
+    tracks = []
+
+    with open(rejects_path, "w", newline="", encoding="utf-8") as rejects_file:
+        rejects = csv.writer(rejects_file)
+        rejects.writerow(["Line", "Reason", "Row"])
+        next_progress = PROGRESS_EVERY
+        for accepted, rejected in iter_validated(iter_batches(iter_input_rows(path), batch_size), workers):
+            for line_number, row, reason in rejected:
+                rejects.writerow([line_number, reason, row if isinstance(row, str) else json.dumps(row, ensure_ascii=False)])
+            report.rejected += len(rejected)
+            for line_number, fields in accepted:
+                key = duplicate_key(fields[0], fields[1], fields[5])
+                if key in seen:
+                    rejects.writerow([line_number, "Duplicate of a track already in the library or this import",
+                                      json.dumps(dict(zip(CSV_FIELDS[1:], fields)), ensure_ascii=False)])
+                    report.duplicates += 1
+                    continue
+                seen.add(key)
+                tracks.append(make_track(next_id, *fields))
+                next_id += 1
+            report.imported = len(tracks)
+            report.rows += len(accepted) + len(rejected)
+            report.seconds = time.perf_counter() - start
+            if progress is not None and report.rows >= next_progress:
+                progress(report)
+                next_progress += PROGRESS_EVERY
+
+    library.add_tracks(tracks)
+    if not library.autosave:
+        library.flush()
+    report.seconds = time.perf_counter() - start
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a large CSV or JSON-lines catalogue into the JukeBox library.")
+    parser.add_argument("input", help="a CSV file with tracks_data.csv's columns, or a .jsonl file")
+    parser.add_argument("--rejects", default=REJECTS_FILE, help="where to write rows that weren't imported")
+    parser.add_argument("--workers", type=int, default=None, help="validation processes (default: one per CPU; 1 validates in this process)")
+    args = parser.parse_args()
+
+    # Use the SQLite library once it has been imported with sqlite_storage.py, like the GUI
+    storage = SqliteStorage() if os.path.exists(DATABASE_FILE) else None
+    library = TrackLibrary(storage=storage)
+    library.autosave = False
+    report = import_tracks(library, args.input, args.rejects, args.workers, progress=lambda r: print(f"  {r}"))
+    print(report)
+    if report.rejected or report.duplicates:
+        print(f"Rows that weren't imported are listed in {args.rejects}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+class FieldIndex:
+    # Maps each value of one track attribute to the IDs of the tracks that have it
+    def __init__(self, key):
+        self.key = key
+        self.ids_by_value = {}
+        self.value_by_id = {}
+
+    def add_track(self, track):
+        value = self.key(track)
+        self.value_by_id[track.track_id] = value
+        self.ids_by_value.setdefault(value, set()).add(track.track_id)
+
+    def remove_track(self, track_id):
+        if track_id not in self.value_by_id:
+            return
+        value = self.value_by_id.pop(track_id)
+        ids = self.ids_by_value[value]
+        ids.discard(track_id)
+        if not ids:
+            del self.ids_by_value[value]
+
+    def update_track(self, track):
+        self.remove_track(track.track_id)
+        self.add_track(track)
+
+    def get(self, value):
+        return self.ids_by_value.get(value, set())
+
+    def values(self):
+        # Blank values (no genre, unknown year) aren't worth offering as filters
+        return sorted(value for value in self.ids_by_value if value not in ("", 0))
+
+def release_year(track):
+    year = getattr(track, "release_year", 0)
+    return int(year) if str(year).isdigit() else 0
+
+def release_decade(track):
+    return release_year(track) // 10 * 10
+
+# The fields tracks can be filtered on, shared by TrackLibrary's indexes and TrackPager's scans
+FILTER_FIELDS = {
+    "artist": lambda track: track.artist,
+    "genre": lambda track: getattr(track, "genre", ""),
+    "album": lambda track: getattr(track, "album", ""),
+    "decade": release_decade,
+}
+
+def wanted_values(wanted):
+    # A criterion is a value or a collection of values, any of which may match
+    return wanted if isinstance(wanted, (list, tuple, set, frozenset)) else (wanted,)
+
+def matches_criteria(track, criteria):
+    return all(wanted is None or FILTER_FIELDS[field](track) in wanted_values(wanted)
+               for field, wanted in criteria.items())
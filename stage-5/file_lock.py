@@ -0,0 +1,62 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no flock; msvcrt only offers exclusive locks, which readers use too
+    fcntl = None
+    import msvcrt
+
+class FileLock:
+    # Advisory lock shared between processes through a lock file. Readers can share it,
+    # writers get it to themselves. It's re-entrant within a process, and threads in the
+    # same process take turns. A write can't be nested inside a read: converting the lock
+    # isn't atomic with flock, so another writer could get in between and whatever was read
+    # under the shared lock would be stale. Take it exclusively before reading instead.
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.fd = None
+        self.depth = 0
+        self.exclusive = False
+
+    @contextmanager
+    def __call__(self, shared=False):
+        with self.thread_lock:
+            if self.depth == 0:
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self.lock_fd(shared)
+                self.exclusive = not shared
+            elif not shared and not self.exclusive:
+                raise RuntimeError(f"{self.path} is held shared; take it exclusively from the start to write")
+            self.depth += 1
+            try:
+                yield
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.unlock_fd()
+                    os.close(self.fd)
+                    self.fd = None
+
+    def lock_fd(self, shared):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            return
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after ten seconds; keep waiting like flock does
+                continue
+
+    def unlock_fd(self):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
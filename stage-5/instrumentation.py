@@ -0,0 +1,146 @@
+import functools
+import os
+import threading
+import time
+
+# Latency buckets grow by powers of two from 1 µs, so a histogram is a short list of counts
+FIRST_BUCKET_SECONDS = 1e-6
+BUCKET_COUNT = 32
+LAG_SAMPLE_MS = 100
+
+class OperationStats:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKET_COUNT
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        bucket = 0
+        limit = FIRST_BUCKET_SECONDS
+        while seconds > limit and bucket < BUCKET_COUNT - 1:
+            limit *= 2
+            bucket += 1
+        self.buckets[bucket] += 1
+
+    def percentile(self, fraction):
+        # Upper edge of the bucket the percentile falls in, capped at the slowest call seen
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(FIRST_BUCKET_SECONDS * 2 ** bucket, self.max)
+        return self.max
+
+class Instrumentation:
+    # Off by default; while off, a timed call costs one attribute check
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.profiler = None
+
+    def record(self, name, seconds):
+        with self.lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats()
+            stats.add(seconds)
+
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def measure(self, name):
+        return Measurement(self, name)
+
+    def summary(self):
+        with self.lock:
+            return sorted((name, stats.count, stats.percentile(0.5), stats.percentile(0.99), stats.max)
+                          for name, stats in self.operations.items())
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+
+    def start_profile(self):
+        # cProfile is only imported when a profile is actually taken
+        import cProfile
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_profile(self, path):
+        # Saves the profile for snakeviz/pstats
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        self.profiler.dump_stats(path)
+        self.profiler = None
+
+class Measurement:
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if self.instrumentation.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.instrumentation.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class EventLoopLagMonitor:
+    # Schedules a callback every LAG_SAMPLE_MS and records how late it actually ran
+    def __init__(self, root, instrumentation, interval_ms=LAG_SAMPLE_MS):
+        self.root = root
+        self.instrumentation = instrumentation
+        self.interval_ms = interval_ms
+        self.after_id = None
+        self.expected = None
+
+    def start(self):
+        if self.after_id is None:
+            self.schedule()
+
+    def schedule(self):
+        self.expected = time.perf_counter() + self.interval_ms / 1000
+        self.after_id = self.root.after(self.interval_ms, self.sample)
+
+    def sample(self):
+        self.instrumentation.record("tk event loop lag", max(0.0, time.perf_counter() - self.expected))
+        self.schedule()
+
+    def stop(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+# Shared by the library and the GUI; set JUKEBOX_PROFILE=1 to record from startup
+instrumentation = Instrumentation(enabled=os.environ.get("JUKEBOX_PROFILE") == "1")
+timed = instrumentation.timed
+measure = instrumentation.measure
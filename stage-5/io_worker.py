@@ -0,0 +1,81 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+POLL_INTERVAL_MS = 50
+COALESCE_DELAY_MS = 500
+
+class IOExecutor:
+    # Runs disk work on background threads. Tk isn't thread-safe, so results are
+    # queued and handed back to callbacks on the main loop by polling with root.after.
+    def __init__(self, root, max_workers=1):
+        self.root = root
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jukebox-io")
+        self.results = queue.Queue()
+        self.pending = {}
+        self.closed = False
+        self.root.after(POLL_INTERVAL_MS, self.poll)
+
+    def submit(self, func, *args, callback=None, error_callback=None):
+        future = self.pool.submit(func, *args)
+        future.add_done_callback(lambda f: self.results.put((f, callback, error_callback)))
+        return future
+
+    def submit_coalesced(self, key, func, *args, callback=None, error_callback=None, delay_ms=COALESCE_DELAY_MS):
+        # Requests with the same key that arrive within delay_ms of each other
+        # collapse into one call, using the arguments from the latest request
+        self.cancel(key)
+        after_id = self.root.after(delay_ms, lambda: self.run_pending(key))
+        self.pending[key] = (after_id, func, args, callback, error_callback)
+
+    def cancel(self, key):
+        if key in self.pending:
+            self.root.after_cancel(self.pending.pop(key)[0])
+
+    def run_pending_now(self, key):
+        if key in self.pending:
+            self.root.after_cancel(self.pending[key][0])
+            self.run_pending(key)
+
+    def run_pending(self, key):
+        _, func, args, callback, error_callback = self.pending.pop(key)
+        self.submit(func, *args, callback=callback, error_callback=error_callback)
+
+    def poll(self):
+        while True:
+            try:
+                future, callback, error_callback = self.results.get_nowait()
+            except queue.Empty:
+                break
+            error = future.exception()
+            if error is not None:
+                if error_callback:
+                    error_callback(error)
+                else:
+                    print(f"Background task failed: {error}")
+            elif callback:
+                callback(future.result())
+        if not self.closed:
+            self.root.after(POLL_INTERVAL_MS, self.poll)
+
+    def flush(self):
+        # Called on shutdown: finish what's running, then run anything still waiting
+        # to be coalesced right here so no update is lost
+        self.closed = True
+        self.pool.shutdown(wait=True)
+        for key in list(self.pending):
+            after_id, func, args, _, _ = self.pending.pop(key)
+            self.root.after_cancel(after_id)
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Background task failed: {e}")
+        while not self.results.empty():
+            future, _, _ = self.results.get_nowait()
+            if future.exception() is not None:
+                print(f"Background task failed: {future.exception()}")
+
+    def shutdown(self):
+        self.closed = True
+        for key in list(self.pending):
+            self.cancel(key)
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -1,9 +1,28 @@
+import bisect
 import csv
 import os
+import pickle
+import threading
+from collections import Counter
+from itertools import islice
+from file_lock import FileLock
+from field_index import FieldIndex, FILTER_FIELDS, wanted_values
+from instrumentation import timed
+from search_index import SearchIndex
+from sorted_view import SortedTracks, SortedView, decode_cursor, encode_cursor
 
 DATA_FILE = "tracks_data.csv"
+JOURNAL_COMPACT_LIMIT = 500
+LOAD_CHUNK_SIZE = 2000
+# Bump when the cached row layout changes so old caches are rebuilt from the CSV
+CACHE_VERSION = 2
+
+ALBUM_FIELDS = ("album", "release_year", "genre", "track_number")
+CSV_FIELDS = ["Track ID", "Name", "Artist", "Rating", "Play Count", "Image Path", "Album", "Release Year", "Genre", "Track Number"]
 
 class LibraryItem:
+    __slots__ = ("track_id", "name", "artist", "rating", "play_count", "image_path")
+
     def __init__(self, track_id, name, artist, rating, play_count=0, image_path=""):
         self.track_id = track_id
         self.name = name
@@ -24,6 +43,8 @@ class LibraryItem:
         self.play_count += 1
 
 class LibraryItemAlbum(LibraryItem):
+    __slots__ = ALBUM_FIELDS
+
     def __init__(self, track_id, name, artist, rating, play_count=0, image_path="", album="", release_year=0, genre="", track_number=0):
         super().__init__(track_id, name, artist, rating, play_count, image_path)
         self.album = album  
@@ -38,69 +59,846 @@ class LibraryItemAlbum(LibraryItem):
     def get_album_info(self):
         return f"Album: {self.album}, Released: {self.release_year}, Genre: {self.genre}"
 
+def parse_track_row(row):
+    track_id = int(row["Track ID"])
+    name = row["Name"]
+    artist = row["Artist"]
+    rating = int(row["Rating"])
+    play_count = int(row["Play Count"])
+    image_path = row["Image Path"].strip() if "Image Path" in row else ""
+    album = row["Album"].strip() if "Album" in row else ""
+    release_year = int(row["Release Year"]) if row["Release Year"].isdigit() else 0
+    genre = row["Genre"].strip() if "Genre" in row else ""
+    track_number = int(row["Track Number"]) if row["Track Number"].isdigit() else 0
+
+    if album:
+        return LibraryItemAlbum(track_id, name, artist, rating, play_count, image_path, album, release_year, genre, track_number)
+    return LibraryItem(track_id, name, artist, rating, play_count, image_path)
+
+def iter_track_chunks(path, chunk_size=LOAD_CHUNK_SIZE):
+    chunk = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                chunk.append(parse_track_row(row))
+            except ValueError:
+                print(f"Skipping invalid row: {row}")
+                continue
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+TRACK_FIELDS = LibraryItem.__slots__ + ALBUM_FIELDS
+
+def track_fields(track):
+    if isinstance(track, LibraryItemAlbum):
+        return (track.track_id, track.name, track.artist, track.rating, track.play_count, track.image_path,
+                track.album, track.release_year, track.genre, track.track_number)
+    return (track.track_id, track.name, track.artist, track.rating, track.play_count, track.image_path, "", "", "", "")
+
+def make_track(track_id, name, artist, rating, play_count=0, image_path="", album="", release_year=0, genre="", track_number=0):
+    if album:
+        return LibraryItemAlbum(track_id, name, artist, rating, play_count, image_path, album, release_year or 0, genre, track_number or 0)
+    return LibraryItem(track_id, name, artist, rating, play_count, image_path)
+
+class ConcurrentModificationError(RuntimeError):
+    pass
+
+class StorageChanges:
+    # What other processes saved since a storage last looked: the journal entries they added,
+    # or the whole library (tracks) when it has to be read again. base is where the storage's
+    # own bookkeeping stood when they were read, so the same changes can't be applied twice.
+    def __init__(self, base, version, tracks=None, entries=(), journal_offset=0, journal_size=0):
+        self.base = base
+        self.version = version
+        self.tracks = tracks
+        self.entries = entries
+        self.journal_offset = journal_offset
+        self.journal_size = journal_size
+
+def apply_journal_entry(tracks_by_id, row):
+    try:
+        track = tracks_by_id.get(int(row["Track ID"]))
+        if not track:
+            return None
+        if row["Field"] == "Play Count":
+            track.play_count += int(row["Value"])
+        elif row["Field"] == "Rating":
+            track.rating = int(row["Value"])
+        return track.track_id
+    except (ValueError, TypeError):
+        print(f"Skipping invalid journal entry: {row}")
+        return None
+
+def copy_track(target, source):
+    for cls in type(source).__mro__:
+        for attribute in getattr(cls, "__slots__", ()):
+            setattr(target, attribute, getattr(source, attribute))
+
+def iter_cached_chunks(rows, chunk_size=LOAD_CHUNK_SIZE):
+    for start in range(0, len(rows), chunk_size):
+        yield [make_track(*fields) for fields in rows[start:start + chunk_size]]
+
+class CsvStorage:
+    # tracks_data.csv is the snapshot; plays and rating changes go to an append-only
+    # journal next to it until TrackLibrary folds them back in with save_tracks.
+    #
+    # Several processes can share the files. Writes happen under an exclusive lock on
+    # tracks_data.lock, and each one bumps the (snapshot, write) counter in the version
+    # file. A process only writes if the counter is still what it last saw; otherwise
+    # it first catches up with read_changes.
+    supports_row_updates = False
+
+    def __init__(self, path=None):
+        self.path = path or DATA_FILE
+        base = os.path.splitext(self.path)[0]
+        self.journal_file = base + "_journal.csv"
+        # Parsed rows of the CSV, pickled for a faster warm start
+        self.cache_file = base + "_cache.pickle"
+        self.locked = FileLock(base + ".lock")
+        self.version_file = base + "_version.txt"
+        self.version = None
+        self.load_version = None
+        self.journal_offset = 0
+        self.journal_size = 0
+
+    def read_version(self):
+        try:
+            with open(self.version_file, encoding="utf-8") as f:
+                snapshot, writes = f.read().split()
+            return int(snapshot), int(writes)
+        except FileNotFoundError:
+            return 0, 0
+        except (OSError, ValueError):
+            # Unreadable means someone was cut off mid-write; nobody will match it, so all reload
+            return -1, -1
+
+    def bump_version(self, new_snapshot):
+        snapshot, writes = self.version or (0, 0)
+        self.version = (snapshot + 1 if new_snapshot else snapshot, writes + 1)
+        with open(self.version_file, "w", encoding="utf-8") as f:
+            f.write(f"{self.version[0]} {self.version[1]}\n")
+
+    def check_version(self):
+        if self.read_version() != (self.version or (0, 0)):
+            raise ConcurrentModificationError(f"{self.path} was changed by another process; call read_changes first")
+
+    def load_chunks(self, chunk_size=LOAD_CHUNK_SIZE):
+        with self.locked(shared=True):
+            self.load_version = self.read_version()
+        yield from self.read_chunks(chunk_size)
+
+    def read_chunks(self, chunk_size=LOAD_CHUNK_SIZE):
+        if not os.path.exists(self.path):
+            return
+        rows = self.read_cache()
+        if rows is not None:
+            yield from iter_cached_chunks(rows, chunk_size)
+            return
+        # The CSV can be replaced while it's being read, so the cache is only written if it's
+        # still the file that was opened
+        source = self.csv_signature()
+        tracks = []
+        for chunk in iter_track_chunks(self.path, chunk_size):
+            tracks.extend(chunk)
+            yield chunk
+        if self.csv_signature() == source:
+            self.write_cache(tracks, source)
+
+    def csv_signature(self):
+        # A replaced file gets a new inode even if its size and timestamp happen to match
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def read_cache(self):
+        # The cache only counts if it was made from the CSV exactly as it is now
+        try:
+            with open(self.cache_file, "rb") as f:
+                cache = pickle.load(f)
+            if cache["version"] == CACHE_VERSION and cache["source"] == self.csv_signature():
+                return cache["rows"]
+        except FileNotFoundError:
+            pass
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError) as e:
+            print(f"Ignoring track cache: {e}")
+        return None
+
+    def write_cache(self, tracks, source):
+        try:
+            # Readers write the cache outside the file lock, so each process needs its own temp file
+            temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(temp_file, "wb") as f:
+                pickle.dump({"version": CACHE_VERSION, "source": source,
+                             "rows": [track_fields(track) for track in tracks]}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, self.cache_file)
+        except OSError as e:
+            print(f"Could not write track cache: {e}")
+
+    def finish_load(self, tracks_by_id):
+        with self.locked(shared=True):
+            entries, self.journal_offset, self.journal_size = self.read_journal(0)
+            for entry in entries:
+                apply_journal_entry(tracks_by_id, entry)
+            self.version = self.read_version()
+            if self.version[0] != self.load_version[0]:
+                # The CSV was replaced while it was being read; the next write reloads it
+                self.version = None
+
+    def changes_base(self):
+        return self.version, self.journal_offset
+
+    def read_changes(self):
+        # What other processes saved since we last looked, or None if nothing: the journal
+        # entries they added, or the whole library again if the snapshot was replaced.
+        # Nothing is applied here (see TrackLibrary.apply_changes). Call with the lock held.
+        version = self.read_version()
+        if version == self.version:
+            return None
+        if self.version is None or version[0] != self.version[0]:
+            return self.read_snapshot(version)
+        entries, journal_offset, count = self.read_journal(self.journal_offset)
+        return StorageChanges(self.changes_base(), version, entries=entries, journal_offset=journal_offset,
+                              journal_size=self.journal_size + count)
+
+    def read_snapshot(self, version):
+        # The library as it is on disk now, journal included, in new track objects
+        tracks_by_id = {track.track_id: track for chunk in self.read_chunks() for track in chunk}
+        entries, journal_offset, journal_size = self.read_journal(0)
+        for entry in entries:
+            apply_journal_entry(tracks_by_id, entry)
+        return StorageChanges(self.changes_base(), version, tracks=tracks_by_id, journal_offset=journal_offset,
+                              journal_size=journal_size)
+
+    def accept_changes(self, changes):
+        # Moves our bookkeeping on to where changes left off, or returns False if it moved since
+        # they were read (we wrote, or newer changes were accepted), as they'd then count twice
+        if changes.base != self.changes_base():
+            return False
+        self.version = changes.version
+        self.journal_offset = changes.journal_offset
+        self.journal_size = changes.journal_size
+        return True
+
+    def read_journal(self, offset):
+        # Returns the entries from offset on, the offset to carry on from and the entry count.
+        # It stops after the last committed batch, so an append still in progress is picked
+        # up by the next call instead.
+        entries = []
+        if not os.path.exists(self.journal_file):
+            return entries, offset, 0
+        with open(self.journal_file, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        batch = []
+        position = offset
+        for line in data.splitlines(keepends=True):
+            position += len(line)
+            if not line.endswith(b"\n"):
+                break
+            row = next(csv.reader([line.decode("utf-8")]), None)
+            if not row or len(row) != 3 or row[1] == "Field":
+                continue
+            # Entries only count once their batch's Commit row made it to disk
+            if row[1] != "Commit":
+                batch.append(dict(zip(("Track ID", "Field", "Value"), row)))
+                continue
+            entries.extend(batch)
+            offset = position
+            batch = []
+        return entries, offset, len(entries)
+
+    def append_journal(self, entries):
+        with self.locked():
+            self.check_version()
+            write_header = not os.path.exists(self.journal_file)
+            with open(self.journal_file, "a", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                if write_header:
+                    writer.writerow(["Track ID", "Field", "Value"])
+                writer.writerows(entries)
+                writer.writerow(["", "Commit", len(entries)])
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_offset = os.path.getsize(self.journal_file)
+            self.journal_size += len(entries)
+            self.bump_version(new_snapshot=False)
+
+    def record_plays(self, play_counts):
+        self.append_journal([(track_id, "Play Count", count) for track_id, count in play_counts.items()])
+
+    def set_rating(self, track_id, rating):
+        self.set_ratings({track_id: rating})
+
+    def set_ratings(self, ratings):
+        self.append_journal([(track_id, "Rating", rating) for track_id, rating in ratings.items()])
+
+    def save_tracks(self, tracks):
+        # Write the snapshot to a temporary file first so a crash mid-write can't
+        # leave a truncated library behind, then drop the journal it now contains
+        with self.locked():
+            self.check_version()
+            temp_file = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_file, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(CSV_FIELDS)
+                writer.writerows(track_fields(track) for track in tracks)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.path)
+            self.write_cache(tracks, self.csv_signature())
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self.journal_size = 0
+            self.journal_offset = 0
+            self.bump_version(new_snapshot=True)
+
 class TrackLibrary:
-    def __init__(self):
-        self.tracks = self.load_tracks()
+    def __init__(self, load=True, storage=None, history=None, playlists=None):
+        # Tracks are keyed by ID so lookups and removals don't scan the whole library
+        self.tracks_by_id = {}
+        self.reset_indexes()
+        self.storage = storage or CsvStorage()
+        self.history = history
+        # A PlaylistStore; tracks removed from the library are taken out of its playlists too
+        self.playlists = playlists
+        self.pending_load = None
+
+        # With autosave off, changes are only kept in memory until flush() is called,
+        # which lets the GUI batch them up and write them from a background thread
+        self.autosave = True
+        self.changes_lock = threading.RLock()
+        self.pending_plays = Counter()
+        self.pending_ratings = {}
+        self.dirty_ids = set()
+        # track_id -> the fields edited here, for dirty tracks that are also on disk; a dirty
+        # track with no entry (e.g. a new one) is written whole
+        self.edited_fields = {}
+        self.removed_ids = set()
+        if load:
+            self.load_tracks()
 
+    @property
+    def tracks(self):
+        return list(self.tracks_by_id.values())
+
+    @timed("library.load_tracks")
     def load_tracks(self):
-        tracks = []
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        track_id = int(row["Track ID"])
-                        name = row["Name"]
-                        artist = row["Artist"]
-                        rating = int(row["Rating"])
-                        play_count = int(row["Play Count"])
-                        image_path = row["Image Path"].strip() if "Image Path" in row else ""
-                        album = row["Album"].strip() if "Album" in row else ""
-                        release_year = int(row["Release Year"]) if row["Release Year"].isdigit() else 0
-                        genre = row["Genre"].strip() if "Genre" in row else ""
-                        track_number = int(row["Track Number"]) if row["Track Number"].isdigit() else 0
-
-                        if album:  
-                            tracks.append(LibraryItemAlbum(track_id, name, artist, rating, play_count, image_path, album, release_year, genre, track_number))
-                        else:  
-                            tracks.append(LibraryItem(track_id, name, artist, rating, play_count, image_path))
-                    except ValueError:
-                        print(f"Skipping invalid row: {row}")
-        return tracks
+        for _ in self.iter_load():
+            pass
+        return self.tracks
+
+    def iter_load(self, chunk_size=LOAD_CHUNK_SIZE):
+        # Tracks become available chunk by chunk, so callers can show the first ones straight away
+        self.tracks_by_id = {}
+        self.reset_indexes()
+        for chunk in self.storage.load_chunks(chunk_size):
+            for track in chunk:
+                self.tracks_by_id[track.track_id] = track
+                self.index_track(track)
+            yield chunk
+        self.storage.finish_load(self.tracks_by_id)
+        # The journal may have changed play counts and ratings, so sorted views start afresh
+        self.sorted_views = {}
+        if self.history is not None and self.history.log is None:
+            self.history.open(lambda track_id: getattr(self.tracks_by_id.get(track_id), "artist", None))
+        self.pending_load = None
+
+    def reset_indexes(self):
+        # The search index is the slowest to build, so it waits for the first search
+        # (or see start_search_index)
+        self.search_index = None
+        self.search_index_changes = None
+        self.field_indexes = {field: FieldIndex(key) for field, key in FILTER_FIELDS.items()}
+        # Built the first time each sort order is asked for, then kept up to date
+        self.sorted_views = {}
+
+    def index_track(self, track):
+        if self.search_index is not None:
+            self.search_index.update_track(track)
+        elif self.search_index_changes is not None:
+            self.search_index_changes[track.track_id] = track
+        for index in self.field_indexes.values():
+            index.update_track(track)
+        self.update_sorted_views(track)
+
+    def unindex_track(self, track_id):
+        if self.search_index is not None:
+            self.search_index.remove_track(track_id)
+        elif self.search_index_changes is not None:
+            self.search_index_changes[track_id] = None
+        for index in self.field_indexes.values():
+            index.remove_track(track_id)
+        for view in self.sorted_views.values():
+            view.remove_track(track_id)
+
+    def update_sorted_views(self, track):
+        for view in self.sorted_views.values():
+            view.update_track(track)
+
+    @timed("library.get_sorted_view")
+    def get_sorted_view(self, order_by):
+        if order_by not in self.sorted_views:
+            self.sorted_views[order_by] = SortedView(order_by, self.tracks_by_id.values())
+        return self.sorted_views[order_by]
+
+    def sorted_tracks(self, order_by):
+        return SortedTracks(self.get_sorted_view(order_by), self.tracks_by_id)
+
+    @timed("library.top_tracks")
+    def top_tracks(self, limit=50, by="play_count"):
+        # The sorted view is already in order, so this only reads the first `limit` entries
+        return self.sorted_tracks(by)[:limit]
+
+    @timed("library.sort_tracks")
+    def sort_tracks(self, tracks, order_by):
+        view = self.get_sorted_view(order_by)
+        return sorted(tracks, key=lambda track: view.sort_key(track.track_id))
 
+    def refresh(self):
+        # Picks up what other processes saved since we last wrote or looked; True if anything changed
+        self.ensure_loaded()
+        return self.apply_changes(self.fetch_changes())
+
+    def fetch_changes(self):
+        # Reads what other processes saved without touching our tracks, so it can run on a
+        # background thread; the result goes to apply_changes on the thread that reads them
+        with self.storage.locked(shared=True):
+            return self.storage.read_changes()
+
+    def sync_with_storage(self):
+        # Call with the storage lock held
+        return self.apply_changes(self.storage.read_changes())
+
+    def apply_changes(self, changes):
+        # Our own unsaved changes stay on top of what's on disk. Changes that were overtaken
+        # (we wrote since, or newer ones were applied) are dropped; the next fetch reads them again.
+        if changes is None:
+            return False
+        with self.storage.locked(shared=True), self.changes_lock:
+            if not self.storage.accept_changes(changes):
+                return False
+            if changes.tracks is not None:
+                self.merge_tracks(changes.tracks)
+                return True
+            changed_ids = {apply_journal_entry(self.tracks_by_id, entry) for entry in changes.entries}
+            changed_ids.discard(None)
+            for track_id in changed_ids:
+                track = self.tracks_by_id[track_id]
+                track.rating = self.pending_ratings.get(track_id, track.rating)
+                self.update_sorted_views(track)
+            return bool(changed_ids)
+
+    def merge_tracks(self, saved_tracks):
+        # Existing track objects are updated in place, so views holding them stay current
+        for track_id in [track_id for track_id in self.tracks_by_id if track_id not in saved_tracks]:
+            if track_id not in self.dirty_ids:
+                self.tracks_by_id.pop(track_id)
+                self.unindex_track(track_id)
+                self.pending_plays.pop(track_id, None)
+                self.pending_ratings.pop(track_id, None)
+        for track_id, saved in saved_tracks.items():
+            if track_id in self.removed_ids:
+                continue
+            saved.play_count += self.pending_plays[track_id]
+            saved.rating = self.pending_ratings.get(track_id, saved.rating)
+            track = self.tracks_by_id.get(track_id)
+            if track_id in self.dirty_ids:
+                if track is not None and track_id in self.edited_fields:
+                    self.merge_edited_track(track, saved, self.edited_fields[track_id])
+                continue
+            if track is not None and type(track) is type(saved):
+                if track_fields(track) == track_fields(saved):
+                    continue
+                copy_track(track, saved)
+            else:
+                track = self.tracks_by_id[track_id] = saved
+            self.index_track(track)
+
+    def merge_edited_track(self, track, saved, edited):
+        # Only the fields edited here are ours; the rest, play counts and ratings included,
+        # come from disk so other processes' plays aren't written over
+        before = track_fields(track)
+        for field in TRACK_FIELDS:
+            if field not in edited and hasattr(track, field) and hasattr(saved, field):
+                setattr(track, field, getattr(saved, field))
+        if track_fields(track) != before:
+            self.index_track(track)
+
+    def start_loading(self, chunk_size=LOAD_CHUNK_SIZE):
+        self.pending_load = self.iter_load(chunk_size)
+        return self.pending_load
+
+    def ensure_loaded(self):
+        # Writing out a half-loaded library would drop the tracks not read yet
+        if self.pending_load is not None:
+            for _ in self.pending_load:
+                pass
+
+    @timed("library.compact_journal")
+    def compact_journal(self):
+        self.ensure_loaded()
+        if self.storage.journal_size:
+            self.save_tracks()
+
+    def check_journal_size(self):
+        if self.storage.journal_size >= JOURNAL_COMPACT_LIMIT:
+            self.compact_journal()
+
+    def record_play(self, track):
+        self.record_plays([track.track_id])
+
+    def count_plays(self, track_ids):
+        play_counts = Counter(track_ids)
+        unknown_ids = [track_id for track_id in play_counts if track_id not in self.tracks_by_id]
+        if unknown_ids:
+            raise ValueError(f"Unknown track ID(s): {', '.join(map(str, unknown_ids))}")
+        return play_counts
+
+    @timed("library.record_plays")
+    def record_plays(self, track_ids):
+        # All the plays are written in one go; if any ID is unknown or the write
+        # fails, no play counts change
+        self.ensure_loaded()
+        play_counts = self.count_plays(track_ids)
+        if not play_counts:
+            return
+
+        with self.storage.locked(), self.changes_lock:
+            self.sync_with_storage()
+            self.storage.record_plays(play_counts)
+            for track_id, count in play_counts.items():
+                self.tracks_by_id[track_id].play_count += count
+                self.update_sorted_views(self.tracks_by_id[track_id])
+        self.log_plays(play_counts)
+        if self.history is not None:
+            self.history.flush()
+        self.check_journal_size()
+
+    @timed("library.queue_plays")
+    def queue_plays(self, track_ids):
+        # Like record_plays, but the write waits for the next flush()
+        self.ensure_loaded()
+        play_counts = self.count_plays(track_ids)
+        with self.changes_lock:
+            for track_id, count in play_counts.items():
+                self.tracks_by_id[track_id].play_count += count
+                self.update_sorted_views(self.tracks_by_id[track_id])
+            self.pending_plays.update(play_counts)
+        self.log_plays(play_counts)
+        if self.autosave:
+            self.flush()
+
+    def log_plays(self, play_counts):
+        if self.history is not None:
+            self.history.record(play_counts, {track_id: self.tracks_by_id[track_id].artist for track_id in play_counts})
+
+    def plays_in_last(self, days=7, track=None, artist=None):
+        if self.history is None:
+            return 0
+        return self.history.plays_in_last(days, track_id=track.track_id if track else None, artist=artist)
+
+    @timed("library.rate_track")
+    def rate_track(self, track, rating):
+        self.ensure_loaded()
+        with self.storage.locked(), self.changes_lock:
+            self.sync_with_storage()
+            # Catching up may have replaced the track object
+            track = self.tracks_by_id.get(track.track_id, track)
+            track.set_rating(rating)
+            self.update_sorted_views(track)
+            self.storage.set_rating(track.track_id, rating)
+        self.check_journal_size()
+
+    @timed("library.queue_rating")
+    def queue_rating(self, track, rating):
+        # Like rate_track, but the write waits for the next flush()
+        self.ensure_loaded()
+        with self.changes_lock:
+            track.set_rating(rating)
+            self.update_sorted_views(track)
+            self.pending_ratings[track.track_id] = rating
+        if self.autosave:
+            self.flush()
+
+    @timed("library.save_tracks")
     def save_tracks(self):
-        with open(DATA_FILE, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=["Track ID", "Name", "Artist", "Rating", "Play Count", "Image Path", "Album", "Release Year", "Genre", "Track Number"])
-            writer.writeheader()
-            for track in self.tracks:
-                writer.writerow({
-                    "Track ID": track.track_id,
-                    "Name": track.name,
-                    "Artist": track.artist,
-                    "Rating": track.rating,
-                    "Play Count": track.play_count,
-                    "Image Path": track.image_path,
-                    "Album": track.album if isinstance(track, LibraryItemAlbum) else "",
-                    "Release Year": track.release_year if isinstance(track, LibraryItemAlbum) else "",
-                    "Genre": track.genre if isinstance(track, LibraryItemAlbum) else "",
-                    "Track Number": track.track_number if isinstance(track, LibraryItemAlbum) else ""
-                })
+        self.ensure_loaded()
+        # The storage lock keeps other processes out until the new snapshot is in place
+        with self.storage.locked():
+            self.sync_with_storage()
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        # Call with the storage lock held and nothing left to catch up with. The tracks are
+        # copied under changes_lock, so queued plays can't slip in between the copy and taking
+        # them, and written after letting go of it, so edits on the Tk thread don't wait for
+        # the whole file.
+        with self.changes_lock:
+            tracks = [make_track(*track_fields(track)) for track in self.tracks_by_id.values()]
+            taken = self.take_changes()
+        try:
+            self.storage.save_tracks(tracks)
+        except Exception:
+            self.restore_changes(taken)
+            raise
+
+    def take_changes(self):
+        # Call with changes_lock held. Hands over everything queued, for writing.
+        taken = (self.pending_plays, self.pending_ratings, self.dirty_ids, self.edited_fields, self.removed_ids)
+        self.pending_plays, self.pending_ratings = Counter(), {}
+        self.dirty_ids, self.edited_fields, self.removed_ids = set(), {}, set()
+        return taken
+
+    def restore_changes(self, taken):
+        # Puts back what a failed write took, so the next flush tries again; anything
+        # queued since stays on top
+        play_counts, ratings, dirty_ids, edited_fields, removed_ids = taken
+        with self.changes_lock:
+            self.pending_plays.update(play_counts)
+            self.pending_ratings = {**ratings, **self.pending_ratings}
+            for track_id in dirty_ids - self.removed_ids:
+                self.mark_dirty(track_id, edited_fields.get(track_id))
+            self.removed_ids |= removed_ids - self.dirty_ids
+
+    def mark_dirty(self, track_id, fields=None):
+        # Call with changes_lock held. fields are the ones edited here; None means the whole
+        # track, e.g. a new one.
+        if track_id in self.dirty_ids and track_id not in self.edited_fields:
+            return
+        self.dirty_ids.add(track_id)
+        if fields is None:
+            self.edited_fields.pop(track_id, None)
+        else:
+            self.edited_fields.setdefault(track_id, set()).update(fields)
+
+    def mark_changed(self, track_id, removed=False):
+        with self.changes_lock:
+            if removed:
+                self.dirty_ids.discard(track_id)
+                self.edited_fields.pop(track_id, None)
+                self.removed_ids.add(track_id)
+            else:
+                self.removed_ids.discard(track_id)
+                self.mark_dirty(track_id)
+        if self.autosave:
+            self.flush()
+
+    def has_unsaved_changes(self):
+        return bool(self.pending_plays or self.pending_ratings or self.dirty_ids or self.removed_ids)
+
+    def flush(self):
+        # Writes everything queued, catching up with other processes on this thread as needed
+        while True:
+            changes = self.try_flush()
+            if changes is None:
+                return
+            self.apply_changes(changes)
+
+    @timed("library.flush")
+    def try_flush(self):
+        # Writes the queued changes, unless other processes saved theirs since we last looked:
+        # then nothing is written and their changes are returned, for apply_changes and another
+        # try. It never changes tracks, so it can run on a background thread while the main one
+        # reads them.
+        self.ensure_loaded()
+        if self.history is not None:
+            self.history.flush()
+        if self.playlists is not None:
+            self.playlists.flush()
+        with self.storage.locked():
+            changes = self.storage.read_changes()
+            if changes is not None:
+                return changes
+            with self.changes_lock:
+                snapshot = (self.dirty_ids or self.removed_ids) and not self.storage.supports_row_updates
+                if not snapshot:
+                    taken = self.take_changes()
+                    play_counts, ratings, dirty_ids, edited_fields, removed_ids = taken
+                    # Copies, so an edit made while this is being written can't be half-saved
+                    changed_tracks = [make_track(*track_fields(self.tracks_by_id[track_id]))
+                                      for track_id in dirty_ids if track_id in self.tracks_by_id]
+            if snapshot:
+                # A full snapshot already includes the queued play counts
+                self.write_snapshot()
+                return None
+
+            try:
+                if play_counts:
+                    self.storage.record_plays(play_counts)
+                if ratings:
+                    self.storage.set_ratings(ratings)
+                if dirty_ids or removed_ids:
+                    self.storage.write_changes(changed_tracks, removed_ids, edited_fields)
+            except Exception:
+                self.restore_changes(taken)
+                raise
+            if self.storage.journal_size >= JOURNAL_COMPACT_LIMIT:
+                self.write_snapshot()
+        return None
 
     def list_all(self):
         return self.tracks
 
     def get_track_by_id(self, track_id):
-        return next((track for track in self.tracks if track.track_id == track_id), None)
+        return self.tracks_by_id.get(track_id)
+
+    @timed("library.search")
+    def search(self, query, limit=None):
+        return [self.tracks_by_id[track_id] for track_id in self.get_search_index().search(query, limit)]
+
+    def get_search_index(self):
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.tracks_by_id.values())
+            self.search_index_changes = None
+        return self.search_index
+
+    def start_search_index(self):
+        # For building the index on a background thread: returns the tracks to index, and
+        # whatever changes before install_search_index gets the result is applied to it then
+        self.search_index_changes = {}
+        return list(self.tracks_by_id.values())
+
+    def install_search_index(self, index):
+        # False if the index was built some other way in the meantime, or the library reloaded
+        if self.search_index_changes is None:
+            return False
+        for track_id, track in self.search_index_changes.items():
+            if track is None:
+                index.remove_track(track_id)
+            else:
+                index.update_track(track)
+        self.search_index = index
+        self.search_index_changes = None
+        return True
+
+    def cancel_search_index(self):
+        # The background build failed; the next search builds the index itself
+        self.search_index_changes = None
+
+    def get_field_values(self, field):
+        return self.field_indexes[field].values()
+
+    @timed("library.filter_tracks")
+    def filter_tracks(self, **criteria):
+        # Each criterion is a value or a collection of values (any of which may match);
+        # a track has to match every criterion given, e.g. filter_tracks(artist="IU", decade=[2010, 2020])
+        matches = self.matching_ids(criteria)
+        if matches is None:
+            return self.list_all()
+        return [self.tracks_by_id[track_id] for track_id in sorted(matches)]
+
+    def matching_ids(self, criteria):
+        # None when no criterion is given, so callers can skip filtering altogether
+        matches = None
+        for field, wanted in (criteria or {}).items():
+            if wanted is None:
+                continue
+            index = self.field_indexes[field]
+            ids = set().union(*(index.get(value) for value in wanted_values(wanted)))
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return set()
+        return matches
+
+    def count_tracks(self, criteria=None):
+        matches = self.matching_ids(criteria)
+        return len(self.tracks_by_id) if matches is None else len(matches)
+
+    @timed("library.iter_tracks")
+    def iter_tracks(self, offset=0, limit=None, order_by=None, criteria=None):
+        # Yields one slice of the library, optionally filtered and sorted, without copying the rest.
+        # With no order_by tracks come in library order, as list_all() has them.
+        stop = None if limit is None else offset + limit
+        matches = self.matching_ids(criteria)
+        if matches is None:
+            if order_by is None:
+                return islice(self.tracks_by_id.values(), offset, stop)
+            return iter(self.sorted_tracks(order_by)[offset:stop])
+        if order_by is None:
+            # filter_tracks has always returned matches by track ID
+            ordered_ids = sorted(matches)
+        else:
+            ordered_ids = sorted(matches, key=self.get_sorted_view(order_by).sort_key)
+        return (self.tracks_by_id[track_id] for track_id in ordered_ids[offset:stop])
+
+    @timed("library.page_tracks")
+    def page_tracks(self, limit, cursor=None, order_by="track_id", criteria=None):
+        # Cursor-based paging: returns (tracks, next_cursor), where next_cursor is None after the
+        # last page. Unlike an offset, a cursor doesn't skip or repeat tracks when others are
+        # added or removed between pages.
+        view = self.get_sorted_view(order_by)
+        matches = self.matching_ids(criteria)
+        if matches is None:
+            entries = view.entries
+        else:
+            entries = sorted(view.sort_key(track_id) for track_id in matches)
+        start = bisect.bisect_right(entries, decode_cursor(cursor, order_by)) if cursor else 0
+        page = [self.tracks_by_id[track_id] for _, track_id in entries[start:start + limit]]
+        next_cursor = encode_cursor(order_by, entries[start + limit - 1]) if start + limit < len(entries) else None
+        return page, next_cursor
+
+    def track_cursor(self, track, order_by="track_id"):
+        return encode_cursor(order_by, self.get_sorted_view(order_by).sort_key(track.track_id))
 
     def add_track(self, track):
-        self.tracks.append(track)
-        self.save_tracks()
+        self.ensure_loaded()
+        # Marked as changed before the lock is let go, so catching up with the disk can't undo it
+        with self.changes_lock:
+            self.tracks_by_id[track.track_id] = track
+            self.index_track(track)
+            self.mark_dirty(track.track_id)
+        self.mark_changed(track.track_id)
+
+    @timed("library.add_tracks")
+    def add_tracks(self, tracks):
+        # Like add_track for many tracks at once; they're all written by a single flush
+        self.ensure_loaded()
+        with self.changes_lock:
+            # Inserting one by one into every sorted view would be slow, so they're rebuilt when next asked for
+            self.sorted_views = {}
+            for track in tracks:
+                self.tracks_by_id[track.track_id] = track
+                self.index_track(track)
+                self.removed_ids.discard(track.track_id)
+                self.mark_dirty(track.track_id)
+        if self.autosave:
+            self.flush()
+
+    @timed("library.edit_track")
+    def edit_track(self, track, **changes):
+        self.ensure_loaded()
+        with self.changes_lock:
+            rating = changes.pop("rating", None)
+            if rating is not None:
+                # Saved like queue_rating, so it stays on top of whatever is on disk
+                track.set_rating(rating)
+                self.pending_ratings[track.track_id] = rating
+            edited = set()
+            for field, value in changes.items():
+                # Plain items have nowhere to keep album details, and save_tracks never wrote them
+                if field in ALBUM_FIELDS and not isinstance(track, LibraryItemAlbum):
+                    continue
+                setattr(track, field, value)
+                edited.add(field)
+            self.index_track(track)
+            self.mark_dirty(track.track_id, edited)
+        if self.autosave:
+            self.flush()
 
     def remove_track(self, track_id):
-        track = self.get_track_by_id(track_id)
+        self.ensure_loaded()
+        with self.changes_lock:
+            track = self.tracks_by_id.pop(track_id, None)
+            if track:
+                self.unindex_track(track_id)
+                self.dirty_ids.discard(track_id)
+                self.edited_fields.pop(track_id, None)
+                self.removed_ids.add(track_id)
         if track:
-            self.tracks.remove(track)
-            self.save_tracks()
+            self.mark_changed(track_id, removed=True)
+            if self.playlists is not None:
+                self.playlists.remove_track(track_id)
         else:
             print(f"Track with ID {track_id} not found.")
-
@@ -0,0 +1,433 @@
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+from library_item import TrackLibrary, ALBUM_FIELDS
+from play_history import PlayHistory, HISTORY_FILE
+from playlist_store import PlaylistStore, PLAYLIST_FOLDER
+from field_index import FILTER_FIELDS
+from sorted_view import SORT_KEYS
+from sqlite_storage import SqliteStorage, DATABASE_FILE
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+MAX_BATCH_SIZE = 1000
+MAX_BODY_SIZE = 1 << 20
+MAX_HEADER_SIZE = 1 << 16
+# Idle keep-alive connections are closed after this many seconds
+KEEP_ALIVE_TIMEOUT = 15
+# Plays and playlist changes are gathered for this long and written together,
+# like the GUI's coalesced saves
+FLUSH_DELAY = 0.2
+
+# Every route is a method and a path pattern; {track_id} and {name} parts are passed to the handler
+ROUTES = [
+    ("GET", ("tracks",), "list_tracks"),
+    ("GET", ("tracks", "{track_id}"), "get_track"),
+    ("POST", ("tracks", "{track_id}", "play"), "play_track"),
+    ("PUT", ("tracks", "{track_id}", "rating"), "rate_track"),
+    ("GET", ("search",), "search"),
+    ("POST", ("plays",), "record_plays"),
+    ("GET", ("playlists",), "list_playlists"),
+    ("POST", ("playlists",), "create_playlist"),
+    ("GET", ("playlists", "{name}"), "get_playlist"),
+    ("DELETE", ("playlists", "{name}"), "delete_playlist"),
+    ("POST", ("playlists", "{name}", "tracks"), "add_to_playlist"),
+    ("DELETE", ("playlists", "{name}", "tracks", "{track_id}"), "remove_from_playlist"),
+    ("POST", ("batch",), "batch"),
+]
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def track_to_dict(track):
+    fields = {
+        "track_id": track.track_id,
+        "name": track.name,
+        "artist": track.artist,
+        "rating": track.rating,
+        "play_count": track.play_count,
+        "image_path": track.image_path,
+    }
+    for field in ALBUM_FIELDS:
+        if hasattr(track, field):
+            fields[field] = getattr(track, field)
+    return fields
+
+def parse_int(value, name, minimum=None, maximum=None):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer") from None
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} must be between {minimum} and {maximum}")
+    return number
+
+def page_bounds(query):
+    offset = parse_int(query.get("offset", [0])[-1], "offset", minimum=0)
+    limit = parse_int(query.get("limit", [PAGE_LIMIT])[-1], "limit", 1, MAX_PAGE_LIMIT)
+    return offset, limit
+
+def page(items, query):
+    # items only needs len() and slicing, e.g. a playlist
+    offset, limit = page_bounds(query)
+    return offset_page(items[offset:offset + limit], len(items), offset, limit)
+
+def offset_page(tracks, total, offset, limit):
+    return {
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if offset + limit < total else None,
+        "tracks": [track_to_dict(track) for track in tracks],
+    }
+
+def encode_json(payload):
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+class LibraryService:
+    # A local HTTP/JSON front end for TrackLibrary. Everything runs on one asyncio loop;
+    # requests on a connection are answered in order, so clients can keep it open and
+    # pipeline, and POST /batch runs many requests in one round trip. Reads are served
+    # from memory and writes are queued and flushed from a single background thread;
+    # other processes' changes that a flush turns up are merged back on the loop, so a
+    # handler never sees the tracks half-updated.
+    def __init__(self, library, playlists=None, flush_delay=FLUSH_DELAY):
+        self.library = library
+        self.playlists = playlists
+        self.flush_delay = flush_delay
+        self.library.autosave = False
+        # One thread keeps disk writes in order, like the GUI's IOExecutor
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.flush_handle = None
+        self.server = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_SIZE)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        loop = asyncio.get_running_loop()
+        while True:
+            changes = await loop.run_in_executor(self.writer, self.library.try_flush)
+            if changes is None:
+                break
+            self.library.apply_changes(changes)
+        self.writer.shutdown()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except HttpError as e:
+                    self.write_response(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, body, keep_alive = request
+                status, payload = await self.dispatch(method, target, body)
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        # Returns (method, target, body, keep_alive), or None once the client has gone
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Request headers are too large") from None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line") from None
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(HTTPStatus.LENGTH_REQUIRED, "Chunked request bodies are not supported")
+        length = parse_int(headers.get("content-length", 0), "Content-Length", 0, MAX_BODY_SIZE)
+        body = await reader.readexactly(length) if length else b""
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return method.upper(), target, body, keep_alive
+
+    def write_response(self, writer, status, payload, keep_alive):
+        body = encode_json(payload)
+        status = HTTPStatus(status)
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+        )
+
+    async def dispatch(self, method, target, body):
+        # Returns (status, payload); errors come back as {"error": message}
+        try:
+            url = urlsplit(target)
+            parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+            handler, arguments = self.route(method, parts)
+            query = parse_qs(url.query, keep_blank_values=True)
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise HttpError(HTTPStatus.BAD_REQUEST, "The request body must be a JSON object")
+            return await handler(query, data, **arguments)
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except json.JSONDecodeError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": f"Invalid JSON: {e}"}
+        except ValueError as e:
+            # The library's own validation, e.g. a rating out of range or an unknown track ID
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            print(f"Request {method} {target} failed: {e}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+
+    def route(self, method, parts):
+        path_matched = False
+        for route_method, pattern, handler_name in ROUTES:
+            if len(pattern) != len(parts):
+                continue
+            arguments = {}
+            for expected, part in zip(pattern, parts):
+                if expected.startswith("{"):
+                    arguments[expected[1:-1]] = part
+                elif expected != part:
+                    break
+            else:
+                path_matched = True
+                if route_method == method:
+                    if "track_id" in arguments:
+                        arguments["track_id"] = parse_int(arguments["track_id"], "track ID")
+                    return getattr(self, handler_name), arguments
+        if path_matched:
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not allowed here")
+        raise HttpError(HTTPStatus.NOT_FOUND, f"No such resource: /{'/'.join(parts)}")
+
+    def find_track(self, track_id):
+        track = self.library.get_track_by_id(track_id)
+        if track is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"Track with ID {track_id} not found")
+        return track
+
+    def find_playlist(self, name):
+        if self.playlists is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, "This library has no playlists")
+        if name not in self.playlists:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"Playlist '{name}' not found")
+        return name
+
+    def schedule_flush(self):
+        # Writes that arrive close together share one flush
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self.start_flush)
+
+    def start_flush(self):
+        self.flush_handle = None
+        future = asyncio.get_running_loop().run_in_executor(self.writer, self.library.try_flush)
+        future.add_done_callback(self.flush_done)
+
+    def flush_done(self, future):
+        # Runs on the loop, so merging other processes' changes can't race a handler
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            # The library kept the changes, so the next flush tries again
+            print(f"Failed to save tracks: {future.exception()}")
+            self.schedule_flush()
+        elif future.result() is not None:
+            # Nothing was written; catch up and try again
+            self.library.apply_changes(future.result())
+            self.schedule_flush()
+
+    async def list_tracks(self, query, data):
+        # Filters are repeatable (?genre=Pop&genre=Rock) and combine like TrackLibrary.filter_tracks.
+        # Pages come by offset, or by cursor with ?cursor= (blank for the first page), which
+        # doesn't skip or repeat tracks when the library changes between requests.
+        order_by = query.get("order_by", ["track_id"])[-1]
+        if order_by not in SORT_KEYS:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"order_by must be one of {', '.join(SORT_KEYS)}")
+        criteria = {}
+        for field in FILTER_FIELDS:
+            if field in query:
+                values = query[field]
+                if field == "decade":
+                    values = [parse_int(value, "decade") for value in values]
+                criteria[field] = values[0] if len(values) == 1 else values
+        offset, limit = page_bounds(query)
+        if "cursor" in query:
+            tracks, next_cursor = self.library.page_tracks(limit, query["cursor"][-1], order_by, criteria)
+            return HTTPStatus.OK, {"limit": limit, "next_cursor": next_cursor,
+                                   "tracks": [track_to_dict(track) for track in tracks]}
+        tracks = list(self.library.iter_tracks(offset, limit, order_by, criteria))
+        return HTTPStatus.OK, offset_page(tracks, self.library.count_tracks(criteria), offset, limit)
+
+    async def get_track(self, query, data, track_id):
+        return HTTPStatus.OK, track_to_dict(self.find_track(track_id))
+
+    async def search(self, query, data):
+        text = query.get("q", [""])[-1].strip()
+        if not text:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Please give a search term with ?q=")
+        # Only as many results as this page needs are ranked, plus one to tell whether
+        # there is a next page, so there is no total
+        offset, limit = page_bounds(query)
+        tracks = self.library.search(text, limit=offset + limit + 1)
+        return HTTPStatus.OK, {
+            "offset": offset,
+            "limit": limit,
+            "next_offset": offset + limit if len(tracks) > offset + limit else None,
+            "tracks": [track_to_dict(track) for track in tracks[offset:offset + limit]],
+        }
+
+    async def play_track(self, query, data, track_id):
+        count = parse_int(data.get("count", 1), "count", 1, 0xFFFF)
+        track = self.find_track(track_id)
+        self.library.queue_plays([track_id] * count)
+        self.schedule_flush()
+        return HTTPStatus.OK, track_to_dict(track)
+
+    async def record_plays(self, query, data):
+        # {"track_ids": [1, 1, 3]}; nothing is counted if any ID is unknown
+        track_ids = data.get("track_ids")
+        if not isinstance(track_ids, list):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "track_ids must be a list")
+        self.library.queue_plays([parse_int(track_id, "track ID") for track_id in track_ids])
+        self.schedule_flush()
+        return HTTPStatus.OK, {"recorded": len(track_ids)}
+
+    async def rate_track(self, query, data, track_id):
+        track = self.find_track(track_id)
+        rating = data.get("rating")
+        if not isinstance(rating, int) or not (1 <= rating <= 5):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Rating must be an integer between 1 and 5")
+        # The rating changes in memory now and is written with the next flush, like plays
+        self.library.queue_rating(track, rating)
+        self.schedule_flush()
+        return HTTPStatus.OK, track_to_dict(track)
+
+    async def list_playlists(self, query, data):
+        return HTTPStatus.OK, {"playlists": self.playlists.names() if self.playlists is not None else []}
+
+    async def create_playlist(self, query, data):
+        if self.playlists is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, "This library has no playlists")
+        name = data.get("name")
+        if not isinstance(name, str) or not name.strip():
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Please give a playlist name")
+        name = name.strip()
+        # The name becomes a file name in the playlist folder
+        if name in (".", "..") or "/" in name or "\\" in name or os.sep in name:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Playlist names can't contain path separators")
+        if name in self.playlists:
+            raise HttpError(HTTPStatus.CONFLICT, "Playlist already exists!")
+        self.playlists.create(name)
+        self.schedule_flush()
+        return HTTPStatus.CREATED, {"name": name}
+
+    async def get_playlist(self, query, data, name):
+        self.find_playlist(name)
+        tracks = [self.library.get_track_by_id(track_id) for track_id in self.playlists.get_ids(name)]
+        result = page([track for track in tracks if track], query)
+        result["name"] = name
+        return HTTPStatus.OK, result
+
+    async def delete_playlist(self, query, data, name):
+        self.playlists.delete(self.find_playlist(name))
+        self.schedule_flush()
+        return HTTPStatus.OK, {"name": name}
+
+    async def add_to_playlist(self, query, data, name):
+        self.find_playlist(name)
+        track = self.find_track(parse_int(data.get("track_id"), "track_id"))
+        added = self.playlists.add(name, track.track_id)
+        self.schedule_flush()
+        return HTTPStatus.OK, {"name": name, "track_id": track.track_id, "added": added}
+
+    async def remove_from_playlist(self, query, data, name, track_id):
+        self.find_playlist(name)
+        removed = self.playlists.remove(name, track_id)
+        self.schedule_flush()
+        return HTTPStatus.OK, {"name": name, "track_id": track_id, "removed": removed}
+
+    async def batch(self, query, data):
+        # {"requests": [{"method": "GET", "path": "/tracks/1"}, {"method": "POST", "path": "/plays", "body": {...}}]}
+        # Requests run in order and each gets its own status; one failing doesn't stop the rest
+        requests = data.get("requests")
+        if not isinstance(requests, list) or len(requests) > MAX_BATCH_SIZE:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"requests must be a list of at most {MAX_BATCH_SIZE} requests")
+        responses = []
+        for request in requests:
+            if not isinstance(request, dict) or not isinstance(request.get("path"), str):
+                responses.append({"status": HTTPStatus.BAD_REQUEST, "body": {"error": "Each request needs a path"}})
+                continue
+            method = str(request.get("method", "GET")).upper()
+            if request["path"].strip("/").split("/")[0].split("?")[0] == "batch":
+                responses.append({"status": HTTPStatus.BAD_REQUEST, "body": {"error": "Batches can't be nested"}})
+                continue
+            body = encode_json(request["body"]) if "body" in request else b""
+            status, payload = await self.dispatch(method, request["path"], body)
+            responses.append({"status": int(status), "body": payload})
+        return HTTPStatus.OK, {"responses": responses}
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the JukeBox library as a local HTTP/JSON API.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    # Use the SQLite library once it has been imported with sqlite_storage.py, like the GUI
+    storage = SqliteStorage() if os.path.exists(DATABASE_FILE) else None
+    playlists = PlaylistStore(PLAYLIST_FOLDER)
+    playlists.open()
+    library = TrackLibrary(storage=storage, history=PlayHistory(HISTORY_FILE), playlists=playlists)
+    service = LibraryService(library, playlists)
+    # Built up front, so the first search doesn't hold up the loop
+    library.get_search_index()
+
+    async def serve():
+        server = await service.start(args.host, args.port)
+        print(f"Serving {len(library.list_all())} tracks on http://{args.host}:{args.port}")
+        try:
+            await server.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        library.compact_journal()
+        if library.history is not None:
+            library.history.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import os
+import pickle
+import struct
+import threading
+import time
+from file_lock import FileLock
+
+HISTORY_FILE = "play_history.bin"
+# Each event is 10 bytes: unix time (seconds), track ID and how many plays it stands for
+EVENT = struct.Struct("<IIH")
+HOUR = 3600
+DAY = 24 * HOUR
+# Hourly buckets older than this are dropped; the daily ones are kept for good
+HOURLY_RETENTION_DAYS = 8
+
+class PlayHistory:
+    # Append-only log of timestamped plays, with per-hour and per-day totals for every
+    # track, every artist and the library as a whole kept alongside it. Window queries
+    # only ever touch those totals, never the raw events. Several processes can share the
+    # log: events are written under a lock file, and each flush first counts whatever the
+    # others logged since, so log_offset is always the end of the events in the totals.
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self.rollup_file = path + ".rollup"
+        self.locked = FileLock(path + ".lock")
+        self.lock = threading.Lock()
+        self.hourly = {}
+        self.daily = {}
+        self.log_offset = 0
+        self.pending = []
+        self.artist_of = lambda track_id: None
+        self.log = None
+
+    def open(self, artist_of=None):
+        # artist_of(track_id) lets events read back from the log count towards their artist
+        self.artist_of = artist_of or self.artist_of
+        with self.locked():
+            self.load()
+            # Unbuffered, so a failed write leaves nothing behind to go out with the next one
+            self.log = open(self.path, "ab", buffering=0)
+
+    def load(self):
+        if os.path.exists(self.rollup_file):
+            try:
+                with open(self.rollup_file, "rb") as f:
+                    snapshot = pickle.load(f)
+                self.hourly, self.daily, self.log_offset = snapshot["hourly"], snapshot["daily"], snapshot["offset"]
+            except (OSError, pickle.UnpicklingError, EOFError, KeyError) as e:
+                print(f"Rebuilding play history totals: {e}")
+                self.hourly, self.daily, self.log_offset = {}, {}, 0
+
+        if not os.path.exists(self.path):
+            return
+        log_size = self.trim_torn_event()
+        if self.log_offset > log_size:
+            # The log was replaced since the totals were saved, so start over
+            self.hourly, self.daily, self.log_offset = {}, {}, 0
+        self.read_new_events()
+        self.prune()
+
+    def trim_torn_event(self):
+        # Call with the lock file held. A crash part-way through a write leaves part of an
+        # event at the end; anything appended after it would be read out of step, so it goes.
+        log_size = os.path.getsize(self.path)
+        if log_size % EVENT.size:
+            log_size -= log_size % EVENT.size
+            os.truncate(self.path, log_size)
+        return log_size
+
+    def read_new_events(self):
+        # Call with the lock file held. Counts the events logged after log_offset, i.e. by
+        # other processes since we last wrote or the last checkpoint.
+        with open(self.path, "rb") as f:
+            f.seek(self.log_offset)
+            data = f.read()
+        with self.lock:
+            for timestamp, track_id, count in EVENT.iter_unpack(data):
+                self.add_to_rollups(timestamp, track_id, self.artist_of(track_id), count)
+            self.log_offset += len(data)
+
+    def add_to_rollups(self, timestamp, track_id, artist, count):
+        hour = timestamp // HOUR
+        day = timestamp // DAY
+        keys = [("all",), ("track", track_id)]
+        if artist is not None:
+            keys.append(("artist", artist))
+        for key in keys:
+            hours = self.hourly.setdefault(key, {})
+            hours[hour] = hours.get(hour, 0) + count
+            days = self.daily.setdefault(key, {})
+            days[day] = days.get(day, 0) + count
+
+    def record(self, play_counts, artists=None, timestamp=None):
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        artists = artists or {}
+        events = []
+        for track_id, count in play_counts.items():
+            # A single event can hold up to 65535 plays
+            for start in range(0, count, 0xFFFF):
+                events.append(EVENT.pack(timestamp, track_id, min(count - start, 0xFFFF)))
+        with self.lock:
+            # Written by the next flush, where the log's end can be checked
+            self.pending.extend(events)
+            for track_id, count in play_counts.items():
+                self.add_to_rollups(timestamp, track_id, artists.get(track_id), count)
+
+    def flush(self):
+        if self.log is None:
+            return
+        with self.locked():
+            self.write_pending()
+
+    def write_pending(self):
+        # Call with the lock file held. Other processes' events go into the totals before
+        # ours are appended, so log_offset ends up at the true end of the log.
+        self.trim_torn_event()
+        self.read_new_events()
+        with self.lock:
+            events, self.pending = self.pending, []
+        if not events:
+            return
+        data = memoryview(b"".join(events))
+        try:
+            while data:
+                data = data[self.log.write(data):]
+            os.fsync(self.log.fileno())
+        except OSError:
+            # Undo whatever got written and put the events back for the next flush
+            os.truncate(self.path, self.log_offset)
+            with self.lock:
+                self.pending[:0] = events
+            raise
+        with self.lock:
+            # The log is opened for appending, so this is its end as we wrote it, and with
+            # the lock file held nobody else has written since
+            self.log_offset = self.log.tell()
+
+    def checkpoint(self):
+        # Save the totals so the next start only has to read events logged after this point
+        with self.locked():
+            self.write_pending()
+            with self.lock:
+                self.prune()
+                temp_file = self.rollup_file + ".tmp"
+                with open(temp_file, "wb") as f:
+                    pickle.dump({"hourly": self.hourly, "daily": self.daily, "offset": self.log_offset}, f,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_file, self.rollup_file)
+
+    def close(self):
+        if self.log is None:
+            return
+        self.checkpoint()
+        self.log.close()
+        self.log = None
+
+    def prune(self):
+        oldest_hour = (int(time.time()) - HOURLY_RETENTION_DAYS * DAY) // HOUR
+        for hours in self.hourly.values():
+            for hour in [hour for hour in hours if hour < oldest_hour]:
+                del hours[hour]
+
+    def plays_between(self, since, until=None, track_id=None, artist=None):
+        if track_id is not None:
+            key = ("track", track_id)
+        elif artist is not None:
+            key = ("artist", artist)
+        else:
+            key = ("all",)
+        hours = self.hourly.get(key, {})
+        days = self.daily.get(key, {})
+
+        until = int(time.time() if until is None else until)
+        start_hour = int(since) // HOUR
+        end_hour = until // HOUR
+        if start_hour < (int(time.time()) - HOURLY_RETENTION_DAYS * DAY) // HOUR:
+            # Hourly detail is gone this far back, so count from the start of that day
+            start_hour -= start_hour % 24
+
+        # Whole days come from the daily totals and only the ragged ends from the hourly ones
+        total = 0
+        hour = start_hour
+        while hour <= end_hour:
+            if hour % 24 == 0 and hour + 23 <= end_hour:
+                total += days.get(hour // 24, 0)
+                hour += 24
+            else:
+                total += hours.get(hour, 0)
+                hour += 1
+        return total
+
+    def plays_in_last(self, days=7, track_id=None, artist=None):
+        now = int(time.time())
+        return self.plays_between(now - days * DAY, now, track_id=track_id, artist=artist)
+
+    def iter_events(self):
+        with self.locked():
+            self.write_pending()
+            with open(self.path, "rb") as f:
+                data = f.read()
+        yield from EVENT.iter_unpack(data[:len(data) - len(data) % EVENT.size])
@@ -0,0 +1,314 @@
+import csv
+import os
+import struct
+import threading
+from file_lock import FileLock
+
+PLAYLIST_FOLDER = "playlists"
+PLAYLIST_EXTENSION = ".ids"
+MAGIC = b"JBPLIDS1"
+# Every change is one record: an operation byte and a track ID
+RECORD = struct.Struct("<Bq")
+ADD = 1
+REMOVE = 2
+# A playlist file is rewritten once it holds this many more records than live entries
+COMPACT_SLACK = 64
+LOCK_FILE = "playlists.lock"
+
+class OrderedIdSet:
+    # Track IDs in the order they were added, with O(1) membership, add and remove.
+    # A dict keeps insertion order, so its keys do both jobs.
+    __slots__ = ("ids",)
+
+    def __init__(self, track_ids=()):
+        self.ids = dict.fromkeys(track_ids)
+
+    def __contains__(self, track_id):
+        return track_id in self.ids
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, track_id):
+        if track_id in self.ids:
+            return False
+        self.ids[track_id] = None
+        return True
+
+    def discard(self, track_id):
+        if track_id not in self.ids:
+            return False
+        del self.ids[track_id]
+        return True
+
+def read_csv_playlist(path):
+    # The old format: Track ID, Name, Artist per row
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [int(row[0]) for row in reader if row and row[0].isdigit()]
+
+def read_ids_playlist(path):
+    # Returns the live track IDs in order and how many records the file holds
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a playlist file")
+    body = data[len(MAGIC):]
+    body = body[:len(body) - len(body) % RECORD.size]
+    track_ids = OrderedIdSet()
+    for operation, track_id in RECORD.iter_unpack(body):
+        if operation == ADD:
+            track_ids.add(track_id)
+        elif operation == REMOVE:
+            track_ids.discard(track_id)
+    return list(track_ids), len(body) // RECORD.size
+
+def trim_torn_record(path):
+    # Call with the lock file held. A crash part-way through an append leaves part of a
+    # record at the end, and the next append would land out of step with the rest, so it's
+    # cut off. Returns the file's (inode, size) afterwards, or None if there's no file.
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    size = stat.st_size
+    usable = size - (size - len(MAGIC)) % RECORD.size if size >= len(MAGIC) else 0
+    if usable != size:
+        os.truncate(path, usable)
+    return stat.st_ino, usable
+
+def read_playlist_file(path):
+    if path.endswith(PLAYLIST_EXTENSION):
+        return read_ids_playlist(path)[0]
+    return read_csv_playlist(path)
+
+class PlaylistStore:
+    # Playlists hold track IDs only; names and artists always come from the library.
+    # Adds and removes are appended to the playlist's file as records, so a change to
+    # one entry never rewrites the rest. Entries are read the first time a playlist is
+    # used. Changes are kept in memory until flush(), like TrackLibrary's plays. Other
+    # processes can share the folder: files are only touched under its lock file, and a
+    # playlist someone else changed since we read it is read again before ours go on top.
+    def __init__(self, folder=PLAYLIST_FOLDER):
+        self.folder = folder
+        self.lock = threading.RLock()
+        self.locked = FileLock(os.path.join(folder, LOCK_FILE))
+        self.playlist_names = set()
+        # name -> OrderedIdSet, for the playlists read so far
+        self.entries = {}
+        # track_id -> names of the loaded playlists that contain it
+        self.track_playlists = {}
+        self.record_counts = {}
+        # name -> the file's (inode, size) as we last read or wrote it
+        self.file_states = {}
+        self.pending = {}
+        self.rewrites = set()
+        self.deleted = set()
+
+    def open(self):
+        # Lists the playlists without reading them; old CSV playlists are converted once
+        os.makedirs(self.folder, exist_ok=True)
+        filenames = os.listdir(self.folder)
+        names = {name for name, extension in map(os.path.splitext, filenames) if extension == PLAYLIST_EXTENSION}
+        for filename in filenames:
+            name, extension = os.path.splitext(filename)
+            if extension == ".csv" and name not in names:
+                try:
+                    self.migrate(name)
+                    names.add(name)
+                except (OSError, ValueError) as e:
+                    print(f"Skipping playlist {filename}: {e}")
+        with self.lock:
+            self.playlist_names |= names - self.deleted
+        return self.names()
+
+    def migrate(self, name):
+        csv_file = os.path.join(self.folder, f"{name}.csv")
+        with self.locked():
+            self.write_file(name, list(dict.fromkeys(read_csv_playlist(csv_file))))
+        # Kept under another name so nothing is lost, but never read again
+        os.replace(csv_file, csv_file + ".migrated")
+
+    def path(self, name):
+        return os.path.join(self.folder, name + PLAYLIST_EXTENSION)
+
+    def names(self):
+        with self.lock:
+            return sorted(self.playlist_names)
+
+    def __contains__(self, name):
+        return name in self.playlist_names
+
+    def load(self, name):
+        with self.lock:
+            if name not in self.playlist_names:
+                raise KeyError(name)
+            if name not in self.entries:
+                with self.locked():
+                    self.read_file(name)
+            return self.entries[name]
+
+    def read_file(self, name):
+        # Call with both locks held
+        state = trim_torn_record(self.path(name))
+        if state is not None and state[1]:
+            track_ids, self.record_counts[name] = read_ids_playlist(self.path(name))
+        else:
+            track_ids, self.record_counts[name] = [], 0
+        for track_id in self.entries.get(name, ()):
+            self.unindex_entry(name, track_id)
+        self.entries[name] = OrderedIdSet(track_ids)
+        for track_id in self.entries[name]:
+            self.index_entry(name, track_id)
+        self.file_states[name] = state
+
+    def load_all(self):
+        with self.lock:
+            for name in self.playlist_names:
+                self.load(name)
+
+    def index_entry(self, name, track_id):
+        self.track_playlists.setdefault(track_id, set()).add(name)
+
+    def unindex_entry(self, name, track_id):
+        names = self.track_playlists.get(track_id)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self.track_playlists[track_id]
+
+    def playlists_with(self, track_id):
+        # Every playlist has to be read once for the answer to be complete; after that it's a lookup
+        with self.lock:
+            self.load_all()
+            return sorted(self.track_playlists.get(track_id, ()))
+
+    def remove_track(self, track_id):
+        # Called when a track leaves the library; returns the playlists it was taken out of
+        with self.lock:
+            names = self.playlists_with(track_id)
+            for name in names:
+                self.remove(name, track_id)
+            return names
+
+    def get_ids(self, name):
+        with self.lock:
+            return list(self.load(name))
+
+    def create(self, name):
+        with self.lock:
+            self.playlist_names.add(name)
+            self.deleted.discard(name)
+            for track_id in self.entries.get(name, ()):
+                self.unindex_entry(name, track_id)
+            self.entries[name] = OrderedIdSet()
+            self.pending.pop(name, None)
+            self.rewrites.add(name)
+
+    def delete(self, name):
+        with self.lock:
+            self.playlist_names.discard(name)
+            for track_id in self.entries.pop(name, ()):
+                self.unindex_entry(name, track_id)
+            self.pending.pop(name, None)
+            self.rewrites.discard(name)
+            self.deleted.add(name)
+
+    def add(self, name, track_id):
+        with self.lock:
+            if not self.load(name).add(track_id):
+                return False
+            self.index_entry(name, track_id)
+            self.pending.setdefault(name, []).append((ADD, track_id))
+            return True
+
+    def remove(self, name, track_id):
+        with self.lock:
+            if not self.load(name).discard(track_id):
+                return False
+            self.unindex_entry(name, track_id)
+            self.pending.setdefault(name, []).append((REMOVE, track_id))
+            return True
+
+    def replace(self, name, track_ids):
+        # For changes that touch every entry, like sorting or clearing a playlist
+        with self.lock:
+            for track_id in self.load(name):
+                self.unindex_entry(name, track_id)
+            self.entries[name] = OrderedIdSet(track_ids)
+            for track_id in self.entries[name]:
+                self.index_entry(name, track_id)
+            self.pending.pop(name, None)
+            self.rewrites.add(name)
+
+    def reload(self, name):
+        self.flush(name)
+        with self.lock:
+            for track_id in self.entries.pop(name, ()):
+                self.unindex_entry(name, track_id)
+            return self.get_ids(name)
+
+    def flush(self, name=None):
+        with self.lock, self.locked():
+            names = [name] if name is not None else list(self.deleted | self.rewrites | set(self.pending))
+            for name in names:
+                if name in self.deleted:
+                    if os.path.exists(self.path(name)):
+                        os.remove(self.path(name))
+                    self.deleted.discard(name)
+                    self.record_counts.pop(name, None)
+                    self.file_states.pop(name, None)
+                    continue
+                if name in self.rewrites:
+                    # Sorting, clearing and creating replace whatever is saved
+                    self.pending.pop(name, None)
+                    self.write_file(name, list(self.entries[name]))
+                    self.rewrites.discard(name)
+                    continue
+                records = self.pending.pop(name, [])
+                if not records:
+                    continue
+                if trim_torn_record(self.path(name)) != self.file_states.get(name):
+                    # Another process appended to or rewrote the playlist since we read it
+                    self.read_file(name)
+                    for operation, track_id in records:
+                        self.apply_record(name, operation, track_id)
+                if self.record_counts[name] + len(records) > 2 * len(self.entries[name]) + COMPACT_SLACK:
+                    self.write_file(name, list(self.entries[name]))
+                else:
+                    self.append_records(name, records)
+
+    def apply_record(self, name, operation, track_id):
+        if operation == ADD and self.entries[name].add(track_id):
+            self.index_entry(name, track_id)
+        elif operation == REMOVE and self.entries[name].discard(track_id):
+            self.unindex_entry(name, track_id)
+
+    def append_records(self, name, records):
+        # Call with the lock file held
+        with open(self.path(name), "ab") as f:
+            if f.tell() == 0:
+                f.write(MAGIC)
+            f.write(b"".join(RECORD.pack(operation, track_id) for operation, track_id in records))
+            f.flush()
+            os.fsync(f.fileno())
+            stat = os.fstat(f.fileno())
+        self.record_counts[name] += len(records)
+        self.file_states[name] = (stat.st_ino, stat.st_size)
+
+    def write_file(self, name, track_ids):
+        # Call with the lock file held; other processes never see a half-written file
+        temp_file = self.path(name) + ".tmp"
+        with open(temp_file, "wb") as f:
+            f.write(MAGIC)
+            f.write(b"".join(RECORD.pack(ADD, track_id) for track_id in track_ids))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.path(name))
+        self.record_counts[name] = len(track_ids)
+        stat = os.stat(self.path(name))
+        self.file_states[name] = (stat.st_ino, stat.st_size)
@@ -0,0 +1,113 @@
+from tkinter import ttk
+
+IMAGE_SIZE = (80, 80)
+
+def plan_moves(current, target):
+    # Yields (track_id, previous_id, next_id) for each row that has to be repacked to
+    # turn the current order into the target one, naming the rows it now sits between.
+    # Both lists hold the same IDs. A single row moving up or down the list comes out
+    # as a single move.
+    arranged = list(current)
+    displaced = set()
+    for position, track_id in enumerate(target):
+        if position < len(arranged) and arranged[position] == track_id:
+            continue
+        if position + 1 < len(arranged) and arranged[position + 1] == track_id:
+            # The row in the way is the one out of place; it's repacked when its turn comes
+            displaced.add(arranged.pop(position))
+            continue
+        if track_id in displaced:
+            displaced.discard(track_id)
+        else:
+            arranged.remove(track_id)
+        arranged.insert(position, track_id)
+        yield (track_id, arranged[position - 1] if position else None,
+               arranged[position + 1] if position + 1 < len(arranged) else None)
+
+class PlaylistRow:
+    def __init__(self, parent, on_play, on_remove):
+        self.track = None
+        self.shown = {}
+
+        self.frame = ttk.Frame(parent, padding=5, relief="flat", borderwidth=1)
+        self.image_label = ttk.Label(self.frame, font=("Arial", 10))
+        self.image_label.pack(side="left", padx=10)
+
+        info_frame = ttk.Frame(self.frame)
+        info_frame.pack(side="left", fill="x", expand=True)
+        self.name_label = ttk.Label(info_frame, font=("Arial", 13, "bold"))
+        self.name_label.pack(anchor="w")
+        self.artist_label = ttk.Label(info_frame, font=("Arial", 11))
+        self.artist_label.pack(anchor="w")
+
+        button_frame = ttk.Frame(self.frame)
+        button_frame.pack(side="right", padx=10)
+        ttk.Button(button_frame, text="Play", command=lambda: on_play(self.track)).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Remove", command=lambda: on_remove(self.track)).pack(side="left", padx=5)
+
+# Playlist rows keyed by track ID; update() only touches the rows that changed
+class PlaylistView:
+    def __init__(self, frame, thumbnails, on_play, on_remove):
+        self.frame = frame
+        self.thumbnails = thumbnails
+        self.on_play = on_play
+        self.on_remove = on_remove
+        self.rows = {}
+        self.order = []
+
+    def update(self, tracks):
+        tracks_by_id = {}
+        for track in tracks:
+            # A hand-edited playlist file can repeat an ID; only its first entry gets a row
+            tracks_by_id.setdefault(track.track_id, track)
+        target = list(tracks_by_id)
+
+        for track_id in [track_id for track_id in self.order if track_id not in tracks_by_id]:
+            self.rows.pop(track_id).frame.destroy()
+        current = [track_id for track_id in self.order if track_id in tracks_by_id]
+        for track_id in target:
+            if track_id not in self.rows:
+                # New rows start at the bottom and are moved into place with the rest
+                self.rows[track_id] = PlaylistRow(self.frame, self.on_play, self.on_remove)
+                self.rows[track_id].frame.pack(pady=5, fill="x")
+                current.append(track_id)
+
+        for track_id, previous_id, next_id in plan_moves(current, target):
+            frame = self.rows[track_id].frame
+            if previous_id is not None:
+                frame.pack(pady=5, fill="x", after=self.rows[previous_id].frame)
+            else:
+                frame.pack(pady=5, fill="x", before=self.rows[next_id].frame)
+
+        for track_id, track in tracks_by_id.items():
+            self.show_track(self.rows[track_id], track)
+        self.order = target
+
+    def show_track(self, row, track):
+        row.track = track
+        shown = {"name": track.name, "artist": track.artist, "image_path": getattr(track, "image_path", "")}
+        previous, row.shown = row.shown, shown
+        if shown["name"] != previous.get("name"):
+            row.name_label.configure(text=f"{track.name}")
+        if shown["artist"] != previous.get("artist"):
+            row.artist_label.configure(text=f"by {track.artist}")
+        if shown["image_path"] != previous.get("image_path"):
+            self.show_image(row, shown["image_path"])
+
+    def show_image(self, row, image_path):
+        if image_path:
+            img_tk = self.thumbnails.request(image_path, IMAGE_SIZE, lambda img: self.set_row_image(row, image_path, img))
+            if img_tk:
+                self.set_row_image(row, image_path, img_tk)
+        else:
+            self.set_row_image(row, image_path, None)
+
+    def set_row_image(self, row, image_path, img_tk):
+        # The row may have been removed or given another cover while this one was decoding
+        if row.shown.get("image_path") != image_path or not row.frame.winfo_exists():
+            return
+        if img_tk:
+            row.image_label.configure(image=img_tk, text="")
+        else:
+            row.image_label.configure(image="", text="No Image")
+        row.image_label.image = img_tk
@@ -0,0 +1,466 @@
+import bisect
+import heapq
+import re
+
+# How much a match in each field counts towards a track's score
+FIELD_WEIGHTS = {"name": 4, "artist": 3, "album": 2, "genre": 1}
+WEIGHTS = tuple(FIELD_WEIGHTS.values())
+EXACT_MATCH, PREFIX_MATCH, SUBSTRING_MATCH = 3, 2, 1
+NGRAM_SIZE = 3
+TOKEN_PATTERN = re.compile(r"\w+")
+# Short terms match through thousands of tokens, so for each n-gram the first this many
+# matching track IDs are kept ready, in ID order
+GRAM_LIST_SIZE = 2048
+# Working out the gram lists for an n-gram in this many tokens is slow enough to do up front
+PREPARED_GRAM_TOKENS = 20000
+# A combination of levels is checked track by track until this many candidates per wanted
+# result have been looked at; past that it's cheaper to work it out with set operations
+SCAN_FACTOR = 4
+SCAN_MINIMUM = 256
+# Checking one track against a term costs about as much as merging this many postings
+CHECK_COST = 8
+
+def matches_by_score():
+    # Every score one term can earn (field weight times match kind), with the (kind, weight)
+    # pairs that earn it
+    matches = {}
+    for weight in WEIGHTS:
+        for kind in (EXACT_MATCH, PREFIX_MATCH, SUBSTRING_MATCH):
+            matches.setdefault(weight * kind, []).append((kind, weight))
+    return matches
+
+MATCHES_BY_SCORE = matches_by_score()
+SCORE_LEVELS = sorted(MATCHES_BY_SCORE, reverse=True)
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+def field_text(value):
+    # A field's tokens between spaces, so exact and prefix matches are substring checks
+    return " " + " ".join(tokenize(value)) + " "
+
+def ngrams(token):
+    for size in range(1, NGRAM_SIZE + 1):
+        for i in range(len(token) - size + 1):
+            yield token[i:i + size]
+
+def insert_sorted(ids, track_id):
+    # IDs mostly arrive in increasing order, so this is usually an append
+    if not ids or ids[-1] < track_id:
+        ids.append(track_id)
+        return
+    i = bisect.bisect_left(ids, track_id)
+    if i == len(ids) or ids[i] != track_id:
+        ids.insert(i, track_id)
+
+def remove_sorted(ids, track_id):
+    i = bisect.bisect_left(ids, track_id)
+    if i < len(ids) and ids[i] == track_id:
+        del ids[i]
+
+class GramList:
+    # The tracks with a token that starts with (or contains) one n-gram at one field weight:
+    # the lowest IDs in order, and how many there are in all
+    __slots__ = ("ids", "count", "complete")
+
+    def __init__(self, ids, count, complete):
+        self.ids = ids
+        self.count = count
+        self.complete = complete
+
+    def add(self, track_id):
+        self.count += 1
+        # IDs past the end of a cut-off list aren't known, so new ones there aren't either
+        if self.complete or (self.ids and track_id < self.ids[-1]):
+            insert_sorted(self.ids, track_id)
+
+    def remove(self, track_id):
+        self.count -= 1
+        remove_sorted(self.ids, track_id)
+
+EMPTY_GRAM_LIST = GramList([], 0, True)
+
+class TermMatches:
+    # The tracks one query term matches, split into levels by the score they get for it (a
+    # track only counts at its best score). Each level can be read in track ID order, which
+    # is all a limited search needs, or worked out in full as a set when reading it one
+    # track at a time would take longer.
+    def __init__(self, index, term):
+        self.index = index
+        self.term = term
+        self.exact = f" {term} "
+        self.prefix = f" {term}"
+        self.scores = {}
+        self.level_sets = {}
+        self.source_lists = {}
+        self.sizes = [sum(count for _, count in self.sources(score)) for score in SCORE_LEVELS]
+        self.positions = [position for position, size in enumerate(self.sizes) if size]
+
+    def sources(self, score):
+        # ((kind, weight), count) for the lists that make up one level; a track can be in more than one
+        return [((kind, weight), count) for kind, weight in MATCHES_BY_SCORE[score]
+                for count in (self.source_count(kind, weight),) if count]
+
+    def source_count(self, kind, weight):
+        if kind == EXACT_MATCH:
+            return len(self.index.postings.get(self.term, {}).get(weight, ()))
+        if len(self.term) <= NGRAM_SIZE:
+            return self.index.gram_list(self.term, kind, weight).count
+        return len(self.source_ids(kind, weight))
+
+    def source_ids(self, kind, weight):
+        # The track IDs for longer terms, which only ever match a handful of tokens
+        if (kind, weight) not in self.source_lists:
+            tokens = self.index.prefix_tokens(self.term) if kind == PREFIX_MATCH else self.index.substring_tokens(self.term)
+            lists = [self.index.postings[token][weight] for token in tokens
+                     if token != self.term and weight in self.index.postings[token]
+                     and (kind == PREFIX_MATCH or not token.startswith(self.term))]
+            self.source_lists[kind, weight] = lists[0] if len(lists) == 1 else sorted(set().union(*lists))
+        return self.source_lists[kind, weight]
+
+    def iter_source(self, kind, weight):
+        if kind == EXACT_MATCH:
+            return iter(self.index.postings[self.term][weight])
+        if len(self.term) <= NGRAM_SIZE:
+            return self.index.iter_gram_list(self.term, kind, weight)
+        return iter(self.source_ids(kind, weight))
+
+    def level_ids(self, position):
+        # Track IDs in this level in ID order, along with some that score better for the term
+        streams = [self.iter_source(*source) for source, _ in self.sources(SCORE_LEVELS[position])]
+        previous = None
+        for track_id in streams[0] if len(streams) == 1 else heapq.merge(*streams):
+            if track_id != previous:
+                previous = track_id
+                yield track_id
+
+    def is_best_level(self, position):
+        # Nothing scores better, so every track read from this level belongs to it
+        return not any(self.sizes[:position])
+
+    def level_set(self, position):
+        if position not in self.level_sets:
+            sources = []
+            for (kind, weight), _ in self.sources(SCORE_LEVELS[position]):
+                if kind != EXACT_MATCH and len(self.term) <= NGRAM_SIZE:
+                    sources.append(self.index.complete_gram_list(self.term, kind, weight))
+                elif kind == EXACT_MATCH:
+                    sources.append(self.index.postings[self.term][weight])
+                else:
+                    sources.append(self.source_ids(kind, weight))
+            ids = set().union(*sources)
+            for better in range(position):
+                if self.sizes[better] and ids:
+                    ids -= self.level_set(better)
+            self.level_sets[position] = ids
+        return self.level_sets[position]
+
+    def score(self, track_id):
+        score = self.scores.get(track_id)
+        if score is None:
+            score = 0
+            term = self.term
+            # Heaviest field first, so the rest can be skipped once they can't do better
+            for text, weight in zip(self.index.texts_by_id[track_id], WEIGHTS):
+                if weight * EXACT_MATCH <= score:
+                    break
+                if term in text:
+                    kind = EXACT_MATCH if self.exact in text else PREFIX_MATCH if self.prefix in text else SUBSTRING_MATCH
+                    score = max(score, weight * kind)
+            self.scores[track_id] = score
+        return score
+
+class SearchIndex:
+    def __init__(self, tracks=()):
+        self.postings = {}       # token -> {field weight: track IDs in order}
+        self.ngram_tokens = {}   # n-gram -> tokens containing it, for substring lookups
+        self.prefix_index = {}   # first 1-3 characters -> tokens starting with them
+        self.texts_by_id = {}    # track_id -> field_text of each field, for scoring and removals
+        self.gram_lists = {}     # n-gram -> {(match kind, field weight): GramList}, made when first needed
+        self.add_tracks(tracks)
+
+    def add_track(self, track):
+        self.add_tracks([track])
+
+    def add_tracks(self, tracks):
+        # Artists, albums and genres repeat, so each distinct value is only tokenized once
+        field_texts = {}
+        postings = self.postings
+        for track in tracks:
+            track_id = track.track_id
+            if track_id in self.texts_by_id:
+                self.remove_track(track_id)
+            texts = []
+            token_weights = {}
+            for field, weight in FIELD_WEIGHTS.items():
+                value = getattr(track, field, "")
+                text_tokens = field_texts.get(value)
+                if text_tokens is None:
+                    text = field_text(value)
+                    text_tokens = field_texts[value] = (text, text.split())
+                texts.append(text_tokens[0])
+                for token in text_tokens[1]:
+                    # Fields come heaviest first, so a token keeps its best weight
+                    if token in token_weights:
+                        continue
+                    token_weights[token] = weight
+                    # Tracks are mostly added in ID order, which only needs an append
+                    ids = postings.get(token, {}).get(weight)
+                    if ids and ids[-1] < track_id:
+                        ids.append(track_id)
+                    else:
+                        self.add_posting(token, weight, track_id)
+            self.texts_by_id[track_id] = tuple(texts)
+            if self.gram_lists:
+                for gram, kind, weight in self.gram_keys(token_weights):
+                    if gram in self.gram_lists:
+                        self.gram_lists[gram].setdefault((kind, weight), GramList([], 0, True)).add(track_id)
+
+    def add_posting(self, token, weight, track_id):
+        weights = self.postings.get(token)
+        if weights is None:
+            weights = self.postings[token] = {}
+            for gram in ngrams(token):
+                self.ngram_tokens.setdefault(gram, set()).add(token)
+            for size in range(1, min(len(token), NGRAM_SIZE) + 1):
+                self.prefix_index.setdefault(token[:size], set()).add(token)
+        ids = weights.get(weight)
+        if ids is None:
+            weights[weight] = [track_id]
+        else:
+            insert_sorted(ids, track_id)
+
+    def remove_track(self, track_id):
+        texts = self.texts_by_id.pop(track_id, None)
+        if texts is None:
+            return
+        token_weights = {}
+        for text, weight in zip(texts, WEIGHTS):
+            for token in text.split():
+                token_weights.setdefault(token, weight)
+        if self.gram_lists:
+            for gram, kind, weight in self.gram_keys(token_weights):
+                if gram in self.gram_lists:
+                    self.gram_lists[gram][kind, weight].remove(track_id)
+        for token, weight in token_weights.items():
+            posting = self.postings[token]
+            remove_sorted(posting[weight], track_id)
+            if not posting[weight]:
+                del posting[weight]
+            if posting:
+                continue
+            del self.postings[token]
+            for gram in set(ngrams(token)):
+                self.ngram_tokens[gram].discard(token)
+                if not self.ngram_tokens[gram]:
+                    del self.ngram_tokens[gram]
+            for size in range(1, min(len(token), NGRAM_SIZE) + 1):
+                self.prefix_index[token[:size]].discard(token)
+                if not self.prefix_index[token[:size]]:
+                    del self.prefix_index[token[:size]]
+
+    def update_track(self, track):
+        self.remove_track(track.track_id)
+        self.add_track(track)
+
+    @staticmethod
+    def gram_keys(token_weights):
+        # The gram lists a track with these tokens belongs to
+        keys = set()
+        for token, weight in token_weights.items():
+            for gram in ngrams(token):
+                if gram != token:
+                    keys.add((gram, PREFIX_MATCH if token.startswith(gram) else SUBSTRING_MATCH, weight))
+        return keys
+
+    def gram_sources(self, gram):
+        # The ID lists of tokens other than the gram itself that start with it or contain it
+        # further in, by (match kind, field weight)
+        sources = {}
+        for token in self.ngram_tokens.get(gram, ()):
+            if token != gram:
+                kind = PREFIX_MATCH if token.startswith(gram) else SUBSTRING_MATCH
+                for weight, ids in self.postings[token].items():
+                    sources.setdefault((kind, weight), []).append(ids)
+        return sources
+
+    def make_gram_lists(self, gram):
+        # Every list for the gram comes out of one pass over its tokens. Postings are in ID
+        # order, so only the start of each is needed for a list that gets cut off. The count
+        # can be a little high when a track has more than one of the tokens.
+        lists = self.gram_lists[gram] = {}
+        for key, sources in self.gram_sources(gram).items():
+            count = sum(map(len, sources))
+            if count <= GRAM_LIST_SIZE:
+                ids = set().union(*sources)
+                lists[key] = GramList(sorted(ids), len(ids), True)
+            else:
+                ids = set().union(*(ids if len(ids) <= GRAM_LIST_SIZE else ids[:GRAM_LIST_SIZE] for ids in sources))
+                lists[key] = GramList(heapq.nsmallest(GRAM_LIST_SIZE, ids), count, False)
+        return lists
+
+    def gram_list(self, gram, kind, weight):
+        lists = self.gram_lists.get(gram)
+        if lists is None:
+            lists = self.make_gram_lists(gram)
+        return lists.get((kind, weight), EMPTY_GRAM_LIST)
+
+    def complete_gram_list(self, gram, kind, weight):
+        # Reading past the IDs kept ready means working out the rest; they're kept from then on
+        entry = self.gram_list(gram, kind, weight)
+        if not entry.complete:
+            entry.ids = sorted(set().union(*self.gram_sources(gram)[kind, weight]))
+            entry.count = len(entry.ids)
+            entry.complete = True
+        return entry.ids
+
+    def iter_gram_list(self, gram, kind, weight):
+        entry = self.gram_list(gram, kind, weight)
+        seen = entry.ids
+        yield from seen
+        if not entry.complete:
+            ids = self.complete_gram_list(gram, kind, weight)
+            yield from ids[bisect.bisect_right(ids, seen[-1]) if seen else 0:]
+
+    def prepare_short_terms(self, should_stop=lambda: False):
+        # Works out the gram lists that take a while ahead of the first searches, e.g. on the
+        # thread that built the index
+        for gram, tokens in list(self.ngram_tokens.items()):
+            if should_stop():
+                return
+            if len(tokens) >= PREPARED_GRAM_TOKENS and gram not in self.gram_lists:
+                self.make_gram_lists(gram)
+
+    def search(self, query, limit=None):
+        # Every term has to match somewhere in the track, and a track's score is the sum of its
+        # best score for each term
+        if limit is None:
+            return self.search_all(query)
+        # Combinations of one score level per term are visited from the highest total down, so
+        # once `limit` tracks are in and the current total is done, no lower one can change the
+        # result. Each combination is read in track ID order and stops once it has enough.
+        terms = [TermMatches(self, term) for term in tokenize(query)]
+        if not terms or not all(term.positions for term in terms):
+            return []
+        start = (0,) * len(terms)
+        queue = [(-self.total(terms, start), start)]
+        queued = {start}
+        results = []
+        group_total, group = None, set()
+        while queue:
+            negative_total, steps = heapq.heappop(queue)
+            if -negative_total != group_total:
+                self.take_group(results, group, limit)
+                if len(results) >= limit:
+                    break
+                group_total, group = -negative_total, set()
+            positions = [term.positions[step] for term, step in zip(terms, steps)]
+            group.update(self.matching_combination(terms, positions, limit - len(results)))
+            for i, term in enumerate(terms):
+                if steps[i] + 1 < len(term.positions):
+                    following = steps[:i] + (steps[i] + 1,) + steps[i + 1:]
+                    if following not in queued:
+                        queued.add(following)
+                        heapq.heappush(queue, (-self.total(terms, following), following))
+        else:
+            self.take_group(results, group, limit)
+        return results
+
+    def search_all(self, query):
+        # Every match has to be scored anyway, so this simply walks the postings
+        scores = None
+        for term in tokenize(query):
+            term_scores = self.match_term(term)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {track_id: scores[track_id] + score
+                          for track_id, score in term_scores.items() if track_id in scores}
+            if not scores:
+                return []
+        if not scores:
+            return []
+        return sorted(scores, key=lambda track_id: (-scores[track_id], track_id))
+
+    def match_term(self, term):
+        matches = {}
+        for token in self.substring_tokens(term):
+            if token == term:
+                kind = EXACT_MATCH
+            elif token.startswith(term):
+                kind = PREFIX_MATCH
+            else:
+                kind = SUBSTRING_MATCH
+            for weight, track_ids in self.postings[token].items():
+                score = weight * kind
+                for track_id in track_ids:
+                    if score > matches.get(track_id, 0):
+                        matches[track_id] = score
+        return matches
+
+    def matching_combination(self, terms, positions, wanted):
+        # The lowest `wanted` track IDs at the given level for every term. The smallest level is
+        # read in ID order and each track checked against the other terms; if too few pass,
+        # the levels are worked out as sets instead.
+        driver = min(range(len(terms)), key=lambda i: terms[i].sizes[positions[i]])
+        checks = [(term, SCORE_LEVELS[position]) for i, (term, position) in enumerate(zip(terms, positions))
+                  if i != driver or not term.is_best_level(position)]
+        others = sum(term.sizes[position] for i, (term, position) in enumerate(zip(terms, positions)) if i != driver)
+        budget = max(wanted * SCAN_FACTOR, SCAN_MINIMUM, others // CHECK_COST)
+        matches = []
+        for scanned, track_id in enumerate(terms[driver].level_ids(positions[driver])):
+            if scanned == budget:
+                return heapq.nsmallest(wanted, self.matching_set(terms, positions))
+            for term, score in checks:
+                if term.score(track_id) != score:
+                    break
+            else:
+                matches.append(track_id)
+                if len(matches) == wanted:
+                    break
+        return matches
+
+    @staticmethod
+    def matching_set(terms, positions):
+        # The smallest levels go first, so the candidates shrink quickly; once only a few are
+        # left, the other terms are checked against those tracks rather than worked out
+        candidates = None
+        for term, position in sorted(zip(terms, positions), key=lambda pair: pair[0].sizes[pair[1]]):
+            if candidates is not None and len(candidates) * CHECK_COST < term.sizes[position] \
+                    and position not in term.level_sets:
+                score = SCORE_LEVELS[position]
+                candidates = {track_id for track_id in candidates if term.score(track_id) == score}
+            else:
+                ids = term.level_set(position)
+                candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return set()
+        return candidates
+
+    @staticmethod
+    def total(terms, steps):
+        return sum(SCORE_LEVELS[term.positions[step]] for term, step in zip(terms, steps))
+
+    @staticmethod
+    def take_group(results, group, limit):
+        # Tracks with the same score come in track ID order
+        if len(results) < limit:
+            results.extend(heapq.nsmallest(limit - len(results), group))
+
+    def prefix_tokens(self, term):
+        tokens = self.prefix_index.get(term[:NGRAM_SIZE], ())
+        if len(term) <= NGRAM_SIZE:
+            return tokens
+        return [token for token in tokens if token.startswith(term)]
+
+    def substring_tokens(self, term):
+        if len(term) <= NGRAM_SIZE:
+            return self.ngram_tokens.get(term, set())
+
+        candidates = None
+        for i in range(len(term) - NGRAM_SIZE + 1):
+            tokens = self.ngram_tokens.get(term[i:i + NGRAM_SIZE], set())
+            candidates = tokens if candidates is None else candidates & tokens
+            if not candidates:
+                return set()
+        return {token for token in candidates if term in token}
@@ -0,0 +1,88 @@
+import base64
+import bisect
+import json
+from field_index import release_year
+
+# Numbers sort highest first, matching the playlist sort, so their keys are negated
+SORT_KEYS = {
+    "name": lambda track: track.name,
+    "artist": lambda track: track.artist,
+    "rating": lambda track: -track.rating,
+    "play_count": lambda track: -track.play_count,
+    "release_year": lambda track: -release_year(track),
+    "track_id": lambda track: track.track_id,
+}
+# Sort keys that compare text; the rest are whole numbers
+TEXT_SORT_KEYS = ("name", "artist")
+
+def encode_cursor(order_by, entry):
+    # A cursor is the (sort key, track ID) of the last track handed out, so the next page
+    # starts right after it even if tracks were added or removed in between
+    return base64.urlsafe_b64encode(json.dumps([order_by, *entry]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor, order_by):
+    try:
+        cursor_order, key, track_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}") from None
+    if cursor_order != order_by:
+        raise ValueError(f"The cursor is for tracks ordered by {cursor_order}, not {order_by}")
+    # An edited cursor could otherwise put e.g. a string where the view compares numbers
+    key_type = str if order_by in TEXT_SORT_KEYS else int
+    if type(key) is not key_type or type(track_id) is not int:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return key, track_id
+
+class SortedView:
+    # Track IDs kept in order of one sort key. Changing a track moves just its own
+    # entry, so the order never has to be rebuilt after ratings or play counts change.
+    def __init__(self, order_by, tracks=()):
+        self.key = SORT_KEYS[order_by]
+        self.key_by_id = {track.track_id: self.key(track) for track in tracks}
+        self.entries = sorted((key, track_id) for track_id, key in self.key_by_id.items())
+
+    def add_track(self, track):
+        key = self.key(track)
+        self.key_by_id[track.track_id] = key
+        bisect.insort(self.entries, (key, track.track_id))
+
+    def remove_track(self, track_id):
+        if track_id not in self.key_by_id:
+            return
+        entry = (self.key_by_id.pop(track_id), track_id)
+        del self.entries[bisect.bisect_left(self.entries, entry)]
+
+    def update_track(self, track):
+        if self.key_by_id.get(track.track_id) == self.key(track):
+            return
+        self.remove_track(track.track_id)
+        self.add_track(track)
+
+    def sort_key(self, track_id):
+        return (self.key_by_id[track_id], track_id)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [track_id for _, track_id in self.entries[index]]
+        return self.entries[index][1]
+
+class SortedTracks:
+    # Sequence of tracks backed by a SortedView; only the rows actually read are looked up
+    def __init__(self, view, tracks_by_id):
+        self.view = view
+        self.tracks_by_id = tracks_by_id
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.tracks_by_id[track_id] for track_id in self.view[index]]
+        return self.tracks_by_id[self.view[index]]
+
+    def __iter__(self):
+        for _, track_id in self.view.entries:
+            yield self.tracks_by_id[track_id]
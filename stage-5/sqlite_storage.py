@@ -0,0 +1,154 @@
+import argparse
+import sqlite3
+import threading
+from library_item import CsvStorage, StorageChanges, TrackLibrary, LOAD_CHUNK_SIZE, TRACK_FIELDS, make_track, track_fields
+
+DATABASE_FILE = "tracks_data.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    track_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    play_count INTEGER NOT NULL DEFAULT 0,
+    image_path TEXT NOT NULL DEFAULT '',
+    album TEXT NOT NULL DEFAULT '',
+    release_year INTEGER NOT NULL DEFAULT 0,
+    genre TEXT NOT NULL DEFAULT '',
+    track_number INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist);
+CREATE INDEX IF NOT EXISTS tracks_genre ON tracks (genre);
+CREATE INDEX IF NOT EXISTS tracks_rating ON tracks (rating);
+CREATE INDEX IF NOT EXISTS tracks_play_count ON tracks (play_count);
+"""
+
+TRACK_COLUMNS = "track_id, name, artist, rating, play_count, image_path, album, release_year, genre, track_number"
+
+def row_values(track):
+    values = track_fields(track)
+    # Plain items have no album details, so store the defaults load_tracks would give them
+    return values[:7] + (values[7] or 0, values[8], values[9] or 0)
+
+class SqliteStorage:
+    supports_row_updates = True
+    journal_size = 0
+
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        # The GUI and the service write from a background thread while the main one reads,
+        # so every use of the shared connection goes through self.lock. One connection per
+        # thread wouldn't do: data_version would then count our own commits as someone else's.
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.data_version = None
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def load_chunks(self, chunk_size=LOAD_CHUNK_SIZE):
+        # The lock is only held for each fetch, not while the caller works through a chunk
+        with self.lock:
+            cursor = self.connection.execute(f"SELECT {TRACK_COLUMNS} FROM tracks ORDER BY rowid")
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [make_track(*row) for row in rows]
+
+    def finish_load(self, tracks_by_id):
+        self.data_version = self.read_data_version()
+
+    def read_data_version(self):
+        # Changes whenever another connection commits, in this process or another one
+        with self.lock:
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def locked(self, shared=False):
+        # SQLite locks the database against other processes itself, and plays are added to the
+        # stored counts rather than overwriting them, so this only keeps our own threads from
+        # catching up and writing at the same time
+        return self.lock
+
+    def changes_base(self):
+        return self.data_version
+
+    def read_changes(self):
+        # SQLite can't say which rows changed, so any commit from elsewhere means a reload
+        data_version = self.read_data_version()
+        if data_version == self.data_version:
+            return None
+        return StorageChanges(self.data_version, data_version, tracks=self.load_all())
+
+    def accept_changes(self, changes):
+        if changes.base != self.data_version:
+            return False
+        self.data_version = changes.version
+        return True
+
+    def load_all(self):
+        return {track.track_id: track for chunk in self.load_chunks() for track in chunk}
+
+    def save_tracks(self, tracks):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM tracks")
+            self.connection.executemany(f"INSERT INTO tracks ({TRACK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        (row_values(track) for track in tracks))
+
+    def write_changes(self, tracks, removed_ids, edited_fields=None):
+        # New tracks are written whole. Tracks edited here only get the edited columns, so
+        # the plays other connections add to play_count in the meantime aren't written over.
+        edited_fields = edited_fields or {}
+        new_rows = []
+        updates = {}
+        for track in tracks:
+            fields = edited_fields.get(track.track_id)
+            if fields is None:
+                new_rows.append(row_values(track))
+            elif fields:
+                values = dict(zip(TRACK_FIELDS, row_values(track)))
+                columns = tuple(sorted(fields))
+                updates.setdefault(columns, []).append([values[column] for column in columns] + [track.track_id])
+        with self.lock, self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO tracks ({TRACK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        new_rows)
+            for columns, rows in updates.items():
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                self.connection.executemany(f"UPDATE tracks SET {assignments} WHERE track_id = ?", rows)
+            self.connection.executemany("DELETE FROM tracks WHERE track_id = ?", [(track_id,) for track_id in removed_ids])
+
+    def record_plays(self, play_counts):
+        with self.lock, self.connection:
+            self.connection.executemany("UPDATE tracks SET play_count = play_count + ? WHERE track_id = ?",
+                                        [(count, track_id) for track_id, count in play_counts.items()])
+
+    def set_rating(self, track_id, rating):
+        self.set_ratings({track_id: rating})
+
+    def set_ratings(self, ratings):
+        with self.lock, self.connection:
+            self.connection.executemany("UPDATE tracks SET rating = ? WHERE track_id = ?",
+                                        [(rating, track_id) for track_id, rating in ratings.items()])
+
+def import_csv_library(csv_path, database_path):
+    # Loading through CsvStorage also folds in any journaled plays that haven't been compacted yet.
+    # Playlists aren't copied: PlaylistStore keeps them in playlists/ for either storage.
+    library = TrackLibrary(storage=CsvStorage(csv_path))
+    storage = SqliteStorage(database_path)
+    storage.save_tracks(library.list_all())
+    storage.close()
+    return len(library.list_all())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import tracks_data.csv into an SQLite library.")
+    parser.add_argument("--csv", default="tracks_data.csv")
+    parser.add_argument("--database", default=DATABASE_FILE)
+    args = parser.parse_args()
+
+    track_count = import_csv_library(args.csv, args.database)
+    print(f"Imported {track_count} tracks into {args.database}")
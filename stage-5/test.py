@@ -0,0 +1,808 @@
+import os
+import pytest
+import library_item
+from library_item import LibraryItem, LibraryItemAlbum, TrackLibrary
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    data_file = tmp_path / "tracks_data.csv"
+    data_file.write_text(
+        "Track ID,Name,Artist,Rating,Play Count,Image Path,Album,Release Year,Genre,Track Number\n"
+        "1,DDU-DU-DDU-DU,BLACKPINK,4,141,,SQUARE UP,2018,K-Pop,1\n"
+        "2,Kill This Love,BLACKPINK,5,129,,KILL THIS LOVE,2019,K-Pop,2\n"
+        "3,Blinding Lights,The Weeknd,5,98,,After Hours,2020,Synth-Pop,3\n"
+        "4,Loose Track,Someone,3,0,,,,,\n",
+        encoding="utf-8"
+    )
+    monkeypatch.setattr(library_item, "DATA_FILE", str(data_file))
+    return TrackLibrary()
+
+def test_load_tracks(library):
+    tracks = library.list_all()
+    assert [track.track_id for track in tracks] == [1, 2, 3, 4]
+    assert isinstance(tracks[0], LibraryItemAlbum)
+    assert type(tracks[3]) is LibraryItem
+
+def test_get_track_by_id(library):
+    assert library.get_track_by_id(3).name == "Blinding Lights"
+    assert library.get_track_by_id(99) is None
+
+def test_add_track_is_indexed(library):
+    library.add_track(LibraryItem(5, "New Track", "New Artist", 2))
+    assert library.get_track_by_id(5).name == "New Track"
+    assert TrackLibrary().get_track_by_id(5).name == "New Track"
+
+def test_remove_track_keeps_index_in_sync(library):
+    library.remove_track(2)
+    assert library.get_track_by_id(2) is None
+    assert [track.track_id for track in library.list_all()] == [1, 3, 4]
+    assert TrackLibrary().get_track_by_id(2) is None
+
+def test_record_play_is_journaled_and_replayed(library):
+    library.record_play(library.get_track_by_id(1))
+    library.record_play(library.get_track_by_id(1))
+    library.rate_track(library.get_track_by_id(3), 2)
+    assert library.get_track_by_id(1).play_count == 143
+
+    reloaded = TrackLibrary()
+    assert reloaded.get_track_by_id(1).play_count == 143
+    assert reloaded.get_track_by_id(3).rating == 2
+    assert reloaded.storage.journal_size == 3
+
+def test_compact_journal_folds_into_snapshot(library, monkeypatch):
+    monkeypatch.setattr(library_item, "JOURNAL_COMPACT_LIMIT", 2)
+    library.record_play(library.get_track_by_id(2))
+    library.record_play(library.get_track_by_id(2))
+    assert library.storage.journal_size == 0
+    assert not os.path.exists(library.storage.journal_file)
+    assert TrackLibrary().get_track_by_id(2).play_count == 131
+
+def test_thumbnail_disk_cache(tmp_path):
+    from PIL import Image
+    from thumbnail_cache import ThumbnailCache
+
+    image_path = str(tmp_path / "cover.png")
+    Image.new("RGB", (300, 300), "red").save(image_path)
+    cache = ThumbnailCache(folder=str(tmp_path / "thumbs"))
+    mtime = os.stat(image_path).st_mtime_ns
+
+    assert cache.load_resized(image_path, (80, 80), mtime).size == (80, 80)
+    assert len(os.listdir(tmp_path / "thumbs")) == 1
+    assert cache.load_resized(image_path, (80, 80), mtime).size == (80, 80)
+    assert len(os.listdir(tmp_path / "thumbs")) == 1
+
+def test_search_ranks_name_matches_first(library):
+    assert [track.track_id for track in library.search("love")] == [2]
+    assert [track.track_id for track in library.search("blackpink")] == [1, 2]
+    assert [track.track_id for track in library.search("ddu du")] == [1]
+    assert [track.track_id for track in library.search("pop")] == [1, 2, 3]
+    assert [track.track_id for track in library.search("ink kill")] == [2]
+    assert library.search("nothing matches") == []
+
+def test_search_follows_edits_and_removals(library):
+    track = library.get_track_by_id(3)
+    library.edit_track(track, name="Save Your Tears", rating=4)
+    assert library.search("blinding") == []
+    assert library.search("tears") == [track]
+    assert track.rating == 4
+
+    library.remove_track(3)
+    assert library.search("tears") == []
+    library.add_track(LibraryItem(5, "Tears Again", "Someone", 2))
+    assert [t.track_id for t in library.search("tear")] == [5]
+
+def test_limited_search_matches_the_full_ranking():
+    import random
+    from search_index import SearchIndex
+
+    rng = random.Random(0)
+    words = ["love", "lovely", "glove", "pop", "k", "rock", "night", "nightcall", "12", "123", "312"]
+    tracks = [LibraryItemAlbum(track_id, " ".join(rng.sample(words, 2)), rng.choice(words), 3,
+                               album=rng.choice(words), genre=rng.choice(words)) for track_id in range(1, 400)]
+    index = SearchIndex(tracks)
+    for track in tracks[::5]:
+        index.remove_track(track.track_id)
+    for query in ["love", "lo", "ove", "pop k", "night 12", "1 2", "3", "lovely rock pop", "zz"]:
+        ranking = index.search(query)
+        for limit in (1, 10, 50):
+            assert index.search(query, limit) == ranking[:limit]
+
+def test_cut_off_gram_lists_follow_edits(monkeypatch):
+    import random
+    import search_index
+
+    monkeypatch.setattr(search_index, "GRAM_LIST_SIZE", 8)
+    rng = random.Random(1)
+    words = ["love", "glove", "pop", "k", "rock", "12", "123", "312"]
+
+    def make_track(track_id):
+        return LibraryItemAlbum(track_id, " ".join(rng.sample(words, 2)), rng.choice(words), 3,
+                                album=rng.choice(words), genre=rng.choice(words))
+
+    index = search_index.SearchIndex(make_track(track_id) for track_id in range(1, 300))
+    queries = ["lo", "ov", "1", "12 p", "k 3", "o"]
+    for query in queries:
+        index.search(query, 5)
+    # Edits and removals land in the gram lists the searches above filled in
+    for track_id in range(1, 300, 3):
+        index.remove_track(track_id)
+    for track_id in range(2, 300, 7):
+        index.update_track(make_track(track_id))
+    for query in queries:
+        ranking = index.search(query)
+        for limit in (1, 10, 50):
+            assert index.search(query, limit) == ranking[:limit]
+
+def test_search_index_built_in_the_background(library):
+    tracks = library.start_search_index()
+    library.edit_track(library.get_track_by_id(3), name="Save Your Tears")
+    library.remove_track(2)
+    from search_index import SearchIndex
+    assert library.install_search_index(SearchIndex(tracks))
+    assert [t.track_id for t in library.search("tears")] == [3]
+    assert library.search("kill") == []
+    assert [t.track_id for t in library.search("blackpink", limit=1)] == [1]
+
+def test_failed_background_search_index(library):
+    library.start_search_index()
+    library.edit_track(library.get_track_by_id(3), name="Save Your Tears")
+    library.cancel_search_index()
+    assert library.search_index_changes is None
+    assert [t.track_id for t in library.search("tears")] == [3]
+
+def test_library_items_use_slots():
+    track = LibraryItemAlbum(1, "Name", "Artist", 3, album="Album")
+    assert not hasattr(track, "__dict__")
+    with pytest.raises(AttributeError):
+        track.unknown_field = 1
+
+def test_edit_track_ignores_album_fields_on_plain_items(library):
+    track = library.get_track_by_id(4)
+    library.edit_track(track, name="Renamed", album="Some Album")
+    assert track.name == "Renamed"
+    assert not hasattr(track, "album")
+
+def test_track_table_row_views(library):
+    from track_table import TrackTable
+
+    table = TrackTable(library.list_all())
+    assert len(table) == 4
+    row = table.get_track_by_id(2)
+    assert row.get_details() == library.get_track_by_id(2).get_details()
+    assert table[3].get_details() == library.get_track_by_id(4).get_details()
+    assert row.get_album_info() == "Album: KILL THIS LOVE, Released: 2019, Genre: K-Pop"
+
+    row.increment_play_count()
+    row.set_rating(1)
+    assert (table.play_counts[1], table.ratings[1]) == (130, 1)
+    with pytest.raises(ValueError, match="Rating must be an integer between 1 and 5"):
+        row.set_rating(9)
+    assert table.artists[0] is table.artists[1]
+
+def test_iter_load_yields_chunks(library):
+    fresh = TrackLibrary(load=False)
+    chunks = [len(chunk) for chunk in fresh.iter_load(chunk_size=3)]
+    assert chunks == [3, 1]
+    assert len(fresh.list_all()) == 4
+
+def test_saving_mid_load_finishes_loading_first(library):
+    fresh = TrackLibrary(load=False)
+    loader = fresh.start_loading(chunk_size=1)
+    next(loader)
+    fresh.record_play(fresh.get_track_by_id(1))
+    assert len(fresh.list_all()) == 4
+    fresh.save_tracks()
+    assert len(TrackLibrary().list_all()) == 4
+    assert TrackLibrary().get_track_by_id(1).play_count == 142
+
+def test_track_pager_reads_pages_on_demand(library):
+    from track_pager import TrackPager
+
+    pager = TrackPager(library_item.DATA_FILE, page_size=3, cached_pages=1)
+    assert len(pager) == 4
+    assert pager[3].name == "Loose Track"
+    assert pager[0].name == "DDU-DU-DDU-DU"
+    assert list(pager.pages) == [0]
+    assert [track.track_id for track in pager] == [1, 2, 3, 4]
+
+    # A row that doesn't parse keeps its place: looking it up fails, iterating skips it
+    with open(library_item.DATA_FILE, "a", encoding="utf-8") as f:
+        f.write("x,Broken,Someone,2,0,,,,,\n5,New Song,Someone,2,0,,,,,\n")
+    pager = TrackPager(library_item.DATA_FILE, page_size=3)
+    assert len(pager) == 6 and pager[5].name == "New Song"
+    with pytest.raises(ValueError):
+        pager[4]
+    assert [track.track_id for track in pager.iter_tracks(3, 3)] == [4, 5]
+
+def test_sqlite_storage_round_trip(library, tmp_path):
+    from sqlite_storage import SqliteStorage, import_csv_library
+
+    database = str(tmp_path / "tracks.db")
+    assert import_csv_library(library_item.DATA_FILE, database) == 4
+
+    sqlite_library = TrackLibrary(storage=SqliteStorage(database))
+    assert [t.get_details() for t in sqlite_library.list_all()] == [t.get_details() for t in library.list_all()]
+
+    sqlite_library.record_play(sqlite_library.get_track_by_id(3))
+    sqlite_library.edit_track(sqlite_library.get_track_by_id(4), name="Renamed")
+    sqlite_library.remove_track(1)
+    sqlite_library.add_track(LibraryItem(9, "Added", "Someone", 2))
+
+    reloaded = TrackLibrary(storage=SqliteStorage(database))
+    assert reloaded.get_track_by_id(3).play_count == 99
+    assert reloaded.get_track_by_id(4).name == "Renamed"
+    assert reloaded.get_track_by_id(1) is None
+    assert reloaded.get_track_by_id(9).name == "Added"
+
+def test_record_plays_is_one_batch(library):
+    library.record_plays([1, 3, 1])
+    assert (library.get_track_by_id(1).play_count, library.get_track_by_id(3).play_count) == (143, 99)
+    assert TrackLibrary().get_track_by_id(1).play_count == 143
+
+    with pytest.raises(ValueError, match="Unknown track ID"):
+        library.record_plays([2, 42])
+    assert library.get_track_by_id(2).play_count == 129
+
+def test_torn_journal_batch_is_ignored(library):
+    library.record_plays([1, 2])
+    with open(library.storage.journal_file, "a", encoding="utf-8") as f:
+        f.write("3,Play Count,1\n")
+    reloaded = TrackLibrary()
+    assert reloaded.get_track_by_id(1).play_count == 142
+    assert reloaded.get_track_by_id(3).play_count == 98
+
+def test_flush_batches_queued_changes(library):
+    library.autosave = False
+    library.queue_plays([1, 1])
+    library.edit_track(library.get_track_by_id(2), name="Renamed")
+    assert library.has_unsaved_changes()
+    assert TrackLibrary().get_track_by_id(2).name == "Kill This Love"
+
+    library.flush()
+    assert not library.has_unsaved_changes()
+    reloaded = TrackLibrary()
+    assert reloaded.get_track_by_id(2).name == "Renamed"
+    assert reloaded.get_track_by_id(1).play_count == 143
+
+class FakeRoot:
+    def __init__(self):
+        self.callbacks = {}
+        self.next_id = 0
+
+    def after(self, delay_ms, callback):
+        self.next_id += 1
+        self.callbacks[self.next_id] = callback
+        return self.next_id
+
+    def after_cancel(self, after_id):
+        self.callbacks.pop(after_id, None)
+
+def test_io_executor_coalesces_and_flushes():
+    from io_worker import IOExecutor
+
+    root = FakeRoot()
+    executor = IOExecutor(root)
+    calls = []
+    for i in range(10):
+        executor.submit_coalesced("library", calls.append, i)
+    executor.submit_coalesced("other", calls.append, "other")
+    executor.flush()
+    assert sorted(calls, key=str) == [9, "other"]
+
+def test_filter_tracks_with_secondary_indexes(library):
+    assert library.get_field_values("artist") == ["BLACKPINK", "Someone", "The Weeknd"]
+    assert library.get_field_values("decade") == [2010, 2020]
+    assert [t.track_id for t in library.filter_tracks(artist="BLACKPINK")] == [1, 2]
+    assert [t.track_id for t in library.filter_tracks(genre="K-Pop", decade=2010)] == [1, 2]
+    assert [t.track_id for t in library.filter_tracks(artist=["BLACKPINK", "The Weeknd"], decade=2020)] == [3]
+    assert library.filter_tracks(artist="BLACKPINK", genre="Synth-Pop") == []
+
+    library.edit_track(library.get_track_by_id(3), artist="Weeknd")
+    assert "The Weeknd" not in library.get_field_values("artist")
+    assert [t.track_id for t in library.filter_tracks(artist="Weeknd")] == [3]
+    library.remove_track(1)
+    assert [t.track_id for t in library.filter_tracks(artist="BLACKPINK")] == [2]
+
+def test_sorted_views_follow_changes(library):
+    by_plays = library.sorted_tracks("play_count")
+    assert [t.track_id for t in by_plays] == [1, 2, 3, 4]
+    assert [t.track_id for t in library.sorted_tracks("name")[:2]] == [3, 1]
+
+    library.record_plays([4] * 200)
+    assert [t.track_id for t in by_plays[:2]] == [4, 1]
+    library.rate_track(library.get_track_by_id(4), 5)
+    assert [t.track_id for t in library.sorted_tracks("rating")] == [2, 3, 4, 1]
+    library.edit_track(library.get_track_by_id(3), name="A Song")
+    assert library.sorted_tracks("name")[0].track_id == 3
+    library.remove_track(4)
+    assert [t.track_id for t in by_plays] == [1, 2, 3]
+
+    playlist = [library.get_track_by_id(3), library.get_track_by_id(1)]
+    assert [t.track_id for t in library.sort_tracks(playlist, "play_count")] == [1, 3]
+
+def test_top_tracks(library):
+    assert [t.track_id for t in library.top_tracks(2)] == [1, 2]
+    library.record_plays([3] * 50)
+    assert [t.track_id for t in library.top_tracks(2)] == [3, 1]
+    assert [t.track_id for t in library.top_tracks(1, by="rating")] == [2]
+
+def test_play_history_rollups(tmp_path, library):
+    import time
+    from play_history import PlayHistory, EVENT, DAY
+    history = PlayHistory(str(tmp_path / "history.bin"))
+    library.history = history
+    history.open()
+    now = time.time()
+    history.record({3: 2}, {3: "The Weeknd"}, timestamp=now - 10 * DAY)
+    library.record_plays([1, 1, 3])
+    library.queue_plays([2])
+    assert library.plays_in_last(7) == 4
+    assert library.plays_in_last(7, track=library.get_track_by_id(1)) == 2
+    assert library.plays_in_last(7, artist="BLACKPINK") == 3
+    assert library.plays_in_last(30, artist="The Weeknd") == 3
+    history.record({4: 70000})
+    assert sum(count for _, track_id, count in history.iter_events() if track_id == 4) == 70000
+    history.close()
+
+    # Reopening picks up the checkpointed totals and replays anything logged after them
+    with open(history.path, "ab") as f:
+        f.write(EVENT.pack(int(now), 2, 5))
+    reopened = PlayHistory(history.path)
+    reopened.open(lambda track_id: library.get_track_by_id(track_id).artist)
+    assert reopened.plays_in_last(7, artist="BLACKPINK") == 8
+    assert reopened.plays_in_last(7, track_id=4) == 70000
+    reopened.close()
+
+def test_play_history_shared_log_with_torn_event(tmp_path):
+    from play_history import PlayHistory, EVENT
+    path = str(tmp_path / "history.bin")
+    first = PlayHistory(path)
+    first.open()
+    first.record({1: 1})
+    first.flush()
+    # A crash part-way through an event; it's cut off rather than shifting what comes after
+    with open(path, "ab") as f:
+        f.write(b"\x01\x05\x00")
+    second = PlayHistory(path)
+    second.open()
+    second.record({2: 3})
+    first.record({1: 2})
+    second.flush()
+    first.flush()
+    # Each one counts the other's plays, and the offset is the end of the log
+    assert (first.plays_in_last(1, track_id=2), second.plays_in_last(1, track_id=1)) == (3, 1)
+    assert first.log_offset == 3 * EVENT.size
+    assert sorted((track_id, count) for _, track_id, count in first.iter_events()) == [(1, 1), (1, 2), (2, 3)]
+    first.close()
+    second.close()
+    reopened = PlayHistory(path)
+    reopened.open()
+    assert (reopened.plays_in_last(1, track_id=1), reopened.plays_in_last(1, track_id=2)) == (3, 3)
+    reopened.close()
+
+def test_instrumentation_histograms():
+    from instrumentation import Instrumentation
+    stats = Instrumentation()
+
+    @stats.timed("double")
+    def double(value):
+        return value * 2
+
+    assert double(2) == 4
+    assert stats.summary() == []
+
+    stats.enabled = True
+    for _ in range(10):
+        double(1)
+    with stats.measure("block"):
+        pass
+    for seconds in [0.001] * 98 + [0.5, 0.5]:
+        stats.record("fake", seconds)
+    summary = {name: (count, p50, p99, slowest) for name, count, p50, p99, slowest in stats.summary()}
+    assert summary["double"][0] == 10
+    assert summary["block"][0] == 1
+    count, p50, p99, slowest = summary["fake"]
+    assert count == 100
+    assert 0.001 <= p50 < 0.002
+    assert p99 == slowest == 0.5
+
+def test_playlist_view_plans_few_moves():
+    from playlist_view import plan_moves
+
+    def apply(order, moves):
+        order = list(order)
+        for track_id, previous_id, next_id in moves:
+            order.remove(track_id)
+            order.insert(order.index(previous_id) + 1 if previous_id is not None else order.index(next_id), track_id)
+        return order
+
+    assert list(plan_moves([1, 2, 3], [1, 2, 3])) == []
+    assert list(plan_moves([1, 2, 3, 4, 5], [5, 1, 2, 3, 4])) == [(5, None, 1)]
+    assert list(plan_moves([1, 2, 3, 4, 5], [1, 3, 4, 5, 2])) == [(2, 5, None)]
+    for target in ([3, 1, 2], [2, 3, 1], [3, 2, 1], [1, 3, 2]):
+        assert apply([1, 2, 3], plan_moves([1, 2, 3], target)) == target
+
+def test_track_cache_follows_csv(library):
+    storage = library.storage
+    assert os.path.exists(storage.cache_file)
+    assert storage.read_cache() is not None
+    warm = TrackLibrary()
+    assert [t.get_details() for t in warm.list_all()] == [t.get_details() for t in library.list_all()]
+    assert [t.track_id for t in warm.search("blinding")] == [3]
+
+    with open(library_item.DATA_FILE, "a", encoding="utf-8") as f:
+        f.write("5,New Song,Someone,2,0,,,,,\n")
+    assert storage.read_cache() is None
+    assert TrackLibrary().get_track_by_id(5).name == "New Song"
+
+    # A CSV replaced while it was being read isn't cached under the new file's signature
+    os.remove(storage.cache_file)
+    chunks = storage.read_chunks(chunk_size=1)
+    next(chunks)
+    with open(library_item.DATA_FILE, "a", encoding="utf-8") as f:
+        f.write("6,Newer Song,Someone,2,0,,,,,\n")
+    list(chunks)
+    assert not os.path.exists(storage.cache_file)
+
+def test_playlist_store(tmp_path):
+    from playlist_store import PlaylistStore, RECORD, MAGIC, COMPACT_SLACK
+    folder = tmp_path / "playlists"
+    folder.mkdir()
+    (folder / "Old.csv").write_text("Track ID,Name,Artist\n3,Blinding Lights,The Weeknd\n1,DDU-DU-DDU-DU,BLACKPINK\n3,Blinding Lights,The Weeknd\n",
+                                    encoding="utf-8")
+
+    store = PlaylistStore(str(folder))
+    assert store.open() == ["Old"]
+    assert (folder / "Old.csv.migrated").exists()
+    assert store.get_ids("Old") == [3, 1]
+
+    store.create("New")
+    assert store.add("New", 2) and store.add("New", 4)
+    assert not store.add("New", 2)
+    store.flush()
+    size = os.path.getsize(store.path("New"))
+    assert store.remove("New", 2)
+    assert store.add("Old", 2)
+    store.flush()
+    # A change is appended as one record rather than rewriting the playlist
+    assert os.path.getsize(store.path("New")) == size + RECORD.size
+
+    reopened = PlaylistStore(str(folder))
+    assert reopened.open() == ["New", "Old"]
+    assert reopened.get_ids("New") == [4]
+    assert reopened.get_ids("Old") == [3, 1, 2]
+
+    for _ in range(COMPACT_SLACK):
+        reopened.add("New", 5)
+        reopened.remove("New", 5)
+    reopened.flush()
+    assert os.path.getsize(reopened.path("New")) == len(MAGIC) + RECORD.size
+
+    reopened.replace("Old", [2, 3])
+    reopened.delete("New")
+    reopened.flush()
+    assert not os.path.exists(reopened.path("New"))
+    assert PlaylistStore(str(folder)).open() == ["Old"]
+    assert reopened.reload("Old") == [2, 3]
+
+def test_playlist_store_torn_tail_and_shared_folder(tmp_path):
+    from playlist_store import PlaylistStore
+    store = PlaylistStore(str(tmp_path / "playlists"))
+    store.open()
+    store.create("Mix")
+    for track_id in (1, 2, 3):
+        store.add("Mix", track_id)
+    store.flush()
+    # Part of a record left by a crash is cut off, so the next append stays in step
+    with open(store.path("Mix"), "ab") as f:
+        f.write(b"\x01\x05\x00")
+    reopened = PlaylistStore(store.folder)
+    reopened.open()
+    reopened.add("Mix", 4)
+    reopened.flush()
+    final = PlaylistStore(store.folder)
+    final.open()
+    assert final.get_ids("Mix") == [1, 2, 3, 4]
+
+    # Two stores on the same folder keep each other's changes, even across a compaction
+    store.add("Mix", 5)
+    reopened.remove("Mix", 1)
+    reopened.replace("Mix", [2, 3, 4])
+    reopened.flush()
+    store.flush()
+    assert store.get_ids("Mix") == [2, 3, 4, 5]
+    final.remove("Mix", 3)
+    final.flush()
+    assert reopened.reload("Mix") == [2, 4, 5]
+
+def test_playlist_membership_index(tmp_path, library):
+    from playlist_store import PlaylistStore
+    store = PlaylistStore(str(tmp_path / "playlists"))
+    store.open()
+    store.create("Mix")
+    store.create("K-Pop")
+    for track_id in (3, 1, 2):
+        store.add("Mix", track_id)
+    store.add("K-Pop", 1)
+    store.flush()
+
+    reopened = PlaylistStore(store.folder)
+    reopened.open()
+    assert reopened.playlists_with(1) == ["K-Pop", "Mix"]
+    assert reopened.playlists_with(4) == []
+    reopened.replace("Mix", [2, 3])
+    assert reopened.playlists_with(1) == ["K-Pop"]
+    assert reopened.playlists_with(2) == ["Mix"]
+
+    library.playlists = reopened
+    library.remove_track(2)
+    assert reopened.get_ids("Mix") == [3]
+    assert reopened.playlists_with(2) == []
+    reopened.delete("K-Pop")
+    assert reopened.playlists_with(1) == []
+    reopened.flush()
+
+    final = PlaylistStore(store.folder)
+    assert final.open() == ["Mix"]
+    assert final.get_ids("Mix") == [3]
+
+def test_libraries_sharing_files_keep_each_others_changes(library):
+    from library_item import ConcurrentModificationError
+
+    other = TrackLibrary()
+    library.record_plays([1, 1])
+    other.record_plays([1])
+    assert other.get_track_by_id(1).play_count == 144
+    # A snapshot rewrite; the first library has to reload before its next write
+    other.edit_track(other.get_track_by_id(3), name="Renamed")
+    library.rate_track(library.get_track_by_id(2), 1)
+    assert library.get_track_by_id(3).name == "Renamed"
+    assert library.get_track_by_id(1).play_count == 144
+
+    assert other.refresh()
+    assert other.get_track_by_id(2).rating == 1
+    assert not other.refresh()
+
+    library.autosave = False
+    library.queue_plays([4])
+    other.compact_journal()
+    assert library.refresh()
+    assert library.get_track_by_id(4).play_count == 1
+    library.flush()
+    fresh = TrackLibrary()
+    assert [(track.play_count, track.rating) for track in fresh.list_all()] == [(144, 4), (129, 1), (98, 5), (1, 3)]
+    assert fresh.get_track_by_id(3).name == "Renamed"
+
+    other.storage.version = (0, 0)
+    with pytest.raises(ConcurrentModificationError):
+        other.storage.record_plays({1: 1})
+
+def test_file_lock_is_not_upgraded_in_place(tmp_path):
+    from file_lock import FileLock
+
+    locked = FileLock(str(tmp_path / "library.lock"))
+    with locked():
+        with locked(shared=True):
+            pass
+    with locked(shared=True):
+        with pytest.raises(RuntimeError):
+            with locked():
+                pass
+    # The failed upgrade didn't leave the lock held
+    with locked():
+        pass
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_edits_keep_other_processes_plays(library, tmp_path, backend):
+    from sqlite_storage import SqliteStorage, import_csv_library
+
+    if backend == "sqlite":
+        database = str(tmp_path / "tracks.db")
+        import_csv_library(library_item.DATA_FILE, database)
+        first, second = TrackLibrary(storage=SqliteStorage(database)), TrackLibrary(storage=SqliteStorage(database))
+    else:
+        first, second = library, TrackLibrary()
+    first.autosave = False
+    second.record_plays([1, 1, 1])
+    second.compact_journal()
+    # Edited here after the other library's plays were saved, but before catching up with them
+    first.queue_plays([1])
+    first.edit_track(first.get_track_by_id(1), name="Renamed")
+    first.flush()
+    second.refresh()
+    assert (second.get_track_by_id(1).name, second.get_track_by_id(1).play_count) == ("Renamed", 145)
+    assert first.get_track_by_id(1).play_count == 145
+
+def test_failed_snapshot_keeps_the_changes(library, monkeypatch):
+    library.autosave = False
+    library.queue_plays([2])
+    library.edit_track(library.get_track_by_id(3), name="Renamed")
+
+    def fail(tracks):
+        raise OSError("disk full")
+    with monkeypatch.context() as patched:
+        patched.setattr(library.storage, "save_tracks", fail)
+        with pytest.raises(OSError):
+            library.flush()
+    assert library.has_unsaved_changes()
+    library.flush()
+    saved = TrackLibrary()
+    assert (saved.get_track_by_id(2).play_count, saved.get_track_by_id(3).name) == (130, "Renamed")
+
+def test_try_flush_leaves_merging_to_the_caller(library):
+    other = TrackLibrary()
+    other.record_plays([1])
+    library.autosave = False
+    library.queue_plays([3])
+
+    # Nothing is written, and our tracks aren't touched until apply_changes
+    changes = library.try_flush()
+    assert changes is not None
+    assert library.get_track_by_id(1).play_count == 141
+    assert library.has_unsaved_changes()
+    assert library.apply_changes(changes)
+    assert library.get_track_by_id(1).play_count == 142
+    # Applying the same changes twice would count the play twice
+    assert not library.apply_changes(changes)
+    assert library.try_flush() is None
+    assert not library.has_unsaved_changes()
+    assert [TrackLibrary().get_track_by_id(track_id).play_count for track_id in (1, 3)] == [142, 99]
+
+def test_library_service(tmp_path, library):
+    import asyncio
+    import json
+    from library_service import LibraryService
+    from playlist_store import PlaylistStore
+
+    playlists = PlaylistStore(str(tmp_path / "playlists"))
+    playlists.open()
+    library.playlists = playlists
+
+    async def exchange():
+        service = LibraryService(library, playlists, flush_delay=0)
+        server = await service.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+        async def request(method, path, body=None):
+            data = json.dumps(body).encode() if body is not None else b""
+            writer.write(f"{method} {path} HTTP/1.1\r\nHost: x\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+            return int(head.split(b" ")[1]), json.loads(await reader.readexactly(length))
+
+        # Every request goes over the same kept-alive connection
+        status, page = await request("GET", "/tracks?order_by=play_count&limit=2")
+        assert status == 200
+        assert [track["track_id"] for track in page["tracks"]] == [1, 2]
+        assert (page["total"], page["next_offset"]) == (4, 2)
+        assert (await request("GET", "/tracks?genre=K-Pop&offset=1"))[1]["tracks"][0]["name"] == "Kill This Love"
+        status, page = await request("GET", "/tracks?cursor=&limit=3")
+        assert [track["track_id"] for track in page["tracks"]] == [1, 2, 3]
+        status, page = await request("GET", f"/tracks?cursor={page['next_cursor']}&limit=3")
+        assert ([track["track_id"] for track in page["tracks"]], page["next_cursor"]) == ([4], None)
+        assert (await request("GET", "/tracks/4"))[1] == {"track_id": 4, "name": "Loose Track", "artist": "Someone",
+                                                          "rating": 3, "play_count": 0, "image_path": ""}
+        assert (await request("GET", "/tracks/99"))[0] == 404
+        assert (await request("GET", "/search?q=blinding"))[1]["tracks"][0]["track_id"] == 3
+        status, page = await request("GET", "/search?q=e&limit=1")
+        assert (len(page["tracks"]), page["next_offset"], "total" in page) == (1, 1, False)
+        assert (await request("POST", "/tracks/3/play", {"count": 2}))[1]["play_count"] == 100
+        assert (await request("POST", "/plays", {"track_ids": [1, 99]}))[0] == 400
+        assert (await request("PUT", "/tracks/2/rating", {"rating": 9}))[0] == 400
+        assert (await request("PUT", "/tracks/2/rating", {"rating": 2}))[1]["rating"] == 2
+        assert (await request("DELETE", "/tracks/2"))[0] == 405
+        assert (await request("POST", "/playlists", {"name": "../escape"}))[0] == 400
+        assert (await request("POST", "/playlists", {"name": "Mix"}))[0] == 201
+
+        status, result = await request("POST", "/batch", {"requests": [
+            {"method": "POST", "path": "/playlists/Mix/tracks", "body": {"track_id": 3}},
+            {"method": "POST", "path": "/playlists/Mix/tracks", "body": {"track_id": 99}},
+            {"method": "POST", "path": "/plays", "body": {"track_ids": [4, 4]}},
+            {"path": "/playlists/Mix"},
+        ]})
+        assert [response["status"] for response in result["responses"]] == [200, 404, 200, 200]
+        assert [track["track_id"] for track in result["responses"][3]["body"]["tracks"]] == [3]
+
+        writer.close()
+        await service.close()
+
+    asyncio.run(exchange())
+    saved = TrackLibrary()
+    assert [(track.play_count, track.rating) for track in saved.list_all()] == [(141, 4), (129, 2), (100, 5), (2, 3)]
+    reopened = PlaylistStore(playlists.folder)
+    reopened.open()
+    assert reopened.get_ids("Mix") == [3]
+
+def test_iter_tracks_and_cursor_pages(library):
+    from track_pager import TrackPager
+
+    ids = lambda tracks: [track.track_id for track in tracks]
+    assert ids(library.iter_tracks(1, 2)) == [2, 3]
+    assert ids(library.iter_tracks(0, 2, order_by="play_count")) == [1, 2]
+    assert ids(library.iter_tracks(1, None, criteria={"genre": "K-Pop"})) == [2]
+    assert ids(library.iter_tracks(0, 5, "rating", {"decade": [2010, 2020]})) == [2, 3, 1]
+    assert library.count_tracks({"artist": "BLACKPINK"}) == 2
+
+    page, cursor = library.page_tracks(2, order_by="play_count")
+    assert ids(page) == [1, 2]
+    # A track added between pages lands where it belongs without shifting the next page
+    library.add_track(LibraryItem(5, "Newcomer", "Someone", 3, play_count=500))
+    page, cursor = library.page_tracks(2, cursor, order_by="play_count")
+    assert (ids(page), cursor) == ([3, 4], None)
+    page, cursor = library.page_tracks(1, criteria={"artist": "Someone"})
+    assert ids(page) == [4] and ids(library.page_tracks(1, cursor, criteria={"artist": "Someone"})[0]) == [5]
+    with pytest.raises(ValueError):
+        library.page_tracks(2, cursor, order_by="name")
+    # A hand-edited cursor whose key doesn't fit the order is rejected rather than compared
+    from sorted_view import encode_cursor
+    for order_by, entry in [("play_count", ("x", 1)), ("name", (3, 1)), ("rating", (True, 1)), ("rating", (-3, "1"))]:
+        with pytest.raises(ValueError):
+            library.page_tracks(2, encode_cursor(order_by, entry), order_by=order_by)
+
+    pager = TrackPager(library_item.DATA_FILE, page_size=2)
+    assert ids(pager.iter_tracks(1, 2)) == [2, 3]
+    assert ids(pager.iter_tracks(0, 1, criteria={"artist": "Someone"})) == [4]
+    with pytest.raises(ValueError):
+        list(pager.iter_tracks(order_by="name"))
+
+def test_track_catalogue_round_trip(tmp_path, library):
+    from track_catalogue import TrackCatalogue, convert_csv, verify_catalogue
+
+    path = str(tmp_path / "tracks.catalogue")
+    assert convert_csv(library_item.DATA_FILE, path) == 4
+    assert verify_catalogue(library_item.DATA_FILE, path) == 4
+    for use_mmap in (True, False):
+        with TrackCatalogue(path, use_mmap=use_mmap) as catalogue:
+            row = catalogue.get_track_by_id(2)
+            assert (row.name, row.artist, row.play_count, row.release_year) == ("Kill This Love", "BLACKPINK", 129, 2019)
+            assert row.get_details() == library.get_track_by_id(2).get_details()
+            assert catalogue.get_track_by_id(5) is None
+            assert type(catalogue[-1].to_track()) is LibraryItem
+            assert [row.track_id for row in catalogue.iter_tracks(1, 2)] == [2, 3]
+            assert [row.track_id for row in catalogue.iter_tracks(criteria={"decade": 2010})] == [1, 2]
+
+    library.edit_track(library.get_track_by_id(3), name="Changed")
+    with pytest.raises(ValueError, match="Track 3"):
+        verify_catalogue(library_item.DATA_FILE, path)
+    with pytest.raises(ValueError, match="not a track catalogue"):
+        TrackCatalogue(library_item.DATA_FILE)
+
+def test_bulk_import(tmp_path, library):
+    import csv
+    import datetime
+    import json
+    from bulk_import import import_tracks
+
+    source = tmp_path / "catalogue.csv"
+    source.write_text(
+        "Track ID,Name,Artist,Rating,Play Count,Image Path,Album,Release Year,Genre,Track Number\n"
+        "100, Fresh ,Newcomer,4,7,,Debut,2021,Pop,1\n"
+        "101,Kill This Love,BLACKPINK,5,0,,KILL THIS LOVE,2019,K-Pop,2\n"
+        "102,No Artist,,3,0,,,,,\n"
+        "103,Bad Rating,Someone,9,0,,,,,\n"
+        "104,Old,Someone,3,0,,Gramophone,1850,,\n"
+        "105,fresh,NEWCOMER,2,0,,debut,,,\n"
+        "106,Single,Someone,2,,,,,,\n",
+        encoding="utf-8"
+    )
+    # Two worker processes on a copy of the library, then in-process on the real one
+    copy = tmp_path / "copy.csv"
+    copy.write_bytes(open(library_item.DATA_FILE, "rb").read())
+    for workers, storage in ((2, library_item.CsvStorage(str(copy))), (1, None)):
+        rejects = tmp_path / f"rejects{workers}.csv"
+        report = import_tracks(TrackLibrary(storage=storage), str(source), str(rejects), workers=workers, batch_size=2)
+        assert (report.rows, report.imported, report.duplicates, report.rejected) == (7, 2, 2, 3)
+        reasons = {row["Reason"] for row in csv.DictReader(rejects.open(encoding="utf-8"))}
+        assert reasons == {"Artist is required", "Rating must be an integer between 1 and 5",
+                           f"Release year must be between 1900 and {datetime.date.today().year}",
+                           "Duplicate of a track already in the library or this import"}
+    saved = TrackLibrary()
+    assert [(track.track_id, track.name) for track in saved.list_all()[4:]] == [(5, "Fresh"), (6, "Single")]
+    assert saved.get_track_by_id(5).release_year == 2021
+
+    lines = tmp_path / "more.jsonl"
+    lines.write_text(json.dumps({"name": "Lined", "artist": "JSON", "rating": 5}) + "\n{broken\n[1]\n", encoding="utf-8")
+    report = import_tracks(saved, str(lines), str(tmp_path / "rejects.csv"), workers=1)
+    assert (report.imported, report.rejected) == (1, 2)
+    assert TrackLibrary().get_track_by_id(7).name == "Lined"
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+THUMBNAIL_FOLDER = os.path.join("images", ".thumbnails")
+MAX_MEMORY_BYTES = 64 * 1024 * 1024
+
+class ThumbnailCache:
+    def __init__(self, folder=THUMBNAIL_FOLDER, max_bytes=MAX_MEMORY_BYTES, executor=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        # (path, size, mtime) -> (PhotoImage, bytes), least recently used first
+        self.images = OrderedDict()
+        # Decoding can run on an IOExecutor; requests for the same image share one job
+        self.executor = executor
+        self.waiting = {}
+
+    def lookup(self, image_path, size):
+        try:
+            mtime = os.stat(image_path).st_mtime_ns
+        except OSError:
+            return None, None
+
+        key = (image_path, size, mtime)
+        if key in self.images:
+            self.images.move_to_end(key)
+            return key, self.images[key][0]
+        return key, None
+
+    def get(self, image_path, size):
+        key, img_tk = self.lookup(image_path, size)
+        if key is None or img_tk:
+            return img_tk
+
+        try:
+            img = self.load_resized(*key)
+        except Exception as e:
+            print(f"Error loading image {image_path}: {e}")
+            return None
+        return self.store(key, img)
+
+    def request(self, image_path, size, callback):
+        # Returns the image if it's already in memory; otherwise it's decoded in the
+        # background and callback(img_tk) runs on the main loop once it's ready.
+        # Missing or unreadable images are reported as callback(None).
+        if self.executor is None:
+            img_tk = self.get(image_path, size)
+            if img_tk is None:
+                callback(None)
+            return img_tk
+
+        key, img_tk = self.lookup(image_path, size)
+        if key is None:
+            callback(None)
+            return None
+        if img_tk:
+            return img_tk
+
+        if key in self.waiting:
+            self.waiting[key].append(callback)
+        else:
+            self.waiting[key] = [callback]
+            self.executor.submit(self.load_resized, *key,
+                                 callback=lambda img: self.finish_request(key, img),
+                                 error_callback=lambda e: self.fail_request(key, e))
+        return None
+
+    def finish_request(self, key, img):
+        img_tk = self.store(key, img)
+        for callback in self.waiting.pop(key, []):
+            callback(img_tk)
+
+    def fail_request(self, key, error):
+        print(f"Error loading image {key[0]}: {error}")
+        for callback in self.waiting.pop(key, []):
+            callback(None)
+
+    def store(self, key, img):
+        # PIL is imported on first use so it doesn't slow down startup
+        from PIL import ImageTk
+        try:
+            img_tk = ImageTk.PhotoImage(img)
+        except Exception as e:
+            print(f"Error loading image {key[0]}: {e}")
+            return None
+
+        image_bytes = img.width * img.height * 4
+        self.images[key] = (img_tk, image_bytes)
+        self.used_bytes += image_bytes
+        while self.used_bytes > self.max_bytes and len(self.images) > 1:
+            _, (_, evicted_bytes) = self.images.popitem(last=False)
+            self.used_bytes -= evicted_bytes
+        return img_tk
+
+    def load_resized(self, image_path, size, mtime):
+        from PIL import Image
+        digest = hashlib.sha1(f"{os.path.abspath(image_path)}|{mtime}".encode("utf-8")).hexdigest()
+        cached_file = os.path.join(self.folder, f"{digest}_{size[0]}x{size[1]}.png")
+        if os.path.exists(cached_file):
+            try:
+                with Image.open(cached_file) as img:
+                    img.load()
+                    return img
+            except OSError:
+                pass
+
+        with Image.open(image_path) as img:
+            resized = img.resize(size, Image.Resampling.LANCZOS)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            # Save under a private name first so other threads never read a half-written PNG
+            temp_file = f"{cached_file}.{threading.get_ident()}.tmp"
+            resized.save(temp_file, "PNG")
+            os.replace(temp_file, cached_file)
+        except OSError as e:
+            print(f"Could not cache thumbnail for {image_path}: {e}")
+        return resized
+
+    def clear(self):
+        self.images.clear()
+        self.used_bytes = 0
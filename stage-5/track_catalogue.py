@@ -0,0 +1,226 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+from itertools import islice
+from field_index import matches_criteria
+from library_item import DATA_FILE, LibraryItem, LibraryItemAlbum, iter_track_chunks, make_track, track_fields
+
+CATALOGUE_FILE = "tracks_data.catalogue"
+MAGIC = b"JBCATLG1"
+# Magic, record size, record count and heap size; the record table follows, then the string heap
+HEADER = struct.Struct("<8sIIQ")
+# track_id, play_count, rating, release_year, track_number, then an (offset, length) into the
+# heap for each of name, artist, image_path, album and genre
+RECORD = struct.Struct("<qqiii" + "II" * 5)
+TEXT_REF = struct.Struct("<II")
+TRACK_ID = struct.Struct("<q")
+
+class NumberField:
+    def __init__(self, position, code):
+        self.position = position
+        self.field = struct.Struct("<" + code)
+
+    def __get__(self, row, owner):
+        if row is None:
+            return self
+        return self.field.unpack_from(row.catalogue.buffer, row.offset + self.position)[0]
+
+class TextField:
+    def __init__(self, position):
+        self.position = position
+
+    def __get__(self, row, owner):
+        if row is None:
+            return self
+        offset, length = TEXT_REF.unpack_from(row.catalogue.buffer, row.offset + self.position)
+        return row.catalogue.text(offset, length)
+
+class CatalogueRow:
+    # A read-only handle onto one record; each field is unpacked from the file when it's read
+    __slots__ = ("catalogue", "index", "offset")
+
+    track_id = NumberField(0, "q")
+    play_count = NumberField(8, "q")
+    rating = NumberField(16, "i")
+    release_year = NumberField(20, "i")
+    track_number = NumberField(24, "i")
+    name = TextField(28)
+    artist = TextField(36)
+    image_path = TextField(44)
+    album = TextField(52)
+    genre = TextField(60)
+
+    def __init__(self, catalogue, index):
+        self.catalogue = catalogue
+        self.index = index
+        self.offset = HEADER.size + index * RECORD.size
+
+    def get_details(self):
+        if self.album:
+            return LibraryItemAlbum.get_details(self)
+        return LibraryItem.get_details(self)
+
+    def get_album_info(self):
+        return LibraryItemAlbum.get_album_info(self)
+
+    def to_track(self):
+        (track_id, play_count, rating, release_year, track_number,
+         *text_refs) = RECORD.unpack_from(self.catalogue.buffer, self.offset)
+        name, artist, image_path, album, genre = (self.catalogue.text(offset, length)
+                                                  for offset, length in zip(text_refs[::2], text_refs[1::2]))
+        return make_track(track_id, name, artist, rating, play_count, image_path, album, release_year, genre, track_number)
+
+class TrackCatalogue:
+    # Read-only, random-access view of a binary catalogue written by write_catalogue.
+    # Opening it only reads the header; records are sorted by track ID, so lookups are a
+    # binary search over the file and rows are only decoded when their fields are read.
+    # With use_mmap the file is mapped rather than read, and fields are unpacked straight
+    # from the mapping.
+    def __init__(self, path=CATALOGUE_FILE, use_mmap=True):
+        self.path = path
+        self.mapping = None
+        with open(path, "rb") as f:
+            if use_mmap:
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.buffer = memoryview(self.mapping)
+            else:
+                self.buffer = memoryview(f.read())
+        try:
+            magic, record_size, self.record_count, heap_size = HEADER.unpack_from(self.buffer)
+        except struct.error:
+            magic = None
+        if magic != MAGIC or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a track catalogue")
+        self.heap_offset = HEADER.size + self.record_count * RECORD.size
+        if self.heap_offset + heap_size > len(self.buffer):
+            self.close()
+            raise ValueError(f"{path} is truncated")
+
+    def close(self):
+        # The memoryview has to go before the mapping can be closed
+        self.buffer.release()
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def text(self, offset, length):
+        start = self.heap_offset + offset
+        return str(self.buffer[start:start + length], "utf-8")
+
+    def __len__(self):
+        return self.record_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.record_count
+        if not 0 <= index < self.record_count:
+            raise IndexError("track catalogue index out of range")
+        return CatalogueRow(self, index)
+
+    def __iter__(self):
+        for index in range(self.record_count):
+            yield CatalogueRow(self, index)
+
+    def get_track_by_id(self, track_id):
+        low, high = 0, self.record_count
+        while low < high:
+            middle = (low + high) // 2
+            if TRACK_ID.unpack_from(self.buffer, HEADER.size + middle * RECORD.size)[0] < track_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.record_count and TRACK_ID.unpack_from(self.buffer, HEADER.size + low * RECORD.size)[0] == track_id:
+            return CatalogueRow(self, low)
+        return None
+
+    def iter_tracks(self, offset=0, limit=None, order_by=None, criteria=None):
+        # Same arguments as TrackLibrary.iter_tracks; the catalogue is only in track ID order
+        if order_by not in (None, "track_id"):
+            raise ValueError("A track catalogue can only list tracks in track ID order")
+        stop = None if limit is None else offset + limit
+        if criteria:
+            return islice((row for row in self if matches_criteria(row, criteria)), offset, stop)
+        return (CatalogueRow(self, index) for index in range(offset, self.record_count if stop is None
+                                                              else min(stop, self.record_count)))
+
+def write_catalogue(tracks, path=CATALOGUE_FILE):
+    # Tracks are stored by ID, and each distinct string is stored once in the heap
+    tracks_by_id = {track.track_id: track for track in tracks}
+    heap = bytearray()
+    text_refs = {}
+
+    def text_ref(text):
+        if text not in text_refs:
+            data = text.encode("utf-8")
+            text_refs[text] = (len(heap), len(data))
+            heap.extend(data)
+        return text_refs[text]
+
+    records = []
+    for track_id in sorted(tracks_by_id):
+        track_id, name, artist, rating, play_count, image_path, album, release_year, genre, track_number = \
+            track_fields(tracks_by_id[track_id])
+        records.append(RECORD.pack(track_id, play_count, rating, release_year or 0, track_number or 0,
+                                   *text_ref(name), *text_ref(artist), *text_ref(image_path),
+                                   *text_ref(album), *text_ref(genre)))
+
+    temp_file = path + ".tmp"
+    with open(temp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, RECORD.size, len(records), len(heap)))
+        f.write(b"".join(records))
+        f.write(heap)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+    return len(records)
+
+def read_csv_tracks(csv_path):
+    # Later rows win over earlier ones with the same ID, as they do in TrackLibrary
+    tracks_by_id = {}
+    for chunk in iter_track_chunks(csv_path):
+        for track in chunk:
+            tracks_by_id[track.track_id] = track
+    return tracks_by_id
+
+def convert_csv(csv_path=DATA_FILE, path=CATALOGUE_FILE):
+    return write_catalogue(read_csv_tracks(csv_path).values(), path)
+
+def verify_catalogue(csv_path=DATA_FILE, path=CATALOGUE_FILE):
+    # Round-trip check: every track in the CSV has to come back out of the catalogue unchanged
+    expected = read_csv_tracks(csv_path)
+    with TrackCatalogue(path) as catalogue:
+        if len(catalogue) != len(expected):
+            raise ValueError(f"{path} holds {len(catalogue)} tracks, {csv_path} has {len(expected)}")
+        for row in catalogue:
+            track = row.to_track()
+            original = expected.get(track.track_id)
+            if original is None or track_fields(track) != track_fields(original) or type(track) is not type(original):
+                raise ValueError(f"Track {track.track_id} doesn't match {csv_path}: {track_fields(track)}")
+    return len(expected)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert tracks_data.csv into a binary track catalogue and check it.")
+    parser.add_argument("--csv", default=DATA_FILE)
+    parser.add_argument("--output", default=CATALOGUE_FILE)
+    args = parser.parse_args()
+
+    track_count = convert_csv(args.csv, args.output)
+    try:
+        verify_catalogue(args.csv, args.output)
+    except ValueError as e:
+        print(f"Round-trip check failed: {e}")
+        sys.exit(1)
+    print(f"Wrote {track_count} tracks to {args.output} and checked them against {args.csv}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import csv
+import io
+from collections import OrderedDict
+from itertools import islice
+from field_index import matches_criteria
+from library_item import parse_track_row
+
+PAGE_SIZE = 500
+CACHED_PAGES = 16
+
+class TrackPager:
+    # Read-only, on-demand view of a tracks CSV that may not fit in memory.
+    # Only the byte offset of every PAGE_SIZE-th row is kept; pages are parsed
+    # when asked for and the most recent ones are cached. Indexes are rows of the
+    # file: looking up a row that can't be parsed raises ValueError, and iterating
+    # skips it, like load_tracks does. The GUI and service don't use it: their search,
+    # filter and sort indexes need every track in memory anyway. It's for tools that
+    # only need to page through a catalogue too large to load.
+    def __init__(self, path, page_size=PAGE_SIZE, cached_pages=CACHED_PAGES):
+        self.path = path
+        self.page_size = page_size
+        self.cached_pages = cached_pages
+        self.pages = OrderedDict()
+        self.page_offsets = []
+        self.row_count = 0
+        self.build_offsets()
+
+    def build_offsets(self):
+        with open(self.path, "rb") as f:
+            header = f.readline()
+            self.fieldnames = next(csv.reader([header.decode("utf-8-sig")]))
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                # A quoted field can contain newlines, so keep reading until the quotes balance
+                while line.count(b'"') % 2:
+                    more = f.readline()
+                    if not more:
+                        break
+                    line += more
+                if not line.strip():
+                    continue
+                if self.row_count % self.page_size == 0:
+                    self.page_offsets.append(offset)
+                self.row_count += 1
+        self.end_offset = offset
+
+    def __len__(self):
+        return self.row_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.row_count
+        if not 0 <= index < self.row_count:
+            raise IndexError("track index out of range")
+        track = self.get_page(index // self.page_size)[index % self.page_size]
+        if isinstance(track, ValueError):
+            raise ValueError(f"Row {index} of {self.path} is invalid: {track}")
+        return track
+
+    def __iter__(self):
+        for page_number in range(len(self.page_offsets)):
+            for track in self.get_page(page_number):
+                if not isinstance(track, ValueError):
+                    yield track
+
+    def iter_tracks(self, offset=0, limit=None, order_by=None, criteria=None):
+        # Same arguments as TrackLibrary.iter_tracks. Only the pages the slice covers are read;
+        # with criteria the file is scanned from the start, since there's no index to jump with.
+        if order_by is not None:
+            raise ValueError("TrackPager can only list tracks in file order")
+        stop = None if limit is None else offset + limit
+        if criteria:
+            return islice((track for track in self if matches_criteria(track, criteria)), offset, stop)
+        return self.iter_rows(offset, self.row_count if stop is None else min(stop, self.row_count))
+
+    def iter_rows(self, start, stop):
+        # Rows that failed to parse are skipped, so a slice may hold fewer tracks than asked for
+        for index in range(start, stop):
+            track = self.get_page(index // self.page_size)[index % self.page_size]
+            if not isinstance(track, ValueError):
+                yield track
+
+    def get_page(self, page_number):
+        if page_number in self.pages:
+            self.pages.move_to_end(page_number)
+            return self.pages[page_number]
+
+        start = self.page_offsets[page_number]
+        end = self.page_offsets[page_number + 1] if page_number + 1 < len(self.page_offsets) else self.end_offset
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            text = f.read(end - start).decode("utf-8")
+
+        page = []
+        for row in csv.DictReader(io.StringIO(text, newline=""), fieldnames=self.fieldnames):
+            try:
+                page.append(parse_track_row(row))
+            except ValueError as e:
+                # The error stands in for the row, so indexes still line up with the file
+                print(f"Skipping invalid row: {row}")
+                page.append(e)
+
+        self.pages[page_number] = page
+        if len(self.pages) > self.cached_pages:
+            self.pages.popitem(last=False)
+        return page
@@ -1,62 +1,274 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from PIL import Image, ImageTk
-from ttkthemes import ThemedTk
 from library_item import TrackLibrary
+from play_history import PlayHistory, HISTORY_FILE
+from sqlite_storage import SqliteStorage, DATABASE_FILE
+from thumbnail_cache import ThumbnailCache
+from io_worker import IOExecutor
+from virtual_track_list import VirtualTrackList
+from playlist_view import PlaylistView
+from playlist_store import PlaylistStore, PLAYLIST_FOLDER
+from instrumentation import instrumentation, timed, EventLoopLagMonitor
+from search_index import SearchIndex
+from sorted_view import SORT_KEYS
 import os
-import csv
 import datetime
 
-PLAYLIST_FOLDER = "playlists"
-IMAGE_FOLDER = "images"
+# Searches show the best matches only, so the index can stop once it has found them
+SEARCH_RESULT_LIMIT = 500
+# The background index build checks between chunks of this many tracks whether the window closed
+SEARCH_INDEX_CHUNK = 5000
 
-# Create folders if they don't exist
-if not os.path.exists(IMAGE_FOLDER):
-    os.makedirs(IMAGE_FOLDER)
+IMAGE_FOLDER = "images"
+SORT_OPTIONS = ["name", "artist", "rating", "play_count", "release_year"]
 
-if not os.path.exists(PLAYLIST_FOLDER):
-    os.makedirs(PLAYLIST_FOLDER)
+def create_folders():
+    os.makedirs(IMAGE_FOLDER, exist_ok=True)
+    os.makedirs(PLAYLIST_FOLDER, exist_ok=True)
 
 class TrackPlayerGUI:
-    def __init__(self, root):
+    def __init__(self, root, storage=None):
         self.root = root
         self.root.title("JukeBox")
         self.root.geometry("1050x620")
         self.root.configure(bg="#ffffff")  # Light background for a clean look
 
-        # Apply a modern theme
+        create_folders()
+
+        # The modern theme is loaded once the window is up; see apply_theme
         self.style = ttk.Style(self.root)
-        self.style.theme_use("arc")
-        self.style.configure("TButton", font=("Arial", 10, "bold"), padding=6)
-        self.style.configure("TLabel", font=("Arial", 11))
+        self.configure_styles()
+        self.root.after_idle(self.apply_theme)
 
         # Initialize track library and playlist management
-        self.track_library = TrackLibrary()
-        self.playlists = {}
+        # Playlists are read from disk the first time they're selected
+        self.playlist_store = PlaylistStore(PLAYLIST_FOLDER)
+        self.track_library = TrackLibrary(load=False, storage=storage, history=PlayHistory(HISTORY_FILE),
+                                          playlists=self.playlist_store)
         self.current_playlist_name = None
-
-        self.load_all_playlists()
+        self.details_track = None
+
+        # Disk writes go through one background thread so they stay in order and never
+        # block the UI; cover art is decoded on a separate pool
+        self.io = IOExecutor(self.root)
+        self.image_io = IOExecutor(self.root, max_workers=2)
+        # Indexing a big library for search takes a while, so it has a thread of its own
+        # rather than holding up the saves queued on self.io
+        self.index_io = IOExecutor(self.root)
+        self.closing = False
+        self.search_waiting = False
+        self.track_library.autosave = False
+        self.thumbnails = ThumbnailCache(executor=self.image_io)
 
         # Create the notebook (tabbed interface)
         self.create_notebook()
 
-        # Automatically display all tracks when app starts
-        self.view_tracks()
+        # Load tracks a chunk at a time, starting once the empty window has been drawn
+        self.track_loader = self.track_library.start_loading()
+        self.first_chunk_shown = False
+        self.root.after_idle(self.load_next_chunk)
+
+        # Write out queued changes and fold journaled plays back into tracks_data.csv on exit
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # F12 opens a hidden panel with per-operation timings and event loop lag
+        self.lag_monitor = EventLoopLagMonitor(self.root, instrumentation)
+        if instrumentation.enabled:
+            self.lag_monitor.start()
+        self.debug_window = None
+        self.root.bind("<F12>", lambda e: self.show_debug_panel())
+
+        # Another JukeBox window may have saved changes while this one was in the background
+        self.root.bind("<FocusIn>", self.on_focus_in)
+
+    def configure_styles(self):
+        self.style.configure("TButton", font=("Arial", 10, "bold"), padding=6)
+        self.style.configure("TLabel", font=("Arial", 11))
+
+    def apply_theme(self):
+        # ttkthemes takes a while to import, so it waits until after the first paint
+        try:
+            from ttkthemes import ThemedStyle
+        except ImportError as e:
+            print(f"Using the default theme: {e}")
+            return
+        self.style = ThemedStyle(self.root)
+        self.style.set_theme("arc")
+        self.configure_styles()
+
+    def on_close(self):
+        self.closing = True
+        self.image_io.shutdown()
+        self.index_io.shutdown()
+        self.io.flush()
+        try:
+            self.track_library.flush()
+            self.track_library.compact_journal()
+            self.track_library.history.close()
+            self.playlist_store.flush()
+        except Exception as e:
+            print(f"Failed to save tracks: {e}")
+        self.root.destroy()
+
+    def show_debug_panel(self):
+        if self.debug_window is not None:
+            self.debug_window.lift()
+            return
+        instrumentation.enabled = True
+        self.lag_monitor.start()
+
+        self.debug_window = tk.Toplevel(self.root)
+        self.debug_window.title("Performance")
+        self.debug_window.geometry("640x420")
+        self.debug_window.configure(bg="#ffffff")
+        self.debug_window.protocol("WM_DELETE_WINDOW", self.close_debug_panel)
+
+        columns = ("operation", "count", "p50", "p99", "max")
+        self.debug_tree = ttk.Treeview(self.debug_window, columns=columns, show="headings")
+        for column, heading, width in zip(columns, ["Operation", "Calls", "p50 (ms)", "p99 (ms)", "Max (ms)"],
+                                          [260, 70, 90, 90, 90]):
+            self.debug_tree.heading(column, text=heading)
+            self.debug_tree.column(column, width=width, anchor="w")
+        self.debug_tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+        button_frame = ttk.Frame(self.debug_window)
+        button_frame.pack(pady=(0, 10))
+        self.profile_button = ttk.Button(button_frame, text="Start cProfile", command=self.toggle_profile)
+        self.profile_button.pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Reset", command=instrumentation.reset).pack(side="left", padx=5)
+        self.refresh_debug_panel()
+
+    def refresh_debug_panel(self):
+        self.debug_tree.delete(*self.debug_tree.get_children())
+        for name, count, p50, p99, slowest in instrumentation.summary():
+            self.debug_tree.insert("", "end", values=(name, count, f"{p50 * 1000:.2f}", f"{p99 * 1000:.2f}",
+                                                      f"{slowest * 1000:.2f}"))
+        self.debug_refresh_id = self.root.after(1000, self.refresh_debug_panel)
+
+    def toggle_profile(self):
+        if instrumentation.profiler is None:
+            instrumentation.start_profile()
+            self.profile_button.configure(text="Stop and Save")
+            return
+        profile_file = datetime.datetime.now().strftime("jukebox_%Y%m%d_%H%M%S.prof")
+        instrumentation.stop_profile(profile_file)
+        self.profile_button.configure(text="Start cProfile")
+        messagebox.showinfo("Profile Saved", f"cProfile output written to {profile_file}", parent=self.debug_window)
+
+    def close_debug_panel(self):
+        # Recording stops with the panel unless it was switched on with JUKEBOX_PROFILE=1
+        if instrumentation.profiler is not None:
+            self.toggle_profile()
+        instrumentation.enabled = os.environ.get("JUKEBOX_PROFILE") == "1"
+        if not instrumentation.enabled:
+            self.lag_monitor.stop()
+        self.root.after_cancel(self.debug_refresh_id)
+        self.debug_window.destroy()
+        self.debug_window = None
+
+    def on_focus_in(self, event):
+        # <FocusIn> fires for every widget; only the window itself gaining focus counts
+        if event.widget is not self.root or self.track_library.pending_load is not None:
+            return
+        # Reading the changes can mean reading the whole library, so that happens on the I/O
+        # worker; they're merged back here on the Tk thread
+        self.io.submit(self.track_library.fetch_changes, callback=self.finish_focus_refresh,
+                       error_callback=lambda e: print(f"Failed to read changes from disk: {e}"))
+
+    def finish_focus_refresh(self, changes):
+        if self.track_library.apply_changes(changes):
+            self.show_library_changes()
+
+    def show_library_changes(self):
+        self.refresh_filter_options()
+        if not self.search_entry.get().strip() and self.artist_filter.get() == "All" and self.genre_filter.get() == "All":
+            self.track_list.set_tracks(self.track_library.sorted_tracks("track_id"), keep_position=True)
+        else:
+            self.track_list.refresh()
+        if self.details_track is not None:
+            track = self.track_library.get_track_by_id(self.details_track.track_id)
+            if track:
+                self.show_track_details(track)
+        self.refresh_top_tracks()
+
+    def schedule_save(self):
+        # Several quick changes (e.g. a burst of plays) end up as a single write
+        self.io.submit_coalesced("library", self.track_library.try_flush, callback=self.finish_save,
+                                 error_callback=lambda e: messagebox.showerror("Error", f"Failed to save tracks: {e}"))
+
+    def finish_save(self, changes):
+        # Another JukeBox saved first. Its changes are merged here on the Tk thread, which the
+        # track list reads from, and then ours are written on top.
+        if changes is None:
+            return
+        if self.track_library.apply_changes(changes):
+            self.show_library_changes()
+        self.schedule_save()
+
+    @timed("gui.load_next_chunk")
+    def load_next_chunk(self):
+        try:
+            next(self.track_loader)
+        except StopIteration:
+            self.finish_loading()
+            return
+
+        if not self.first_chunk_shown:
+            self.first_chunk_shown = True
+            self.view_tracks()
+        self.root.after(1, self.load_next_chunk)
+
+    def finish_loading(self):
+        self.refresh_filter_options()
+        self.load_all_playlists()
+        self.start_search_index()
+        if not self.search_entry.get().strip() and self.artist_filter.get() == "All" and self.genre_filter.get() == "All":
+            self.track_list.set_tracks(self.track_library.sorted_tracks("track_id"), keep_position=True)
+
+    def refresh_filter_options(self):
+        self.artist_filter["values"] = ["All"] + self.track_library.get_field_values("artist")
+        self.genre_filter["values"] = ["All"] + self.track_library.get_field_values("genre")
+        for combobox in (self.artist_filter, self.genre_filter):
+            if combobox.get() not in combobox["values"]:
+                combobox.set("All")
+
+    def start_search_index(self):
+        tracks = self.track_library.start_search_index()
+        self.index_io.submit(self.build_search_index, tracks, callback=self.finish_search_index,
+                             error_callback=self.search_index_failed)
+
+    def build_search_index(self, tracks):
+        # Runs on index_io; gives up if the window is closed first
+        index = SearchIndex()
+        for start in range(0, len(tracks), SEARCH_INDEX_CHUNK):
+            if self.closing:
+                return None
+            index.add_tracks(tracks[start:start + SEARCH_INDEX_CHUNK])
+        index.prepare_short_terms(should_stop=lambda: self.closing)
+        return None if self.closing else index
+
+    def finish_search_index(self, index):
+        if index is None or not self.track_library.install_search_index(index):
+            return
+        if self.search_waiting:
+            self.search_waiting = False
+            self.search_tracks()
+
+    def search_index_failed(self, error):
+        print(f"Failed to build the search index: {error}")
+        self.track_library.cancel_search_index()
+        if self.search_waiting:
+            self.search_waiting = False
+            self.search_tracks()
 
     def load_all_playlists(self):
-        for filename in os.listdir(PLAYLIST_FOLDER):
-            if filename.endswith(".csv"):
-                playlist_name = filename[:-4]
-                self.playlists[playlist_name] = []
-                playlist_file = os.path.join(PLAYLIST_FOLDER, filename)
-                with open(playlist_file, newline="", encoding="utf-8") as f:
-                    reader = csv.reader(f)
-                    next(reader)
-                    for row in reader:
-                        track_id = int(row[0])
-                        track = self.track_library.get_track_by_id(track_id)
-                        if track:
-                            self.playlists[playlist_name].append(track)
+        # Only the names are read here; entries wait until a playlist is shown
+        self.io.submit(self.playlist_store.open, callback=lambda names: self.update_playlist_combobox(),
+                       error_callback=lambda e: messagebox.showerror("Error", f"Failed to load playlists: {e}"))
+
+    def playlist_tracks(self, playlist_name):
+        tracks = (self.track_library.get_track_by_id(track_id) for track_id in self.playlist_store.get_ids(playlist_name))
+        return [track for track in tracks if track]
 
     def create_notebook(self):
         self.notebook = ttk.Notebook(self.root)
@@ -64,6 +276,8 @@ class TrackPlayerGUI:
 
         self.create_main_tab()
         self.create_playlist_tab()
+        self.create_top_tracks_tab()
+        self.notebook.bind("<<NotebookTabChanged>>", lambda e: self.refresh_top_tracks())
 
     def create_main_tab(self):
         main_frame = ttk.Frame(self.notebook, padding=10)  # Add padding to frame
@@ -77,11 +291,19 @@ class TrackPlayerGUI:
         self.search_entry.pack(side="left", padx=(0, 10))
         ttk.Button(control_frame, text="Search", command=self.search_tracks).pack(side="left", padx=5)
 
-        self.artist_filter = ttk.Combobox(control_frame, values=["All"] + list(
-            set(track.artist for track in self.track_library.list_all())), font=("Arial", 11))
+        # Filter choices come from the library's artist/genre indexes; see refresh_filter_options
+        self.artist_filter = ttk.Combobox(control_frame, values=["All"], font=("Arial", 11))
         self.artist_filter.current(0)
         self.artist_filter.pack(side="left", padx=(10, 10))
-        ttk.Button(control_frame, text="Filter", command=self.filter_by_artist).pack(side="left", padx=5)
+        self.genre_filter = ttk.Combobox(control_frame, values=["All"], width=12, font=("Arial", 11))
+        self.genre_filter.current(0)
+        self.genre_filter.pack(side="left", padx=(0, 10))
+        ttk.Button(control_frame, text="Filter", command=self.filter_tracks).pack(side="left", padx=5)
+
+        self.library_sort_criteria = tk.StringVar(value="name")
+        ttk.Combobox(control_frame, textvariable=self.library_sort_criteria, values=SORT_OPTIONS,
+                     state="readonly", width=12, font=("Arial", 11)).pack(side="left", padx=(10, 5))
+        ttk.Button(control_frame, text="Sort", command=self.sort_library).pack(side="left", padx=5)
 
         # Paned window for tracks and details
         self.paned_window = ttk.PanedWindow(main_frame, orient="horizontal")
@@ -100,11 +322,8 @@ class TrackPlayerGUI:
         scrollbar = ttk.Scrollbar(left_frame, orient="vertical", command=self.canvas.yview)
         scrollbar.pack(side="right", fill="y")
 
-        self.canvas.configure(yscrollcommand=scrollbar.set)
-        self.canvas.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-
-        self.tracks_display_frame = ttk.Frame(self.canvas)
-        self.canvas.create_window((0, 0), window=self.tracks_display_frame, anchor="nw")
+        # Only the visible rows get widgets, so the list stays fast for large libraries
+        self.track_list = VirtualTrackList(self.canvas, scrollbar, self.thumbnails, self.show_track_details)
 
     def create_playlist_tab(self):
         playlist_frame = ttk.Frame(self.notebook, padding=10)
@@ -139,6 +358,8 @@ class TrackPlayerGUI:
 
         self.playlist_tracks_frame = ttk.Frame(self.playlist_canvas)
         self.playlist_canvas.create_window((0, 0), window=self.playlist_tracks_frame, anchor="nw")
+        self.playlist_view = PlaylistView(self.playlist_tracks_frame, self.thumbnails, self.play_track,
+                                          self.remove_from_playlist)
 
         # Button frame with consistent spacing
         button_frame = ttk.Frame(playlist_frame)
@@ -154,32 +375,60 @@ class TrackPlayerGUI:
 
         ttk.Label(sort_frame, text="Sort by:", font=("Arial", 11)).pack(side="left", padx=(0, 5))
         self.sort_criteria = tk.StringVar(value="name")
-        sort_options = ["name", "artist", "rating", "play_count"]
-        self.sort_dropdown = ttk.Combobox(sort_frame, textvariable=self.sort_criteria, values=sort_options, font=("Arial", 11))
+        self.sort_dropdown = ttk.Combobox(sort_frame, textvariable=self.sort_criteria, values=SORT_OPTIONS, font=("Arial", 11))
         self.sort_dropdown.pack(side="left", padx=5)
         ttk.Button(sort_frame, text="Sort Playlist", command=self.sort_playlist).pack(side="left", padx=5)
 
+    def create_top_tracks_tab(self):
+        self.top_tracks_frame = ttk.Frame(self.notebook, padding=10)
+        self.notebook.add(self.top_tracks_frame, text="Top Tracks")
+
+        control_frame = ttk.Frame(self.top_tracks_frame)
+        control_frame.pack(fill="x", pady=(0, 10))
+
+        ttk.Label(control_frame, text="Rank by:", font=("Arial", 11)).pack(side="left", padx=(0, 5))
+        self.top_tracks_criteria = tk.StringVar(value="play_count")
+        ranking = ttk.Combobox(control_frame, textvariable=self.top_tracks_criteria, values=["play_count", "rating"],
+                               state="readonly", width=12, font=("Arial", 11))
+        ranking.pack(side="left", padx=5)
+        ranking.bind("<<ComboboxSelected>>", lambda e: self.refresh_top_tracks())
+
+        ttk.Label(control_frame, text="Show:", font=("Arial", 11)).pack(side="left", padx=(10, 5))
+        self.top_tracks_limit = tk.StringVar(value="50")
+        limit = ttk.Combobox(control_frame, textvariable=self.top_tracks_limit, values=["10", "50", "100"],
+                             state="readonly", width=5, font=("Arial", 11))
+        limit.pack(side="left", padx=5)
+        limit.bind("<<ComboboxSelected>>", lambda e: self.refresh_top_tracks())
+
+        columns = ("rank", "name", "artist", "play_count", "rating")
+        self.top_tracks_tree = ttk.Treeview(self.top_tracks_frame, columns=columns, show="headings")
+        for column, heading, width in zip(columns, ["#", "Name", "Artist", "Plays", "Rating"], [40, 300, 220, 80, 80]):
+            self.top_tracks_tree.heading(column, text=heading)
+            self.top_tracks_tree.column(column, width=width, anchor="w")
+        self.top_tracks_tree.pack(fill="both", expand=True)
+
+    @timed("gui.refresh_top_tracks")
+    def refresh_top_tracks(self):
+        # Only redraw while the tab is on screen; the library answers from its sorted view
+        if self.notebook.select() != str(self.top_tracks_frame):
+            return
+        top_tracks = self.track_library.top_tracks(int(self.top_tracks_limit.get()), self.top_tracks_criteria.get())
+        self.top_tracks_tree.delete(*self.top_tracks_tree.get_children())
+        for rank, track in enumerate(top_tracks, start=1):
+            self.top_tracks_tree.insert("", "end", values=(rank, track.name, track.artist, track.play_count, track.rating))
+
     def create_playlist(self):
         playlist_name = self.playlist_name_entry.get().strip()
         if not playlist_name:
             messagebox.showerror("Error", "Please enter a playlist name!")
             return
 
-        if playlist_name in self.playlists:
+        if playlist_name in self.playlist_store:
             messagebox.showerror("Error", "Playlist already exists!")
             return
 
-        self.playlists[playlist_name] = []
-
-        playlist_file = os.path.join(PLAYLIST_FOLDER, f"{playlist_name}.csv")
-        try:
-            with open(playlist_file, mode="w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                writer.writerow(["Track ID", "Name", "Artist"])
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to create playlist file: {e}")
-            del self.playlists[playlist_name]
-            return
+        self.playlist_store.create(playlist_name)
+        self.save_playlist_to_file(playlist_name)
 
         self.update_playlist_combobox()
         messagebox.showinfo("Success", f"Playlist '{playlist_name}' created successfully!")
@@ -199,11 +448,8 @@ class TrackPlayerGUI:
             return
 
         try:
-            playlist_file = os.path.join(PLAYLIST_FOLDER, f"{playlist_name}.csv")
-            if os.path.exists(playlist_file):
-                os.remove(playlist_file)
-
-            del self.playlists[playlist_name]
+            self.playlist_store.delete(playlist_name)
+            self.save_playlist_to_file(playlist_name)
             if self.current_playlist_name == playlist_name:
                 self.current_playlist_name = None
                 self.update_playlist_display()
@@ -215,10 +461,8 @@ class TrackPlayerGUI:
             messagebox.showerror("Error", f"Failed to delete playlist: {e}")
 
     def update_playlist_combobox(self):
-        # Reload all playlists from folder to ensure we have the latest data
-        self.load_all_playlists()
-        self.playlist_combobox['values'] = list(self.playlists.keys())
-        if self.current_playlist_name and self.current_playlist_name in self.playlists:
+        self.playlist_combobox['values'] = self.playlist_store.names()
+        if self.current_playlist_name and self.current_playlist_name in self.playlist_store:
             self.playlist_combobox.set(self.current_playlist_name)
         else:
             self.playlist_combobox.set('')
@@ -233,85 +477,94 @@ class TrackPlayerGUI:
         self.current_playlist_name = playlist_name
         self.update_playlist_display()
 
+    @timed("gui.view_tracks")
     def view_tracks(self):
-        for widget in self.tracks_display_frame.winfo_children():
-            widget.destroy()
-
-        for track in self.track_library.list_all():
-            track_frame = ttk.Frame(self.tracks_display_frame, padding=5, relief="flat", borderwidth=1)
-            track_frame.pack(pady=5, fill="x")
-
-            if hasattr(track, "image_path") and track.image_path and os.path.exists(track.image_path):
-                try:
-                    img = Image.open(track.image_path).resize((80, 80), Image.Resampling.LANCZOS)
-                    img_tk = ImageTk.PhotoImage(img)
-                    image_label = ttk.Label(track_frame, image=img_tk)
-                    image_label.image = img_tk
-                    image_label.pack(side="left", padx=10)
-                except Exception as e:
-                    print(f"Error loading image {track.image_path}: {e}")
-                    ttk.Label(track_frame, text="No Image", font=("Arial", 10)).pack(side="left", padx=10)
-            else:
-                ttk.Label(track_frame, text="No Image", font=("Arial", 10)).pack(side="left", padx=10)
-
-            info_frame = ttk.Frame(track_frame)
-            info_frame.pack(side="left", fill="x", expand=True)
-
-            ttk.Label(info_frame, text=f"{track.name}", font=("Arial", 13, "bold")).pack(anchor="w")
-            ttk.Label(info_frame, text=f"by {track.artist}", font=("Arial", 11)).pack(anchor="w")
-
-            track_frame.bind("<Button-1>", lambda e, t=track: self.show_track_details(t))
-            for child in track_frame.winfo_children():
-                child.bind("<Button-1>", lambda e, t=track: self.show_track_details(t))
-
-        self.tracks_display_frame.update_idletasks()
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-
-    def show_track_details(self, track):
-        for widget in self.right_frame.winfo_children():
-            widget.destroy()
+        # A live view in track ID order; the list only looks up the rows on screen
+        self.track_list.set_tracks(self.track_library.sorted_tracks("track_id"))
 
+    def create_details_pane(self):
+        # Built once; show_track_details only changes the labels whose text is different
         details_container = ttk.Frame(self.right_frame, padding=10, relief="flat")
         details_container.pack(fill="both", expand=True)
 
-        if hasattr(track, "image_path") and track.image_path and os.path.exists(track.image_path):
-            try:
-                img = Image.open(track.image_path).resize((150, 150), Image.Resampling.LANCZOS)
-                img_tk = ImageTk.PhotoImage(img)
-                image_label = ttk.Label(details_container, image=img_tk)
-                image_label.image = img_tk
-                image_label.pack(pady=(0, 10))
-            except Exception as e:
-                print(f"Error loading image {track.image_path}: {e}")
-                ttk.Label(details_container, text="No Image", font=("Arial", 10)).pack(pady=(0, 10))
-        else:
-            ttk.Label(details_container, text="No Image", font=("Arial", 10)).pack(pady=(0, 10))
+        self.details_image = ttk.Label(details_container, font=("Arial", 10))
+        self.details_image.pack(pady=(0, 10))
 
         details_frame = ttk.Frame(details_container)
         details_frame.pack(pady=10, fill="x")
 
-        ttk.Label(details_frame, text=f"{track.name}", font=("Arial", 16, "bold")).pack(anchor="w")
-        ttk.Label(details_frame, text=f"Artist: {track.artist}", font=("Arial", 12)).pack(anchor="w")
-        ttk.Label(details_frame, text=f"Rating: {track.rating}/5", font=("Arial", 12)).pack(anchor="w")
-        ttk.Label(details_frame, text=f"Play Count: {track.play_count}", font=("Arial", 12)).pack(anchor="w")
-
-        if hasattr(track, "album") and track.album:
-            ttk.Label(details_frame, text=f"Album: {track.album}", font=("Arial", 12)).pack(anchor="w")
-        if hasattr(track, "release_year") and track.release_year:
-            ttk.Label(details_frame, text=f"Year: {track.release_year}", font=("Arial", 12)).pack(anchor="w")
-        if hasattr(track, "genre") and track.genre:
-            ttk.Label(details_frame, text=f"Genre: {track.genre}", font=("Arial", 12)).pack(anchor="w")
+        self.details_labels = {}
+        fields = ["name", "artist", "rating", "play_count", "recent_plays", "album", "release_year", "genre"]
+        for row, field in enumerate(fields):
+            font = ("Arial", 16, "bold") if field == "name" else ("Arial", 12)
+            self.details_labels[field] = ttk.Label(details_frame, font=font)
+            self.details_labels[field].grid(row=row, column=0, sticky="w")
+        self.details_shown = {}
 
         button_frame = ttk.Frame(details_container)
         button_frame.pack(pady=15)
 
-        ttk.Button(button_frame, text="Play", command=lambda: self.play_track(track)).pack(side="left", padx=5)
-        ttk.Button(button_frame, text="Add to Playlist", command=lambda: self.add_to_playlist(track)).pack(side="left", padx=5)
-        ttk.Button(button_frame, text="Edit Track", command=lambda: self.edit_track(track)).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Play", command=lambda: self.play_track(self.details_track)).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Add to Playlist", command=lambda: self.add_to_playlist(self.details_track)).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Edit Track", command=lambda: self.edit_track(self.details_track)).pack(side="left", padx=5)
+
+    def show_details_image(self, image_path):
+        if image_path:
+            img_tk = self.thumbnails.request(image_path, (150, 150),
+                                             lambda img: self.set_details_image(image_path, img))
+            if img_tk:
+                self.set_details_image(image_path, img_tk)
+        else:
+            self.set_details_image(image_path, None)
+
+    def set_details_image(self, image_path, img_tk):
+        # Another track may be on show by the time a background decode finishes
+        if self.details_shown.get("image_path") != image_path:
+            return
+        if img_tk:
+            self.details_image.configure(image=img_tk, text="")
+        else:
+            self.details_image.configure(image="", text="No Image")
+        self.details_image.image = img_tk
+
+    @timed("gui.show_track_details")
+    def show_track_details(self, track):
+        if self.details_track is None:
+            self.create_details_pane()
+        self.details_track = track
+
+        album = getattr(track, "album", "")
+        release_year = getattr(track, "release_year", 0)
+        genre = getattr(track, "genre", "")
+        shown = {
+            "name": f"{track.name}",
+            "artist": f"Artist: {track.artist}",
+            "rating": f"Rating: {track.rating}/5",
+            "play_count": f"Play Count: {track.play_count}",
+            "recent_plays": f"Plays (last 7 days): {self.track_library.plays_in_last(7, track=track)}",
+            "album": f"Album: {album}" if album else "",
+            "release_year": f"Year: {release_year}" if release_year else "",
+            "genre": f"Genre: {genre}" if genre else "",
+            "image_path": getattr(track, "image_path", ""),
+        }
+        previous, self.details_shown = self.details_shown, shown
+
+        for field, label in self.details_labels.items():
+            text = shown[field]
+            if text == previous.get(field):
+                continue
+            label.configure(text=text)
+            # Album, year and genre are hidden for tracks that don't have them
+            if text:
+                label.grid()
+            else:
+                label.grid_remove()
+        if shown["image_path"] != previous.get("image_path"):
+            self.show_details_image(shown["image_path"])
 
     def play_track(self, track):
-        track.increment_play_count()
-        self.track_library.save_tracks()
+        self.track_library.queue_plays([track.track_id])
+        self.schedule_save()
         self.show_track_details(track)
         messagebox.showinfo("Play Track", f"Playing: {track.name}")
 
@@ -328,7 +581,7 @@ class TrackPlayerGUI:
 
         ttk.Radiobutton(control_frame, text="Select existing playlist:", variable=self.use_existing_playlist, 
                         value=True, command=lambda: self.toggle_playlist_entries(playlist_combobox, new_playlist_entry)).pack(anchor="w")
-        playlist_combobox = ttk.Combobox(control_frame, values=list(self.playlists.keys()), state="readonly", font=("Arial", 11))
+        playlist_combobox = ttk.Combobox(control_frame, values=self.playlist_store.names(), state="readonly", font=("Arial", 11))
         playlist_combobox.pack(fill="x", pady=5)
 
         ttk.Radiobutton(control_frame, text="Create new playlist:", variable=self.use_existing_playlist, 
@@ -353,18 +606,17 @@ class TrackPlayerGUI:
                 if not new_playlist_name:
                     messagebox.showerror("Error", "Please enter new playlist name!")
                     return
-                if new_playlist_name in self.playlists:
+                if new_playlist_name in self.playlist_store:
                     messagebox.showerror("Error", "Playlist already exists!")
                     return
-                self.playlists[new_playlist_name] = []
+                self.playlist_store.create(new_playlist_name)
                 selected_playlist = new_playlist_name
             
-            if track in self.playlists[selected_playlist]:
+            if not self.playlist_store.add(selected_playlist, track.track_id):
                 messagebox.showwarning("Warning", f"'{track.name}' is already in playlist '{selected_playlist}'")
                 add_window.destroy()
                 return
             
-            self.playlists[selected_playlist].append(track)
             self.save_playlist_to_file(selected_playlist)
             
             # Update combobox and select the new playlist
@@ -388,15 +640,9 @@ class TrackPlayerGUI:
             entry.config(state='normal')
 
     def save_playlist_to_file(self, playlist_name):
-        playlist_file = os.path.join(PLAYLIST_FOLDER, f"{playlist_name}.csv")
-        try:
-            with open(playlist_file, mode="w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                writer.writerow(["Track ID", "Name", "Artist"])
-                for track in self.playlists[playlist_name]:
-                    writer.writerow([track.track_id, track.name, track.artist])
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to save playlist: {e}")
+        # Only the changed entries are written; quick successive changes share one write
+        self.io.submit_coalesced(("playlist", playlist_name), self.playlist_store.flush, playlist_name,
+                                 error_callback=lambda e: messagebox.showerror("Error", f"Failed to save playlist: {e}"))
 
     def edit_track(self, track):
         edit_window = tk.Toplevel(self.root)
@@ -466,56 +712,30 @@ class TrackPlayerGUI:
                 return
 
             # All validations passed - save changes
-            track.name = entry_vars["Title:"].get().strip()
-            track.artist = entry_vars["Artist:"].get().strip()
-            track.album = entry_vars["Album:"].get().strip()
-            track.release_year = entry_vars["Release Year:"].get().strip()
-            track.genre = entry_vars["Genre:"].get().strip()
-            track.rating = int(entry_vars["Rating (1-5):"].get())
-
-            self.track_library.save_tracks()
+            self.track_library.edit_track(
+                track,
+                name=entry_vars["Title:"].get().strip(),
+                artist=entry_vars["Artist:"].get().strip(),
+                album=entry_vars["Album:"].get().strip(),
+                release_year=int(release_year) if release_year else 0,
+                genre=entry_vars["Genre:"].get().strip(),
+                rating=int(entry_vars["Rating (1-5):"].get())
+            )
+            self.schedule_save()
+            self.refresh_filter_options()
             self.show_track_details(track)
+            self.track_list.update_track(track)
+            self.update_playlist_display()
             edit_window.destroy()
             messagebox.showinfo("Edit Track", "Track updated successfully!")
 
         ttk.Button(form_frame, text="Save", command=save_changes).grid(row=len(fields), column=1, pady=10, sticky="e")
 
+    @timed("gui.update_playlist_display")
     def update_playlist_display(self):
-        for widget in self.playlist_tracks_frame.winfo_children():
-            widget.destroy()
-
-        if not self.current_playlist_name:
-            return
-
-        for track in self.playlists[self.current_playlist_name]:
-            track_frame = ttk.Frame(self.playlist_tracks_frame, padding=5, relief="flat", borderwidth=1)
-            track_frame.pack(pady=5, fill="x")
-
-            if hasattr(track, "image_path") and track.image_path and os.path.exists(track.image_path):
-                try:
-                    img = Image.open(track.image_path).resize((80, 80), Image.Resampling.LANCZOS)
-                    img_tk = ImageTk.PhotoImage(img)
-                    image_label = ttk.Label(track_frame, image=img_tk)
-                    image_label.image = img_tk
-                    image_label.pack(side="left", padx=10)
-                except Exception as e:
-                    print(f"Error loading image {track.image_path}: {e}")
-                    ttk.Label(track_frame, text="No Image", font=("Arial", 10)).pack(side="left", padx=10)
-            else:
-                ttk.Label(track_frame, text="No Image", font=("Arial", 10)).pack(side="left", padx=10)
-
-            info_frame = ttk.Frame(track_frame)
-            info_frame.pack(side="left", fill="x", expand=True)
-
-            ttk.Label(info_frame, text=f"{track.name}", font=("Arial", 13, "bold")).pack(anchor="w")
-            ttk.Label(info_frame, text=f"by {track.artist}", font=("Arial", 11)).pack(anchor="w")
-
-            button_frame = ttk.Frame(track_frame)
-            button_frame.pack(side="right", padx=10)
-
-            ttk.Button(button_frame, text="Play", command=lambda t=track: self.play_track(t)).pack(side="left", padx=5)
-            ttk.Button(button_frame, text="Remove", command=lambda t=track: self.remove_from_playlist(t)).pack(side="left", padx=5)
-
+        # Rows are kept per track, so only added, removed, moved or edited tracks touch any widgets
+        tracks = self.playlist_tracks(self.current_playlist_name) if self.current_playlist_name else []
+        self.playlist_view.update(tracks)
         self.playlist_tracks_frame.update_idletasks()
         self.playlist_canvas.configure(scrollregion=self.playlist_canvas.bbox("all"))
 
@@ -524,15 +744,14 @@ class TrackPlayerGUI:
             messagebox.showerror("Error", "No playlist selected!")
             return
 
-        playlist = self.playlists[self.current_playlist_name]
+        playlist = self.playlist_tracks(self.current_playlist_name)
         if not playlist:
             messagebox.showerror("Error", "The playlist is empty!")
             return
 
-        for track in playlist:
-            track.increment_play_count()
+        self.track_library.queue_plays(track.track_id for track in playlist)
+        self.schedule_save()
 
-        self.track_library.save_tracks()
         self.update_playlist_display()
         messagebox.showinfo("Play Playlist", "All tracks in the playlist have been played.")
 
@@ -541,7 +760,8 @@ class TrackPlayerGUI:
             messagebox.showerror("Error", "No playlist selected!")
             return
 
-        self.playlists[self.current_playlist_name] = []
+        self.playlist_store.replace(self.current_playlist_name, [])
+        self.save_playlist_to_file(self.current_playlist_name)
         self.update_playlist_display()
 
     def load_playlist(self):
@@ -549,61 +769,66 @@ class TrackPlayerGUI:
             messagebox.showerror("Error", "No playlist selected!")
             return
 
-        playlist_file = os.path.join(PLAYLIST_FOLDER, f"{self.current_playlist_name}.csv")
-        if not os.path.exists(playlist_file):
-            messagebox.showerror("Error", "No playlist file found!")
-            return
+        # Any save still waiting for this playlist goes first so the file is current
+        playlist_name = self.current_playlist_name
+        self.io.run_pending_now(("playlist", playlist_name))
+        self.io.submit(self.playlist_store.reload, playlist_name,
+                       callback=lambda track_ids: self.show_loaded_playlist(playlist_name),
+                       error_callback=self.show_playlist_load_error)
 
-        self.playlists[self.current_playlist_name] = []
-        with open(playlist_file, newline="", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            next(reader)
-            for row in reader:
-                track_id = int(row[0])
-                track = self.track_library.get_track_by_id(track_id)
-                if track:
-                    self.playlists[self.current_playlist_name].append(track)
+    def show_playlist_load_error(self, error):
+        if isinstance(error, FileNotFoundError):
+            messagebox.showerror("Error", "No playlist file found!")
+        else:
+            messagebox.showerror("Error", f"Failed to load playlist: {error}")
 
-        self.update_playlist_display()
+    def show_loaded_playlist(self, playlist_name):
+        if self.current_playlist_name == playlist_name:
+            self.update_playlist_display()
 
     def remove_from_playlist(self, track):
         if not self.current_playlist_name:
             messagebox.showerror("Error", "No playlist selected!")
             return
 
-        if track in self.playlists[self.current_playlist_name]:
-            self.playlists[self.current_playlist_name].remove(track)
+        if self.playlist_store.remove(self.current_playlist_name, track.track_id):
             self.update_playlist_display()
             self.save_playlist_to_file(self.current_playlist_name)
             messagebox.showinfo("Remove from Playlist", f"{track.name} has been removed from the playlist.")
         else:
             messagebox.showinfo("Remove from Playlist", f"{track.name} is not in the playlist.")
 
+    @timed("gui.sort_playlist")
     def sort_playlist(self):
         if not self.current_playlist_name:
             messagebox.showerror("Error", "No playlist selected!")
             return
 
         criteria = self.sort_criteria.get()
-        playlist = self.playlists[self.current_playlist_name]
+        playlist = self.playlist_tracks(self.current_playlist_name)
         if not playlist:
             messagebox.showwarning("Warning", "The playlist is empty!")
             return
 
-        if criteria == "name":
-            playlist.sort(key=lambda x: x.name)
-        elif criteria == "artist":
-            playlist.sort(key=lambda x: x.artist)
-        elif criteria == "rating":
-            playlist.sort(key=lambda x: x.rating, reverse=True)
-        elif criteria == "play_count":
-            playlist.sort(key=lambda x: x.play_count, reverse=True)
-        else:
+        if criteria not in SORT_OPTIONS:
             messagebox.showerror("Error", "Invalid sorting criteria!")
             return
 
+        # A stable sort, so tracks that tie keep their order in the playlist
+        sorted_tracks = sorted(playlist, key=SORT_KEYS[criteria])
+        self.playlist_store.replace(self.current_playlist_name, [track.track_id for track in sorted_tracks])
+        self.save_playlist_to_file(self.current_playlist_name)
         self.update_playlist_display()
 
+    @timed("gui.sort_library")
+    def sort_library(self):
+        self.search_entry.delete(0, tk.END)
+        self.artist_filter.set("All")
+        self.genre_filter.set("All")
+        # A live sorted view: the list only reads the rows it shows
+        self.track_list.set_tracks(self.track_library.sorted_tracks(self.library_sort_criteria.get()))
+
+    @timed("gui.search_tracks")
     def search_tracks(self):
         query = self.search_entry.get().strip().lower()
         if not query:
@@ -611,90 +836,37 @@ class TrackPlayerGUI:
             return
 
         self.artist_filter.set("All")
-        results = [track for track in self.track_library.list_all() if
-                   query in track.name.lower() or query in track.artist.lower()]
-
-        for widget in self.tracks_display_frame.winfo_children():
-            widget.destroy()
-
-        if results:
-            for track in results:
-                track_frame = ttk.Frame(self.tracks_display_frame, padding=5, relief="flat", borderwidth=1)
-                track_frame.pack(pady=5, fill="x")
-
-                if hasattr(track, "image_path") and track.image_path and os.path.exists(track.image_path):
-                    try:
-                        img = Image.open(track.image_path).resize((80, 80), Image.Resampling.LANCZOS)
-                        img_tk = ImageTk.PhotoImage(img)
-                        image_label = ttk.Label(track_frame, image=img_tk)
-                        image_label.image = img_tk
-                        image_label.pack(side="left", padx=10)
-                    except Exception as e:
-                        print(f"Error loading image {track.image_path}: {e}")
-                        ttk.Label(track_frame, text="No Image", font=("Arial", 10)).pack(side="left", padx=10)
-                else:
-                    ttk.Label(track_frame, text="No Image", font=("Arial", 10)).pack(side="left", padx=10)
-
-                info_frame = ttk.Frame(track_frame)
-                info_frame.pack(side="left", fill="x", expand=True)
-
-                ttk.Label(info_frame, text=f"{track.name}", font=("Arial", 13, "bold")).pack(anchor="w")
-                ttk.Label(info_frame, text=f"by {track.artist}", font=("Arial", 11)).pack(anchor="w")
+        self.genre_filter.set("All")
+        if self.track_library.search_index_changes is not None:
+            # Still being indexed in the background; the search runs as soon as it's done
+            self.search_waiting = True
+            return
+        results = self.track_library.search(query, SEARCH_RESULT_LIMIT)
 
-                track_frame.bind("<Button-1>", lambda e, t=track: self.show_track_details(t))
-                for child in track_frame.winfo_children():
-                    child.bind("<Button-1>", lambda e, t=track: self.show_track_details(t))
-        else:
+        self.track_list.set_tracks(results)
+        if not results:
             messagebox.showerror("Error", "No tracks found!")
 
-        self.tracks_display_frame.update_idletasks()
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-
-    def filter_by_artist(self):
+    @timed("gui.filter_tracks")
+    def filter_tracks(self):
         self.search_entry.delete(0, tk.END)
         selected_artist = self.artist_filter.get()
+        selected_genre = self.genre_filter.get()
 
-        for widget in self.tracks_display_frame.winfo_children():
-            widget.destroy()
-
-        if selected_artist == "All":
+        if selected_artist == "All" and selected_genre == "All":
             self.view_tracks()
         else:
-            filtered_tracks = [track for track in self.track_library.list_all() if track.artist == selected_artist]
-            if filtered_tracks:
-                for track in filtered_tracks:
-                    track_frame = ttk.Frame(self.tracks_display_frame, padding=5, relief="flat", borderwidth=1)
-                    track_frame.pack(pady=5, fill="x")
-
-                    if hasattr(track, "image_path") and track.image_path and os.path.exists(track.image_path):
-                        try:
-                            img = Image.open(track.image_path).resize((80, 80), Image.Resampling.LANCZOS)
-                            img_tk = ImageTk.PhotoImage(img)
-                            image_label = ttk.Label(track_frame, image=img_tk)
-                            image_label.image = img_tk
-                            image_label.pack(side="left", padx=10)
-                        except Exception as e:
-                            print(f"Error loading image {track.image_path}: {e}")
-                            ttk.Label(track_frame, text="No Image", font=("Arial", 10)).pack(side="left", padx=10)
-                    else:
-                        ttk.Label(track_frame, text="No Image", font=("Arial", 10)).pack(side="left", padx=10)
-
-                    info_frame = ttk.Frame(track_frame)
-                    info_frame.pack(side="left", fill="x", expand=True)
-
-                    ttk.Label(info_frame, text=f"{track.name}", font=("Arial", 13, "bold")).pack(anchor="w")
-                    ttk.Label(info_frame, text=f"by {track.artist}", font=("Arial", 11)).pack(anchor="w")
-
-                    track_frame.bind("<Button-1>", lambda e, t=track: self.show_track_details(t))
-                    for child in track_frame.winfo_children():
-                        child.bind("<Button-1>", lambda e, t=track: self.show_track_details(t))
-            else:
-                messagebox.showerror("Error", f"No tracks found for artist: {selected_artist}")
-
-        self.tracks_display_frame.update_idletasks()
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+            filtered_tracks = self.track_library.filter_tracks(
+                artist=None if selected_artist == "All" else selected_artist,
+                genre=None if selected_genre == "All" else selected_genre
+            )
+            self.track_list.set_tracks(filtered_tracks)
+            if not filtered_tracks:
+                messagebox.showerror("Error", "No tracks found for the selected filters!")
 
 if __name__ == "__main__":
-    root = ThemedTk(theme="arc")
-    app = TrackPlayerGUI(root)
+    root = tk.Tk()
+    # Use the SQLite library once it has been imported with sqlite_storage.py
+    storage = SqliteStorage() if os.path.exists(DATABASE_FILE) else None
+    app = TrackPlayerGUI(root, storage)
     root.mainloop()
@@ -0,0 +1,108 @@
+import sys
+from array import array
+from library_item import LibraryItem, LibraryItemAlbum
+
+class Column:
+    def __init__(self, name, interned=False):
+        self.name = name
+        self.interned = interned
+
+    def __get__(self, row, owner):
+        if row is None:
+            return self
+        return getattr(row.table, self.name)[row.index]
+
+    def __set__(self, row, value):
+        if self.interned:
+            value = sys.intern(value)
+        getattr(row.table, self.name)[row.index] = value
+
+class TrackRowView:
+    # A lightweight handle onto one row of a TrackTable, usable wherever a LibraryItem is
+    __slots__ = ("table", "index")
+
+    track_id = Column("track_ids")
+    name = Column("names")
+    artist = Column("artists", interned=True)
+    rating = Column("ratings")
+    play_count = Column("play_counts")
+    image_path = Column("image_paths", interned=True)
+    album = Column("albums", interned=True)
+    release_year = Column("release_years")
+    genre = Column("genres", interned=True)
+    track_number = Column("track_numbers")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def get_details(self):
+        if self.album:
+            return LibraryItemAlbum.get_details(self)
+        return LibraryItem.get_details(self)
+
+    def get_album_info(self):
+        return LibraryItemAlbum.get_album_info(self)
+
+    set_rating = LibraryItem.set_rating
+    increment_play_count = LibraryItem.increment_play_count
+
+class TrackTable:
+    # Column-oriented track storage: numbers live in typed arrays and repeated
+    # strings (artists, albums, genres) are interned so each value is stored once.
+    # TrackLibrary doesn't keep its tracks here: track_fields and edit_track tell the
+    # two item kinds apart with isinstance(LibraryItemAlbum), the item classes rely on
+    # __slots__, and callers keep references to the items themselves, none of which a
+    # row view can stand in for. It's used on its own where memory matters more.
+    def __init__(self, tracks=()):
+        self.track_ids = array("q")
+        self.ratings = array("b")
+        self.play_counts = array("q")
+        self.release_years = array("h")
+        self.track_numbers = array("h")
+        self.names = []
+        self.artists = []
+        self.image_paths = []
+        self.albums = []
+        self.genres = []
+        self.rows_by_id = {}
+        for track in tracks:
+            self.add_track(track)
+
+    def add_row(self, track_id, name, artist, rating, play_count=0, image_path="",
+                album="", release_year=0, genre="", track_number=0):
+        self.rows_by_id[track_id] = len(self.track_ids)
+        self.track_ids.append(track_id)
+        self.names.append(name)
+        self.artists.append(sys.intern(artist))
+        self.ratings.append(rating)
+        self.play_counts.append(play_count)
+        self.image_paths.append(sys.intern(image_path))
+        self.albums.append(sys.intern(album))
+        self.release_years.append(release_year)
+        self.genres.append(sys.intern(genre))
+        self.track_numbers.append(track_number)
+        return TrackRowView(self, len(self.track_ids) - 1)
+
+    def add_track(self, track):
+        return self.add_row(track.track_id, track.name, track.artist, track.rating, track.play_count,
+                            track.image_path, getattr(track, "album", ""), getattr(track, "release_year", 0) or 0,
+                            getattr(track, "genre", ""), getattr(track, "track_number", 0) or 0)
+
+    def get_track_by_id(self, track_id):
+        index = self.rows_by_id.get(track_id)
+        return None if index is None else TrackRowView(self, index)
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("track table index out of range")
+        return TrackRowView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield TrackRowView(self, index)
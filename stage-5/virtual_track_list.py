@@ -0,0 +1,137 @@
+from tkinter import ttk
+from instrumentation import timed
+
+ROW_HEIGHT = 100
+OVERSCAN = 3
+IMAGE_SIZE = (80, 80)
+
+class TrackRow:
+    def __init__(self, canvas, on_click):
+        self.track = None
+        self.index = None
+        self.width = None
+        self.shown = {}
+
+        self.frame = ttk.Frame(canvas, padding=5, relief="flat", borderwidth=1)
+        self.image_label = ttk.Label(self.frame, font=("Arial", 10))
+        self.image_label.pack(side="left", padx=10)
+
+        info_frame = ttk.Frame(self.frame)
+        info_frame.pack(side="left", fill="x", expand=True)
+        self.name_label = ttk.Label(info_frame, font=("Arial", 13, "bold"))
+        self.name_label.pack(anchor="w")
+        self.artist_label = ttk.Label(info_frame, font=("Arial", 11))
+        self.artist_label.pack(anchor="w")
+
+        for widget in (self.frame, self.image_label, info_frame, self.name_label, self.artist_label):
+            widget.bind("<Button-1>", lambda e: on_click(self.track))
+
+        self.window = canvas.create_window(0, 0, window=self.frame, anchor="nw", state="hidden")
+
+# Scrollable track list that only builds widgets for the rows on screen. Rows follow
+# their track: after a sort or a search, a track that is still on screen keeps its row
+# and only the labels that differ are changed.
+class VirtualTrackList:
+    def __init__(self, canvas, scrollbar, thumbnails, on_select):
+        self.canvas = canvas
+        self.scrollbar = scrollbar
+        self.thumbnails = thumbnails
+        self.on_select = on_select
+        self.tracks = []
+        self.rows = []
+
+        self.canvas.configure(yscrollcommand=self.on_scroll)
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+
+    def set_tracks(self, tracks, keep_position=False):
+        self.tracks = tracks
+        top = self.canvas.canvasy(0)
+        self.canvas.configure(scrollregion=(0, 0, 0, len(tracks) * ROW_HEIGHT))
+        if keep_position and tracks:
+            self.canvas.yview_moveto(top / (len(tracks) * ROW_HEIGHT))
+        else:
+            self.canvas.yview_moveto(0)
+        self.refresh()
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.refresh()
+
+    @timed("gui.track_list.refresh")
+    def refresh(self):
+        top = self.canvas.canvasy(0)
+        height = self.canvas.winfo_height()
+        width = self.canvas.winfo_width()
+        first = max(0, int(top // ROW_HEIGHT) - OVERSCAN)
+        last = min(len(self.tracks), int((top + height) // ROW_HEIGHT) + 1 + OVERSCAN)
+
+        while len(self.rows) < last - first:
+            self.rows.append(TrackRow(self.canvas, self.on_select))
+
+        # Tracks that are still on screen keep their row; the rest are recycled
+        visible = {index: self.tracks[index] for index in range(first, last)}
+        wanted_ids = {track.track_id for track in visible.values()}
+        rows_by_id = {}
+        free_rows = []
+        for row in self.rows:
+            if row.track is not None and row.track.track_id in wanted_ids and row.track.track_id not in rows_by_id:
+                rows_by_id[row.track.track_id] = row
+            else:
+                free_rows.append(row)
+        for index, track in visible.items():
+            row = rows_by_id.pop(track.track_id, None) or free_rows.pop()
+            self.show_row(row, index, track)
+
+        for row in free_rows:
+            if row.index is not None:
+                row.index = None
+                row.track = None
+                self.canvas.itemconfigure(row.window, state="hidden")
+
+        for row in self.rows:
+            if row.index is not None and row.width != width:
+                row.width = width
+                self.canvas.itemconfigure(row.window, width=width, height=ROW_HEIGHT - 10)
+
+    def update_track(self, track):
+        # Call after a track is edited; only its row, if it's on screen, is touched
+        for row in self.rows:
+            if row.track is not None and row.track.track_id == track.track_id:
+                self.show_row(row, row.index, track)
+
+    def show_row(self, row, index, track):
+        row.track = track
+        shown = {"name": track.name, "artist": track.artist, "image_path": getattr(track, "image_path", "")}
+        previous, row.shown = row.shown, shown
+        if shown["name"] != previous.get("name"):
+            row.name_label.configure(text=f"{track.name}")
+        if shown["artist"] != previous.get("artist"):
+            row.artist_label.configure(text=f"by {track.artist}")
+        if shown["image_path"] != previous.get("image_path"):
+            self.show_image(row, shown["image_path"])
+
+        if row.index != index:
+            if row.index is None:
+                self.canvas.itemconfigure(row.window, state="normal")
+            row.index = index
+            self.canvas.coords(row.window, 0, index * ROW_HEIGHT + 5)
+
+    def show_image(self, row, image_path):
+        row.image_label.configure(image="", text="")
+        row.image_label.image = None
+        if image_path:
+            img_tk = self.thumbnails.request(image_path, IMAGE_SIZE, lambda img: self.set_row_image(row, image_path, img))
+            if img_tk:
+                self.set_row_image(row, image_path, img_tk)
+        else:
+            self.set_row_image(row, image_path, None)
+
+    def set_row_image(self, row, image_path, img_tk):
+        # The row may have been recycled for another track while the cover was decoding
+        if row.shown.get("image_path") != image_path:
+            return
+        if img_tk:
+            row.image_label.configure(image=img_tk, text="")
+        else:
+            row.image_label.configure(image="", text="No Image")
+        row.image_label.image = img_tk